@@ -1,8 +1,9 @@
 import streamlit as st
 import os
-from langchain.llms import OpenAI
-from langchain.chat_models import ChatOpenAI
-from gensysai.designer.system import SystemDesigner
+from functools import partial
+from streamlit_autorefresh import st_autorefresh
+from gensysai.jobs import JobQueue, JobStatus, WorkerPool, openai_designer
+from gensysai.export import components_by_provider
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -37,9 +38,63 @@ st.subheader(f"_{PRODUCT_TAGLINE}_")
 DEFAULT_MESSAGE = 'Design a system that ...'
 
 
-#os.environ["OPENAI_API_KEY"] = open_ai_key
-#llm = ChatOpenAI(temperature=0.1, max_tokens= 512, model_name='gpt-3.5-turbo')
-llm = OpenAI(temperature=0.1, max_tokens=512, model_name='text-davinci-003')
+MODEL_NAME = 'text-davinci-003'
+JOBS_PATH = os.environ.get('GENSYSAI_JOBS_PATH', '.gensysai_jobs.sqlite')
+# 0 when the workers run on their own, see `python main.py --serve`
+WORKERS = int(os.environ.get('GENSYSAI_WORKERS', 2))
+# seconds between two refreshes of the page while its job is unfinished: a running job saves its streamed tokens
+# every 0.5s, see `gensysai.jobs.STREAM_SECONDS`, a queued one only changes once a worker claims it
+POLL_SECONDS = {JobStatus.RUNNING : 0.5, JobStatus.QUEUED : 2.0}
+# designs the provider independent stages once and the others for each provider
+COMPARE_OPTION = 'Compare AWS, Azure and GCP'
+COMPARED_PROVIDERS = ['AWS', 'Azure', 'GCP']
+
+
+# --- SHARED RESOURCES ---
+# created once per server process and reused across reruns and sessions,
+# the designs run in the worker processes so a refresh or a closed tab loses nothing
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    return JobQueue(JOBS_PATH)
+
+
+@st.cache_resource
+def get_worker_pool():
+    if WORKERS == 0:
+        return None
+    return WorkerPool(partial(openai_designer, model_name=MODEL_NAME), path=JOBS_PATH, workers=WORKERS).start()
+
+
+def render_job(queue : JobQueue, job) -> None:
+    design_doc = job.result
+    if design_doc is not None and design_doc.title is not None:
+        st.markdown(f"# {design_doc.title}")
+    st.markdown(f"## Problem Statement\n\n{job.problem_statement}")
+    if design_doc is not None and design_doc.functional_requirement is not None:
+        st.markdown(f"## Functional Requirements\n\n{design_doc.functional_requirement}")
+        for cloud_provider, components in components_by_provider(design_doc):
+            st.markdown("## Components" if cloud_provider is None else f"## Components on {cloud_provider}")
+            for component in components:
+                if component.error is not None:
+                    st.markdown(f"### {component.name}")
+                    st.warning(f"Design could not be generated: {component.error}")
+                else:
+                    st.markdown(f"### {component.name}\n{component.design}")
+
+    if job.status == JobStatus.QUEUED:
+        st.info(f"Queued, {queue.counts().get(JobStatus.QUEUED, 0)} design(s) waiting...", icon="⏳")
+    elif job.status == JobStatus.RUNNING:
+        # the text of the running llm calls, replaced by their section once it completes
+        if job.partial is not None:
+            st.markdown(job.partial + ' ▌')
+        st.info('The generation usually takes some time, please have patience...', icon="ℹ️")
+    elif job.status == JobStatus.FAILED:
+        st.error(job.error)
+
+
+queue = get_job_queue()
+get_worker_pool()
 
 # -- FORM --
 with st.form(key='my_form'): 
@@ -48,19 +103,27 @@ with st.form(key='my_form'):
         problem_statement = st.text_input("Enter the problem statement: ", DEFAULT_MESSAGE,)
         st.markdown(":bulb: `Provide a detailed problem statement for more accurate result.`_``Example: Design a system like uber where an user can book rides``_")
     with col2:
-        cloud_option = st.selectbox('Preferred Cloud Provider', ('Any', 'Azure', 'AWS', 'GCP'))
+        cloud_option = st.selectbox('Preferred Cloud Provider', ('Any', 'Azure', 'AWS', 'GCP', COMPARE_OPTION))
     
     submit = st.form_submit_button(label='Generate')
-    st.info('The generation usually takes some time, please have patience...', icon="ℹ️")
 
 
 if submit and problem_statement != '' and problem_statement != DEFAULT_MESSAGE:
-    
-    designer = SystemDesigner(llm=llm, cloud_provider=cloud_option, verbose=False)
-
-    try:
-        designer.design(problem_statement=problem_statement)
-        st.markdown(designer.generate_markdown())
-    except Exception as e:
-        st.error(e)
-
+    # the same problem submitted again, by anyone, is designed once
+    job_id = queue.submit(problem_statement, COMPARED_PROVIDERS if cloud_option == COMPARE_OPTION else cloud_option)
+    # the job is kept in the URL, a refresh resumes polling it
+    st.experimental_set_query_params(job=job_id)
+else:
+    job_id = st.experimental_get_query_params().get('job', [None])[0]
+
+
+if job_id is not None:
+    # one read of the job per run, through the connection of the shared queue
+    job = queue.get(job_id)
+    if job is None:
+        st.warning("This design does not exist anymore.")
+    else:
+        render_job(queue, job)
+        if job.status not in JobStatus.FINISHED:
+            # the browser reruns the page for the next update, no script thread waits in between
+            st_autorefresh(interval=int(POLL_SECONDS.get(job.status, max(POLL_SECONDS.values())) * 1000), key='poll')
@@ -0,0 +1,49 @@
+'''
+Memory regression benchmark: runs many designs in one long-lived process against a fake LLM
+and asserts that the memory held after the designs stays flat.
+
+    python -m benchmarks.bench_memory --designs 1000
+'''
+import argparse
+import gc
+import sys
+import tracemalloc
+from gensysai.designer.system import SystemDesigner
+from gensysai.designer.ratelimiter import RateLimiter
+from gensysai.fakellm import FakeDesignLLM
+
+
+def measure(designs : int, warmup : int) -> int:
+    """
+    Runs the designs with one designer and returns the growth of traced memory in bytes
+    between the end of the warmup and the end of the run.
+    """
+    designer = SystemDesigner(llm=FakeDesignLLM(), rate_limiter=RateLimiter(requests_per_minute=None, tokens_per_minute=None))
+
+    tracemalloc.start()
+    baseline = 0
+    for i in range(designs):
+        designer.design(f"Design a chat application number {i}")
+        designer.generate_markdown()
+        if i + 1 == warmup:
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+    gc.collect()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return current - baseline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--designs', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--max-growth-kb', type=float, default=256, help="Allowed memory growth after the warmup")
+    args = parser.parse_args()
+
+    growth_kb = measure(args.designs, args.warmup) / 1024
+    print(f"designs : {args.designs}, memory growth after warmup : {growth_kb:.1f} KB")
+    if growth_kb > args.max_growth_kb:
+        print(f"FAILED : memory grew by more than {args.max_growth_kb} KB")
+        sys.exit(1)
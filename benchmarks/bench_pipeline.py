@@ -0,0 +1,171 @@
+'''
+Offline end-to-end benchmark of the design pipeline against the fake LLM.
+Reports throughput, p50/p95 design latency, request counts per prompt and the time spent waiting on the rate limiter.
+
+    python -m benchmarks.bench_pipeline --problems 20 --components 8 --latency 0.2 --jitter 0.1 --concurrency 4
+
+With --stage-max-tokens the responses are truncated at a token budget and continued, and the benchmark fails
+unless the continuations are accounted in the requests of the llm, of the run reports and of the budget.
+'''
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+from gensysai.designer.system import SystemDesigner, DesignEvent
+from gensysai.designer.ratelimiter import RateLimiter
+from gensysai.designer.cache import ResponseCache
+from gensysai.designer.checkpoint import CheckpointStore
+from gensysai.designer.semantic import HashingEmbedder, SemanticCache
+from gensysai.designer.routing import StageModel, STAGES
+from gensysai.designer.budget import TokenBudget
+from gensysai.designer.speculation import SPECULATIVE_TYPES
+from gensysai.fakellm import FakeDesignLLM
+from gensysai.instrumentation import RunReport
+from gensysai.prompts import PromptMode
+
+
+def percentile(values : List[float], percent : float) -> float:
+    ''' Nearest-rank percentile '''
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def design_once(designer : SystemDesigner, problem_statement : str) -> Tuple[float, RunReport]:
+    ''' Designs one problem and returns the wall time in seconds and the run report '''
+    start = time.perf_counter()
+    for event, payload in designer.design_iter(problem_statement):
+        if event == DesignEvent.DONE:
+            return time.perf_counter() - start, payload.run_report
+
+
+def run(args : argparse.Namespace) -> Dict[str, Any]:
+    truncate = args.stage_max_tokens is not None
+    llm = FakeDesignLLM(latency=args.latency, jitter=args.jitter, components=args.components, seed=args.seed, truncate=truncate)
+    token_budget = TokenBudget(stage_max_tokens={stage : args.stage_max_tokens for stage in STAGES}) if truncate else None
+    rate_limiter = RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+    cache = ResponseCache(':memory:') if args.cache else None
+    semantic_cache = SemanticCache(HashingEmbedder(), threshold=args.similarity) if args.similarity is not None else None
+    # the fake components are the same for every problem, kept stages would be reused by every design after the first
+    checkpoints = CheckpointStore() if args.reuse_stages else CheckpointStore(max_entries=0)
+    llms, stage_models = [llm], None
+    if args.light_latency is not None:
+        # title and analysis on a faster model, with its own rate limits
+        light_llm = FakeDesignLLM(latency=args.light_latency, jitter=args.jitter, components=args.components, seed=args.seed,
+                                  model_name='fake-light-llm', truncate=truncate)
+        llms.append(light_llm)
+        light_rate_limiter = RateLimiter(requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+        stage_models = {stage : StageModel(light_llm, rate_limiter=light_rate_limiter) for stage in ('title', 'analyzer')}
+    designer = SystemDesigner(llm=llm,
+                              max_concurrency=args.concurrency,
+                              rate_limiter=rate_limiter,
+                              stage_models=stage_models,
+                              cache=cache,
+                              semantic_cache=semantic_cache,
+                              checkpoints=checkpoints,
+                              token_budget=token_budget,
+                              fuse_title=args.fuse_title,
+                              prompt_mode=args.prompt_mode,
+                              batch_size=args.batch_size,
+                              speculative_types=SPECULATIVE_TYPES if args.speculate else None)
+
+    problems = [f"Design a chat application like WhatsApp, variant {i % args.distinct}" for i in range(args.problems)]
+    if semantic_cache is not None:
+        # the repeats are reformatted, they miss the exact cache but not the semantic one
+        problems = [problem if i < args.distinct else f"{problem.lower()}." for i, problem in enumerate(problems)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda problem: design_once(designer, problem), problems))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+
+    stage_seconds : Dict[str, float] = {}
+    reported_requests, fixes = 0, 0
+    for _, run_report in results:
+        for stage, summary in run_report.by_stage().items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + summary.wall_seconds
+            reported_requests += summary.requests
+            fixes += summary.retries
+
+    request_counts : Dict[str, int] = {}
+    for fake_llm in llms:
+        for prompt, count in fake_llm.request_counts.items():
+            request_counts[prompt] = request_counts.get(prompt, 0) + count
+
+    report = {
+        "problems" : args.problems,
+        "components" : args.components,
+        "elapsed_seconds" : round(elapsed, 4),
+        "throughput_designs_per_second" : round(args.problems / elapsed, 4),
+        "latency_p50_seconds" : round(statistics.median(latencies), 4),
+        "latency_p95_seconds" : round(percentile(latencies, 95), 4),
+        "llm_requests" : sum(fake_llm.total_requests for fake_llm in llms),
+        "llm_requests_by_prompt" : dict(sorted(request_counts.items())),
+        "rate_limiter_wait_seconds" : round(rate_limiter.total_wait_seconds, 4),
+        "stage_wall_seconds" : {stage : round(seconds, 4) for stage, seconds in stage_seconds.items()},
+    }
+    if token_budget is not None:
+        # every request is an output, a continuation of one, or a fix of an output that does not parse
+        outputs = sum(sum(histogram.values()) for histogram in token_budget.histograms().values())
+        continuations = sum(token_budget.continuations().values())
+        report["budget_outputs"] = outputs
+        report["budget_continuations"] = token_budget.continuations()
+        report["budget_truncations"] = token_budget.truncations()
+        report["budget_completion_tokens"] = token_budget.histograms()
+        report["run_report_requests"] = reported_requests
+        report["requests_accounted"] = reported_requests == report["llm_requests"] == outputs + continuations + fixes
+    if cache is not None:
+        report["cache_hits"] = cache.hits
+        report["cache_misses"] = cache.misses
+    if semantic_cache is not None:
+        report["semantic_cache_hits"] = semantic_cache.hits
+        report["semantic_cache_misses"] = semantic_cache.misses
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--problems', type=int, default=10, help="Number of problems to design (N)")
+    parser.add_argument('--components', type=int, default=6, help="Number of components per problem (M)")
+    parser.add_argument('--distinct', type=int, default=10**9, help="Number of distinct problem statements, repeats hit the cache")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds per fake LLM request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Maximum random seconds added per request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=1, help="max_concurrency of the designer")
+    parser.add_argument('--workers', type=int, default=1, help="Problems designed in parallel")
+    parser.add_argument('--rpm', type=int, default=None, help="Requests per minute of the rate limiter, unlimited by default")
+    parser.add_argument('--tpm', type=int, default=None, help="Tokens per minute of the rate limiter, unlimited by default")
+    parser.add_argument('--cache', action='store_true', help="Use an in-memory response cache")
+    parser.add_argument('--reuse-stages', action='store_true', help="Reuse the stages of previous designs with the same inputs")
+    parser.add_argument('--similarity', type=float, default=None, help="Use a semantic cache of the HashingEmbedder with this similarity threshold (1), "
+                        "repeated problems are reformatted")
+    parser.add_argument('--fuse-title', action='store_true')
+    parser.add_argument('--prompt-mode', default=PromptMode.FULL, choices=PromptMode.ALL)
+    parser.add_argument('--batch-size', type=int, default=1, help="Generic components designed per request")
+    parser.add_argument('--speculate', action='store_true', help="Design the stock components while the problems are analyzed")
+    parser.add_argument('--light-latency', type=float, default=None, help="Route the title and the analysis to a second fake LLM with this latency")
+    parser.add_argument('--stage-max-tokens', type=int, default=None, help="Truncate the responses at this token budget of every stage "
+                        "and continue them, the requests have to add up")
+    parser.add_argument('--max-p95', type=float, default=None, help="Fail if the p95 latency exceeds this many seconds")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:32} {value}")
+
+    if report.get("requests_accounted") is False:
+        print(f"FAILED : the llm made {report['llm_requests']} requests, the run reports have {report['run_report_requests']}, "
+              f"the budget {report['budget_outputs']} outputs and {sum(report['budget_continuations'].values())} continuations")
+        sys.exit(1)
+
+    if args.max_p95 is not None and report["latency_p95_seconds"] > args.max_p95:
+        print(f"FAILED : p95 latency {report['latency_p95_seconds']}s exceeds {args.max_p95}s")
+        sys.exit(1)
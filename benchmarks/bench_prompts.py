@@ -0,0 +1,87 @@
+'''
+Prompt tokens of every template in `Prompts`, rendered with a sample input, before and after compaction.
+Tokens are counted with tiktoken if it is installed, otherwise estimated at ~4 characters per token.
+
+    python -m benchmarks.bench_prompts --mode minimal
+'''
+import argparse
+import json
+from typing import Any, Callable, Dict
+from langchain import PromptTemplate
+from langchain.output_parsers import PydanticOutputParser
+from gensysai.prompts import Prompts, PromptMode, compact_prompt
+from gensysai.models import Component, ComponentDesigns, ProblemSummary, ServiceComponent, System
+from gensysai.designer.base import render_component
+from gensysai.designer.ratelimiter import estimate_tokens
+
+PROBLEM_STATEMENT = ("Design a Chat Application like WhatsApp, where an user can send or receive message, "
+                     "create a group with more than 2 people, gets notification when a new message is received.")
+FUNCTIONAL_REQUIREMENTS = ("1. Messaging functionality - allow users to send and receive messages.\n"
+                           "2. Group creation functionality - enable users to create groups.\n"
+                           "3. Notification functionality - notify users of new messages.")
+COMPONENT = Component(name="Message Service", component_type="Service",
+                      description="Responsible for sending, receiving and storing the messages of the users.")
+# components of a batched design, rendered as `GenericComponentDesigner.design_batch` does
+COMPONENTS = [Component(name="Message Cache", component_type="Cache",
+                        description="Caches the recent messages of the active conversations."),
+              Component(name="API Load Balancer", component_type="Load Balancer",
+                        description="Distributes the requests of the clients across the instances of the services.")]
+# output models of the templates with format instructions
+FORMAT_MODELS = {
+    'TitledFunctionalRequirementPrompt' : ProblemSummary,
+    'ComponentIdentifierPrompt' : System,
+    'ServiceComponentDesignerPrompt' : ServiceComponent,
+    'BatchedGenericComponentDesignerPrompt' : ComponentDesigns,
+}
+
+
+def token_counter(model_name : str) -> Callable[[str], int]:
+    try:
+        import tiktoken
+    except ImportError:
+        return estimate_tokens
+    encoding = tiktoken.encoding_for_model(model_name)
+    return lambda text : len(encoding.encode(text))
+
+
+def render(name : str, mode : str) -> str:
+    ''' Renders the template of `Prompts` with the sample inputs, as the operations do '''
+    template = compact_prompt(getattr(Prompts, name), mode)
+    inputs = {
+        'input' : PROBLEM_STATEMENT,
+        'functional_requirements' : FUNCTIONAL_REQUIREMENTS,
+        'component' : render_component(COMPONENT, mode),
+        'components' : '[' + ', '.join(component.compact_str() for component in COMPONENTS) + ']',
+        'cloud_provider' : 'AWS',
+    }
+    if name in FORMAT_MODELS:
+        inputs['format_instructions'] = PydanticOutputParser(pydantic_object=FORMAT_MODELS[name]).get_format_instructions()
+    prompt = PromptTemplate.from_template(template)
+    return prompt.format(**{key : value for key, value in inputs.items() if key in prompt.input_variables})
+
+
+def run(args : argparse.Namespace) -> Dict[str, Any]:
+    count = token_counter(args.model_name)
+    names = [name for name in vars(Prompts) if name.endswith('Prompt')]
+
+    report = {}
+    for name in names:
+        before, after = count(render(name, PromptMode.FULL)), count(render(name, args.mode))
+        report[name] = {"full" : before, args.mode : after, "saved_percent" : round(100 * (before - after) / before, 1)}
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=[PromptMode.COMPACT, PromptMode.MINIMAL], default=PromptMode.COMPACT)
+    parser.add_argument('--model-name', default='gpt-3.5-turbo', help="Model of the tiktoken encoding")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'template':36} {'full':>6} {args.mode:>8} {'saved %':>8}")
+        for name, counts in report.items():
+            print(f"{name:36} {counts['full']:>6} {counts[args.mode]:>8} {counts['saved_percent']:>8}")
@@ -0,0 +1,97 @@
+'''
+Cold start benchmark: import time of the package and the entry points, and the time from interpreter start
+to the first LLM request of a design, against the fake LLM. Every sample runs in a fresh interpreter.
+
+    python -m benchmarks.bench_startup --runs 5
+'''
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['gensysai.designer.system', 'gensysai.export', 'main']
+
+# time from the start of the interpreter to the first request, through construction and the first `design_iter` step
+FIRST_REQUEST = '''
+import time
+start = time.perf_counter()
+from gensysai.designer.system import SystemDesigner
+from gensysai.designer.ratelimiter import RateLimiter
+imported = time.perf_counter()
+from gensysai.fakellm import FakeDesignLLM
+from langchain.callbacks.base import BaseCallbackHandler
+llm_ready = time.perf_counter()
+designer = SystemDesigner(llm=FakeDesignLLM(), rate_limiter=RateLimiter(None, None))
+constructed = time.perf_counter()
+
+class FirstRequest(BaseCallbackHandler):
+    first = None
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        if FirstRequest.first is None:
+            FirstRequest.first = time.perf_counter()
+
+next(designer.design_iter("Design a chat application", callbacks=[FirstRequest()]))
+print(json.dumps({"import_seconds" : imported - start, "llm_seconds" : llm_ready - imported,
+                  "construct_seconds" : constructed - llm_ready, "first_request_seconds" : FirstRequest.first - start}))
+'''
+
+
+def entry_point_imports(path : str) -> str:
+    ''' The top-level import statements of a script, e.g. the imports a streamlit page waits for before rendering '''
+    with open(path) as file:
+        tree = ast.parse(file.read())
+    return '\n'.join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def run_python(code : str) -> str:
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=ROOT))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return result.stdout.strip().splitlines()[-1]
+
+
+def time_import(code : str) -> float:
+    return float(run_python(f"import time\nstart = time.perf_counter()\n{code}\nprint(time.perf_counter() - start)"))
+
+
+def median_of(samples : List[float]) -> float:
+    return round(statistics.median(samples), 4)
+
+
+def run(args : argparse.Namespace) -> Dict[str, Any]:
+    targets = {module : f"import {module}" for module in MODULES}
+    targets['Home.py'] = entry_point_imports(os.path.join(ROOT, 'Home.py'))
+
+    report : Dict[str, Any] = {"import_seconds" : {}}
+    for name, code in targets.items():
+        try:
+            report["import_seconds"][name] = median_of([time_import(code) for _ in range(args.runs)])
+        except RuntimeError as e:
+            # e.g. streamlit is not installed
+            report["import_seconds"][name] = str(e)
+
+    samples = [json.loads(run_python("import json\n" + FIRST_REQUEST)) for _ in range(args.runs)]
+    report["first_request"] = {key : median_of([sample[key] for sample in samples]) for key in samples[0]}
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters per measurement, the median is reported")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, seconds in report["import_seconds"].items():
+            print(f"import {name:32} {seconds}")
+        for name, seconds in report["first_request"].items():
+            print(f"first request {name:25} {seconds}")
@@ -0,0 +1,80 @@
+'''
+Semantic cache check: near-misses, i.e. problems and components differing by a negation, an added clause,
+a name or a number, must not reuse each other's responses, while the same texts reformatted must.
+
+    python -m benchmarks.check_semantic
+    python -m benchmarks.check_semantic --openai    # the default threshold with OpenAI embeddings, needs OPENAI_API_KEY
+'''
+import argparse
+import sys
+from typing import List, Tuple
+from gensysai.designer.semantic import HashingEmbedder, SemanticCache
+
+LONG_PROBLEM = ("Design a chat application like WhatsApp where users can send messages, share media "
+                "and make group calls with up to 100 people, with end to end encryption")
+
+# (cached text, looked up text) pairs that must miss
+NEAR_MISSES : List[Tuple[str, str]] = [
+    # negations
+    ("Design a system where users can pay online", "Design a system where users can pay offline"),
+    ("Design a system where users can pay online", "Design a system where users can not pay online"),
+    (LONG_PROBLEM, LONG_PROBLEM.replace("with end to end", "without end to end")),
+    # added clauses
+    ("User Service. Handles user authentication", "User Service. Handles user authentication and payments"),
+    (LONG_PROBLEM, LONG_PROBLEM + " and payments"),
+    # swapped names and numbers
+    ("Design a ride sharing system like Uber", "Design a ride sharing system like Lyft"),
+    ("Design a URL shortener that stores links for 5 years", "Design a URL shortener that stores links for 10 years"),
+    (LONG_PROBLEM, LONG_PROBLEM.replace("100 people", "1000 people")),
+]
+
+# (cached text, looked up text) pairs that must hit
+REPEATS : List[Tuple[str, str]] = [
+    ("Design a chat application like WhatsApp.", "design a chat application like whatsapp"),
+    ("Design   a chat application, like WhatsApp", "Design a chat application like WhatsApp!"),
+    (LONG_PROBLEM, LONG_PROBLEM.upper()),
+]
+
+
+def hits(cache : SemanticCache, pairs : List[Tuple[str, str]]) -> List[bool]:
+    ''' Whether the second text of each pair reuses the response of the first one '''
+    results = []
+    for cached, looked_up in pairs:
+        cache.clear()
+        cache.set('problem', cached, cached)
+        results.append(cache.get('problem', looked_up) is not None)
+    return results
+
+
+def check(cache : SemanticCache, check_repeats : bool = True) -> List[str]:
+    ''' The failures, one line each '''
+    failures = [f"near-miss hit : {cached!r} -> {looked_up!r}"
+                for (cached, looked_up), hit in zip(NEAR_MISSES, hits(cache, NEAR_MISSES)) if hit]
+    if check_repeats:
+        failures += [f"repeat missed : {cached!r} -> {looked_up!r}"
+                     for (cached, looked_up), hit in zip(REPEATS, hits(cache, REPEATS)) if not hit]
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--openai', action='store_true', help="Check the default threshold with OpenAI embeddings")
+    args = parser.parse_args()
+
+    failures = check(SemanticCache(HashingEmbedder(), threshold=1.0))
+    try:
+        SemanticCache(HashingEmbedder(), threshold=0.99)
+        failures.append("a HashingEmbedder is accepted below threshold 1")
+    except ValueError:
+        pass
+    if args.openai:
+        from langchain.embeddings import OpenAIEmbeddings
+        # rewordings, unlike reformatted texts, are up to the model
+        failures += check(SemanticCache(OpenAIEmbeddings()), check_repeats=False)
+
+    print(f"near-misses : {len(NEAR_MISSES)}, repeats : {len(REPEATS)}, failures : {len(failures)}")
+    for failure in failures:
+        print(failure)
+    if failures:
+        print("FAILED : the semantic cache mixes up distinct texts")
+        sys.exit(1)
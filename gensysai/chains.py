@@ -1,46 +1,279 @@
 from langchain.chains.base import Chain
-from typing import Dict, List, Optional
+from langchain.chains import LLMChain
+from langchain.chat_models.base import BaseChatModel
 from langchain.input import get_color_mapping
+from langchain.prompts.base import StringPromptValue
+from langchain.prompts.chat import ChatPromptValue
+from langchain.schema import AIMessage, Generation, HumanMessage, LLMResult, PromptValue
+from .designer.budget import CONTINUE_INSTRUCTION, TokenBudget, completion_tokens, is_truncated
+from .instrumentation import raise_if_cancelled
+from pydantic import PrivateAttr
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import asyncio
 
 from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
     CallbackManagerForChainRun,
 )
 
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Set
 
 class ComponentIdenfierChain(Chain):
+    '''
+        Runs its chains as a DAG of their input and output keys. A chain starts as soon as the chains
+        producing its input keys are completed, so independent branches run concurrently.
+        With a `chained_input_key`, the chains run in sequence instead, the output of each chain
+        is the `chained_input_key` input of the next one.
+    '''
     chains: List[Chain]
-    chained_input_key: str = 'input'
+    chained_input_key: Optional[str] = 'input'
     output_key: str = 'output'
-    
+    max_concurrency: int = 4
+
+    # indexes of the chains each chain waits for, and the verbose colors, computed once
+    _dependencies: List[Set[int]] = PrivateAttr(default_factory=list)
+    _color_mapping: Dict[str, str] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, **kwargs : Any) -> None:
+        super().__init__(**kwargs)
+        if self.max_concurrency < 1:
+            raise ValueError("max_concurrency should be at least 1")
+        self._dependencies = self.__resolve_dependencies()
+        self._color_mapping = get_color_mapping([str(i) for i in range(len(self.chains))])
+
     @property
     def input_keys(self) -> List[str]:
-        # Union of the input keys of the two chains.
-        all_input_vars = set()
+        if self.chained_input_key is not None:
+            # Union of the input keys of the chains.
+            all_input_vars = set()
+            for chain in self.chains:
+                all_input_vars = all_input_vars.union(set(chain.input_keys))
+            return list(all_input_vars)
+
+        # keys not produced by an earlier chain are the inputs of the DAG
+        input_vars, produced = [], set()
         for chain in self.chains:
-            all_input_vars = all_input_vars.union(set(chain.input_keys))
-        return list(all_input_vars)
+            input_vars += [key for key in chain.input_keys if key not in produced and key not in input_vars]
+            produced.update(chain.output_keys)
+        return input_vars
 
     @property
     def output_keys(self) -> List[str]:
-        return [self.output_key] + [f'chain_{i}' for i in range(len(self.chains))]
+        output_vars = [self.output_key] + [f'chain_{i}' for i in range(len(self.chains))]
+        if self.chained_input_key is None:
+            for chain in self.chains:
+                output_vars += [key for key in chain.output_keys if key not in output_vars]
+        return output_vars
 
-    def _call(self, 
+    def _call(self,
               inputs: Dict[str, str],
               run_manager: Optional[CallbackManagerForChainRun] = None,
         ) -> Dict[str, str]:
-        
-        output = dict()
+
         _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
-        color_mapping = get_color_mapping([str(i) for i in range(len(self.chains))])
+        results : Dict[int, Dict[str, Any]] = {}
+        running = {}
+        # the pool is only created once two branches are ready at the same time
+        executor = None
+        try:
+            while len(results) < len(self.chains):
+                ready = self.__ready(results, running.values())
+                if len(ready) == 1 and not running:
+                    i = ready[0]
+                    results[i] = self.__run(i, self.__chain_inputs(i, inputs, results), _run_manager)
+                    self.__on_chain_end(i, results[i], _run_manager)
+                    continue
+
+                if executor is None:
+                    executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+                for i in ready:
+                    running[executor.submit(self.__run, i, self.__chain_inputs(i, inputs, results), _run_manager)] = i
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    results[i] = future.result()
+                    self.__on_chain_end(i, results[i], _run_manager)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+        return self.__outputs(results)
+
+    async def _acall(self,
+              inputs: Dict[str, str],
+              run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+        ) -> Dict[str, str]:
+
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        results : Dict[int, Dict[str, Any]] = {}
+        running = {}
+        try:
+            while len(results) < len(self.chains):
+                for i in self.__ready(results, running.values()):
+                    running[asyncio.ensure_future(self.__arun(i, self.__chain_inputs(i, inputs, results), _run_manager))] = i
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    i = running.pop(task)
+                    results[i] = task.result()
+                    await _run_manager.on_text(
+                        results[i], color=self._color_mapping[str(i)], end="\n", verbose=self.verbose
+                    )
+        finally:
+            for task in running:
+                task.cancel()
+
+        return self.__outputs(results)
+
+    def __resolve_dependencies(self) -> List[Set[int]]:
+        if self.chained_input_key is not None:
+            return [set() if i == 0 else {i - 1} for i in range(len(self.chains))]
+
+        # each input key comes from the last earlier chain producing it, if any
+        dependencies, producers = [], {}
         for i, chain in enumerate(self.chains):
-            _output = chain.run(inputs, callbacks=_run_manager.get_child())
-            output[f'chain_{i}'] = _output
-            inputs[self.chained_input_key] = _output # set as input for next chain
-            _run_manager.on_text(
-                inputs, color=color_mapping[str(i)], end="\n", verbose=self.verbose
-            )
-            
-        output[self.output_key] = _output
+            dependencies.append({producers[key] for key in chain.input_keys if key in producers})
+            for key in chain.output_keys:
+                producers[key] = i
+        return dependencies
+
+    def __ready(self, results : Dict[int, Any], running) -> List[int]:
+        # chains whose dependencies are completed, within the free concurrency slots
+        running = set(running)
+        ready = [i for i in range(len(self.chains))
+                 if i not in results and i not in running and self._dependencies[i].issubset(results)]
+        return ready[:max(self.max_concurrency - len(running), 0)]
+
+    def __chain_inputs(self, i : int, inputs : Dict[str, Any], results : Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+        # a new dict per chain, the caller's inputs and the outputs of other chains are never mutated
+        chain = self.chains[i]
+        if self.chained_input_key is not None:
+            chain_inputs = {key : inputs[key] for key in chain.input_keys if key in inputs}
+            if i > 0:
+                chain_inputs[self.chained_input_key] = self.__first_output(i - 1, results)
+            return chain_inputs
+
+        values = dict(inputs)
+        for j in sorted(self._dependencies[i]):
+            values.update(results[j])
+        return {key : values[key] for key in chain.input_keys}
+
+    def __run(self, i : int, chain_inputs : Dict[str, Any], run_manager : CallbackManagerForChainRun) -> Dict[str, Any]:
+        return self.chains[i](chain_inputs, return_only_outputs=True, callbacks=run_manager.get_child())
+
+    async def __arun(self, i : int, chain_inputs : Dict[str, Any], run_manager : AsyncCallbackManagerForChainRun) -> Dict[str, Any]:
+        chain = self.chains[i]
+        if type(chain)._acall is Chain._acall:
+            # chains without async support, e.g. a TransformChain, are cheap local steps
+            return chain(chain_inputs, return_only_outputs=True)
+        return await chain.acall(chain_inputs, return_only_outputs=True, callbacks=run_manager.get_child())
+
+    def __on_chain_end(self, i : int, outputs : Dict[str, Any], run_manager : CallbackManagerForChainRun) -> None:
+        run_manager.on_text(
+            outputs, color=self._color_mapping[str(i)], end="\n", verbose=self.verbose
+        )
+
+    def __first_output(self, i : int, results : Dict[int, Dict[str, Any]]) -> Any:
+        return results[i][self.chains[i].output_keys[0]]
+
+    def __outputs(self, results : Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+        output = dict()
+        if self.chained_input_key is None:
+            for i in range(len(self.chains)):
+                output.update(results[i])
+        for i in range(len(self.chains)):
+            output[f'chain_{i}'] = self.__first_output(i, results)
+        output[self.output_key] = self.__first_output(len(self.chains) - 1, results)
         return output
-            
\ No newline at end of file
+
+
+class BudgetedLLMChain(LLMChain):
+    '''
+        LLMChain of an `OpenAIOperation`. With a `token_budget` on the operation, each request gets its `max_tokens` 
+        from the budget and a completion cut at max_tokens is continued instead of regenerated, the continuations go 
+        through the rate limiter of the operation. Without a budget it is a plain LLMChain.
+    '''
+    operation: Any = None
+    # most outputs of a request, e.g. the designs of a batch, the budget of a stage is for one
+    outputs: int = 1
+
+    def generate(self,
+              input_list: List[Dict[str, Any]],
+              run_manager: Optional[CallbackManagerForChainRun] = None,
+        ) -> LLMResult:
+
+        budget = getattr(self.operation, 'token_budget', None)
+        if budget is None:
+            return super().generate(input_list, run_manager=run_manager)
+        prompts, stop = self.prep_prompts(input_list, run_manager=run_manager)
+        callbacks = run_manager.get_child() if run_manager else None
+        return LLMResult(generations=[[self.__complete(budget, prompt, stop, callbacks)] for prompt in prompts])
+
+    async def agenerate(self,
+              input_list: List[Dict[str, Any]],
+              run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+        ) -> LLMResult:
+
+        budget = getattr(self.operation, 'token_budget', None)
+        if budget is None:
+            return await super().agenerate(input_list, run_manager=run_manager)
+        prompts, stop = await self.aprep_prompts(input_list, run_manager=run_manager)
+        callbacks = run_manager.get_child() if run_manager else None
+        return LLMResult(generations=[[await self.__acomplete(budget, prompt, stop, callbacks)] for prompt in prompts])
+
+    def __complete(self, budget : TokenBudget, prompt : PromptValue, stop : Optional[List[str]], callbacks) -> Generation:
+        text, tokens, continuations, request = '', 0, 0, prompt
+        while True:
+            max_tokens = budget.max_tokens(request.to_string(), self.llm, self.operation.stage, self.outputs)
+            llm = budget.llm_for(self.llm, max_tokens)
+            if continuations > 0:
+                raise_if_cancelled(callbacks)
+                self.operation.wait_for_rate_limit(request.to_string(), llm, requests=1)
+            result = llm.generate_prompt([request], stop, callbacks=callbacks)
+            text, tokens = text + result.generations[0][0].text, tokens + completion_tokens(result)
+
+            truncated = is_truncated(result, max_tokens)
+            request = self.__continuation(budget, prompt, text, truncated, continuations)
+            if request is None:
+                break
+            continuations += 1
+        return self.__generation(budget, result, text, tokens, truncated, continuations)
+
+    async def __acomplete(self, budget : TokenBudget, prompt : PromptValue, stop : Optional[List[str]], callbacks) -> Generation:
+        text, tokens, continuations, request = '', 0, 0, prompt
+        while True:
+            max_tokens = budget.max_tokens(request.to_string(), self.llm, self.operation.stage, self.outputs)
+            llm = budget.llm_for(self.llm, max_tokens)
+            if continuations > 0:
+                raise_if_cancelled(callbacks)
+                await self.operation.await_rate_limit(request.to_string(), llm, requests=1)
+            result = await llm.agenerate_prompt([request], stop, callbacks=callbacks)
+            text, tokens = text + result.generations[0][0].text, tokens + completion_tokens(result)
+
+            truncated = is_truncated(result, max_tokens)
+            request = self.__continuation(budget, prompt, text, truncated, continuations)
+            if request is None:
+                break
+            continuations += 1
+        return self.__generation(budget, result, text, tokens, truncated, continuations)
+
+    def __continuation(self, budget : TokenBudget, prompt : PromptValue, text : str, 
+                       truncated : bool, continuations : int) -> Optional[PromptValue]:
+        # the request continuing a truncated completion, None if it is complete or cannot be continued
+        if not truncated or continuations >= budget.max_continuations:
+            return None
+        if isinstance(self.llm, BaseChatModel):
+            request = ChatPromptValue(messages=prompt.to_messages() + [AIMessage(content=text), HumanMessage(content=CONTINUE_INSTRUCTION)])
+        else:
+            # a completion model carries on from the end of its prompt
+            request = StringPromptValue(text=prompt.to_string() + text)
+        if budget.available_tokens(request.to_string(), self.llm) < budget.min_tokens:
+            return None
+        return request
+
+    def __generation(self, budget : TokenBudget, result : LLMResult, text : str, tokens : int, 
+                     truncated : bool, continuations : int) -> Generation:
+        budget.observe(self.operation.stage, tokens, truncated, continuations)
+        generation_info = dict(result.generations[0][0].generation_info or {}, continuations=continuations)
+        return Generation(text=text, generation_info=generation_info)
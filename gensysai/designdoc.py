@@ -1,12 +1,42 @@
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from .instrumentation import RunReport
+
+class DesignEvent:
+    ''' Events yielded by `SystemDesigner.design_iter` '''
+    TITLE = 'title'
+    FUNCTIONAL_REQUIREMENTS = 'functional_requirements'
+    COMPONENT = 'component'
+    DONE = 'done'
+
+class DesignedComponent(BaseModel):
+    '''Represents the design of a single component'''
 
-class DesignedComponent:
     name : str
-    design : str
+    design : Optional[str] = None
+    error : Optional[str] = None
+    # the provider of a design depending on it in a multi-cloud design, see `DesignDocument.cloud_providers`
+    cloud_provider : Optional[str] = None
+
+class DesignRecord(BaseModel):
+    '''Represents the dependencies of a design: the content hash of the inputs of each stage, see `CheckpointStore`'''
+
+    title : Optional[str] = None
+    analysis : Optional[str] = None
+    components : List[str] = Field(default_factory=list)
+    # stages taken from a previous design with the same inputs
+    reused : List[str] = Field(default_factory=list)
+    # components designed from the problem statement during the analysis, those in `components` were reused
+    speculated : List[str] = Field(default_factory=list)
 
-class DesignDocument:
-    title : str
-    problem_statement : str
-    functional_requirement: str
-    components : List[DesignedComponent] = []
+class DesignDocument(BaseModel):
+    '''Represents the design of a system, serializable with `.json()` and `DesignDocument.parse_raw`'''
 
+    title : Optional[str] = None
+    problem_statement : Optional[str] = None
+    functional_requirement : Optional[str] = None
+    components : List[DesignedComponent] = Field(default_factory=list)
+    # the providers compared by a multi-cloud design, empty for a single provider
+    cloud_providers : List[str] = Field(default_factory=list)
+    run_report : Optional[RunReport] = None
+    dependencies : Optional[DesignRecord] = None
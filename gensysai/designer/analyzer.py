@@ -1,58 +1,176 @@
-from langchain.llms import BaseLLM
-from ..models import System
-from langchain.output_parsers import PydanticOutputParser
-from langchain import PromptTemplate, LLMChain
-from ..prompts import Prompts
-from ..chains import ComponentIdenfierChain
+from __future__ import annotations
+from ..models import System, ProblemSummary
+from ..prompts import Prompts, PromptMode, compact_prompt
 from .openaioperation import OpenAIOperation
+from .retry import FixableOutputError, OutputFixer
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, Tuple
+
+if TYPE_CHECKING:
+    from langchain import PromptTemplate
+    from langchain.llms import BaseLLM
+    from langchain.output_parsers import PydanticOutputParser
+    from langchain.callbacks.manager import Callbacks
+    from ..chains import ComponentIdenfierChain
 
 class ProblemAnalyzer(OpenAIOperation):
     '''Given a problem statement declaring a system to be designed
     , it analyzes and identifies the components of the systems'''
 
+    stage = 'analyzer'
+
     def __init__(self, 
             llm : BaseLLM,
-            verbose : bool = False) -> None:
+            verbose : bool = False,
+            with_title : bool = False,
+            prompt_mode : str = PromptMode.FULL) -> None:
+        """
+        Initialize the ProblemAnalyzer object.
+
+        Args:
+            llm (BaseLLM): The BaseLLM object. \n
+            verbose (bool, optional): Verbose mode flag. Defaults to False. \n
+            with_title (bool, optional): Generates the title of the system along with the functional requirements 
+                in the same request, see `analyze_with_title`. Defaults to False. \n
+            prompt_mode (str, optional): One of `PromptMode.ALL`, see `compact_prompt`. Defaults to `PromptMode.FULL`. \n
+        """
         self.llm = llm
         self.verbose = verbose
-        self.__parser : PydanticOutputParser = PydanticOutputParser(pydantic_object=System)
-        self.__build_chain()
+        self.with_title = with_title
+        self.prompt_mode = prompt_mode
+
+    # the parsers, prompts and chains are built on the first analysis, LangChain is only imported then
+
+    @cached_property
+    def __parser(self) -> PydanticOutputParser:
+        from langchain.output_parsers import PydanticOutputParser
+        return PydanticOutputParser(pydantic_object=System)
+
+    @cached_property
+    def __summary_parser(self) -> PydanticOutputParser:
+        from langchain.output_parsers import PydanticOutputParser
+        return PydanticOutputParser(pydantic_object=ProblemSummary)
+
+    @cached_property
+    def __fixer(self) -> OutputFixer:
+        return OutputFixer(llm=self.llm, format_instructions=self.__parser.get_format_instructions())
 
+    @cached_property
+    def __summary_fixer(self) -> OutputFixer:
+        return OutputFixer(llm=self.llm, format_instructions=self.__summary_parser.get_format_instructions())
 
-    def __build_chain(self) -> None:
+    @cached_property
+    def __prompt_functional_requirement(self) -> PromptTemplate:
+        from langchain import PromptTemplate
+        if self.with_title:
+            # title and functional requirements in one structured output
+            return PromptTemplate(template=compact_prompt(Prompts.TitledFunctionalRequirementPrompt, self.prompt_mode), 
+                                input_variables=["input"],
+                                partial_variables={"format_instructions": self.__summary_parser.get_format_instructions()})
+        return PromptTemplate(template=compact_prompt(Prompts.FunctionalRequirementPrompt, self.prompt_mode), 
+                                input_variables=["input"])
+
+    @cached_property
+    def __prompt_component_identify(self) -> PromptTemplate:
+        from langchain import PromptTemplate
+        return PromptTemplate(template=compact_prompt(Prompts.ComponentIdentifierPrompt, self.prompt_mode), 
+                        input_variables=["functional_requirements"],
+                        partial_variables={"format_instructions": self.__parser.get_format_instructions()}
+                    )
+
+    @cached_property
+    def combined_chain(self) -> ComponentIdenfierChain:
+        from langchain.chains import TransformChain
+        from ..chains import BudgetedLLMChain, ComponentIdenfierChain
         
         # chain for functional requirement identification
-        __prompt_functional_requirement = PromptTemplate(template=Prompts.FunctionalRequirementPrompt, 
-                                input_variables=["input"])
-        self.__chain_func_requirement = LLMChain(prompt=__prompt_functional_requirement,
+        chain_func_requirement = BudgetedLLMChain(prompt=self.__prompt_functional_requirement,
                                 llm= self.llm,
-                                verbose=self.verbose)
+                                output_key="summary" if self.with_title else "functional_requirements",
+                                verbose=self.verbose, operation=self)
+        chains = [chain_func_requirement]
+
+        if self.with_title:
+            # only the functional requirements are passed on to the component identification
+            chains.append(TransformChain(input_variables=["summary"], 
+                                output_variables=["functional_requirements"],
+                                transform=lambda inputs: {"functional_requirements" : self.__functional_requirements(inputs["summary"])}))
         
 
         # Chain for component identification
-        __prompt_component_identify = PromptTemplate(template=Prompts.ComponentIdentifierPrompt, 
-                        input_variables=["input"],
-                        partial_variables={"format_instructions": self.__parser.get_format_instructions()}
-                    )
-        self.__chain_component_identify = LLMChain(prompt=__prompt_component_identify,
+        chain_component_identify = BudgetedLLMChain(prompt=self.__prompt_component_identify,
                                     llm = self.llm,
-                                    verbose= self.verbose)
+                                    output_key="system",
+                                    verbose= self.verbose, operation=self)
         
 
-        # Component idenfication chain
-        self.combined_chain = ComponentIdenfierChain(
-                        chains=[self.__chain_func_requirement, self.__chain_component_identify], 
-                        chained_input_key='input', 
+        # Component idenfication chain, the chains are wired by their input and output keys
+        chains.append(chain_component_identify)
+        return ComponentIdenfierChain(
+                        chains=chains, 
+                        chained_input_key=None, 
                         verbose=self.verbose)
 
 
-    def analyze(self, problem : str) -> System:
+    def analyze(self, problem : str, callbacks : Callbacks = None) -> System:
+        
+        return self.analyze_with_title(problem, callbacks=callbacks)[1]
+
+    def analyze_with_title(self, problem : str, callbacks : Callbacks = None) -> Tuple[str, System]:
+        """
+        Analyzes the problem statement.
+
+        Args:
+            problem (str): The problem statement.
+            callbacks (Callbacks, optional): LangChain callbacks passed to the LLM calls.
+
+        Returns:
+            Tuple[str, System]: The title, None unless the analyzer is created `with_title`, and the analyzed system.
+        """
+        # both chained requests are accounted upfront, the second prompt embeds the first output
+        prompt = self.__prompt_functional_requirement.format(input=problem) + self.__prompt_component_identify.template
+        return self._cached_call(prompt, self.llm, 
+                                 lambda callbacks: self.combined_chain(problem, return_only_outputs=True, callbacks=callbacks),
+                                 parser=self.__parse, callbacks=callbacks,
+                                 fixer=self.__fixer, fix_key='output', similar=self.__similar(problem))
+
+    async def aanalyze(self, problem : str, callbacks : Callbacks = None) -> System:
         
-        analyzed_output = self.combined_chain(problem, return_only_outputs=True)
+        return (await self.aanalyze_with_title(problem, callbacks=callbacks))[1]
+
+    async def aanalyze_with_title(self, problem : str, callbacks : Callbacks = None) -> Tuple[str, System]:
+        ''' Same as `analyze_with_title` without blocking the event loop '''
+        prompt = self.__prompt_functional_requirement.format(input=problem) + self.__prompt_component_identify.template
+        return await self._acached_call(prompt, self.llm, 
+                                 lambda callbacks: self.combined_chain.acall(problem, return_only_outputs=True, callbacks=callbacks),
+                                 parser=self.__parse, callbacks=callbacks,
+                                 fixer=self.__fixer, fix_key='output', similar=self.__similar(problem))
+
+    def __similar(self, problem : str) -> Tuple[str, str]:
+        # a reworded problem statement reuses the analysis made with the same prompts
+        return self.__prompt_functional_requirement.template + self.__prompt_component_identify.template, problem
+
+    def __functional_requirements(self, summary : str) -> str:
+        from langchain.schema import OutputParserException
+        try:
+            return self.__summary_parser.parse(summary).functional_requirements
+        except OutputParserException:
+            # the raw summary still states the requirements, it is fixed along with the analysis by `__parse`
+            return summary
+
+    def __parse(self, analyzed_output : Dict[str, str]) -> Tuple[str, System]:
         designed_system = self.__parser.parse(analyzed_output['output'])
-        designed_system.functional_requirements = analyzed_output['chain_0']
+        if not self.with_title:
+            designed_system.functional_requirements = analyzed_output['chain_0']
+            return None, designed_system
 
-        return designed_system
+        from langchain.schema import OutputParserException
+        try:
+            summary = self.__summary_parser.parse(analyzed_output['chain_0'])
+        except OutputParserException as e:
+            raise FixableOutputError(e, 'chain_0', self.__summary_fixer) from e
+        designed_system.functional_requirements = summary.functional_requirements
+        return summary.title, designed_system
     
     def get_request_count(self):
         return 2
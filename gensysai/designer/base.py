@@ -1,13 +1,145 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import TYPE_CHECKING, Dict, Any, FrozenSet, List, Tuple, Union
 from ..models import Component
+from ..prompts import PromptMode
+from functools import partial
+import asyncio
+import json
+if TYPE_CHECKING:
+    from langchain.callbacks.manager import Callbacks
 
+CLOUD_PROVIDERS = frozenset(['AWS', 'Azure', 'GCP', 'Any'])
+
+def validate_cloud_provider(cloud_provider : str) -> None:
+    if cloud_provider not in CLOUD_PROVIDERS:
+        raise ValueError("Cloud Provider should be from ['AWS', 'Azure', 'GCP', 'Any']")
+
+def render_component(component : Component, prompt_mode : str = PromptMode.FULL) -> str:
+    ''' The component as given to a designer prompt '''
+    return str(component) if prompt_mode == PromptMode.FULL else component.compact_str()
+
+def similarity_key(component : Component, *context : Any) -> Tuple[str, str]:
+    ''' (context, text) of a component for the semantic cache, the type and context must match while name and description may be reworded '''
+    return json.dumps([component.component_type, *context], sort_keys=True, default=str), f"{component.name}. {component.description}"
 
 class BaseComponentDesigner(ABC):
     ''' Abstract class for Component Designer '''
+
+    # components designed together by `design_batch`, see `SystemDesigner`
+    batch_size : int = 1
+    # whether the designs depend on the cloud provider, the others are reused after a change of provider, see `CheckpointStore`
+    uses_cloud_provider : bool = True
+    # additional inputs to be provided with every design
+    required_inputs : FrozenSet[str] = frozenset()
+
+    def supports(self, component_type : str) -> bool:
+        ''' Whether the designer can design components of the type, checked once when registered, see `DesignerRegistry` '''
+        return True
+
+    def validate(self, component : Component, cloud_provider : str = 'Any', additional_input : Dict[str,str] = None) -> None:
+        """
+        Checks the inputs of a design, the guard of the public entry points. The designs dispatched through a `DesignerRegistry` 
+        skip it: the designer was checked when registered, and the cloud provider by the `SystemDesigner`.
+
+        Args:
+            component (Component): The component to be designed.
+            cloud_provider (str, optional): The cloud provider. Defaults to 'Any'.
+            additional_input (Dict[str,str], optional): Additional inputs of the designer. Defaults to None.
+        """
+        if not self.supports(component.component_type):
+            raise ValueError(f"{type(self).__name__} can not design {component.component_type} components")
+        validate_cloud_provider(cloud_provider)
+        for var in self.required_inputs:
+            if additional_input is None or var not in additional_input:
+                raise ValueError(f"input {var} is not provided.")
+
     @abstractmethod
     def design(self, 
                component : Component, 
                cloud_provider : str = 'Any',
-               additional_input : Dict[str,str] = None) -> Any:
-        pass
\ No newline at end of file
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> Any:
+        pass
+
+    async def adesign(self, 
+               component : Component, 
+               cloud_provider : str = 'Any',
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> Any:
+        ''' Async design, runs the blocking `design` in the default executor unless overridden '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(self.design, component=component, cloud_provider=cloud_provider,
+                                                        additional_input=additional_input, callbacks=callbacks))
+
+    def _design(self, 
+               component : Component, 
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> Any:
+        ''' `design` without the checks of `validate`, the dispatch path of a `DesignerRegistry` '''
+        return self.design(component=component, cloud_provider=cloud_provider, additional_input=additional_input, callbacks=callbacks)
+
+    async def _adesign(self, 
+               component : Component, 
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> Any:
+        ''' Async version of `_design` '''
+        return await self.adesign(component=component, cloud_provider=cloud_provider, additional_input=additional_input, callbacks=callbacks)
+
+    def design_batch(self, 
+               components : List[Component], 
+               cloud_provider : str = 'Any',
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> List[Union[Any, Exception]]:
+        """
+        Designs several components, one `design` each unless the designer batches them into fewer requests.
+
+        Args:
+            components (List[Component]): The components to be designed.
+            cloud_provider (str, optional): The cloud provider. Defaults to 'Any'.
+            additional_input (Dict[str,str], optional): Additional inputs of the designer. Defaults to None.
+            callbacks (Callbacks, optional): LangChain callbacks passed to the LLM calls.
+
+        Returns:
+            List[Union[Any, Exception]]: The design, or the error, of each component in the given order.
+        """
+        for component in components:
+            self.validate(component, cloud_provider, additional_input)
+        return self._design_batch(components, cloud_provider, additional_input, callbacks)
+
+    async def adesign_batch(self, 
+               components : List[Component], 
+               cloud_provider : str = 'Any',
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> List[Union[Any, Exception]]:
+        ''' Async version of `design_batch`, the components are designed concurrently '''
+        for component in components:
+            self.validate(component, cloud_provider, additional_input)
+        return await self._adesign_batch(components, cloud_provider, additional_input, callbacks)
+
+    def _design_batch(self, 
+               components : List[Component], 
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> List[Union[Any, Exception]]:
+        ''' `design_batch` without the checks of `validate`, the dispatch path of a `DesignerRegistry` '''
+        designs = []
+        for component in components:
+            try:
+                designs.append(self._design(component=component, cloud_provider=cloud_provider,
+                                            additional_input=additional_input, callbacks=callbacks))
+            except Exception as e:
+                designs.append(e)
+        return designs
+
+    async def _adesign_batch(self, 
+               components : List[Component], 
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> List[Union[Any, Exception]]:
+        ''' Async version of `_design_batch` '''
+        return await asyncio.gather(*[self._adesign(component=component, cloud_provider=cloud_provider,
+                                                    additional_input=additional_input, callbacks=callbacks)
+                                      for component in components], return_exceptions=True)
@@ -0,0 +1,67 @@
+from threading import Lock
+from typing import Iterator, Set, Tuple
+import json
+import os
+import re
+
+PROBLEM_ID_KEYS = ['id', 'request_id', 'problem_id']
+PROBLEM_STATEMENT_KEYS = ['problem_statement', 'problem', 'body']
+
+
+def read_problems(path : str) -> Iterator[Tuple[str, str]]:
+    """
+    Streams problem statements from a JSONL file, one JSON object per line.
+    The statement is read from `problem_statement`, `problem` or `body` and the id
+    from `id`, `request_id` or `problem_id`, falling back to the line number.
+
+    Args:
+        path (str): Path of the JSONL file.
+
+    Returns:
+        Iterator[Tuple[str, str]]: (problem id, problem statement) pairs.
+    """
+    with open(path, 'r') as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if line == '':
+                continue
+
+            record = json.loads(line)
+            problem_statement = next((record[key] for key in PROBLEM_STATEMENT_KEYS if key in record), None)
+            if problem_statement is None:
+                raise ValueError(f"Line {line_number} of {path} has no problem statement, expected one of {PROBLEM_STATEMENT_KEYS}")
+            problem_id = next((str(record[key]) for key in PROBLEM_ID_KEYS if key in record), f"{line_number:05d}")
+            yield problem_id, problem_statement
+
+
+def safe_filename(name : str) -> str:
+    ''' Turns a problem id into a file name '''
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('._') or 'design'
+
+
+class BatchCheckpoint:
+    '''
+        Records the completed problems of a batch in an append-only file,
+        so that an interrupted batch can be resumed.
+    '''
+
+    def __init__(self, path : str) -> None:
+        self.path = path
+        self.__lock = Lock()
+        self.__completed : Set[str] = set()
+
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.__completed = set(line.strip() for line in file if line.strip() != '')
+
+    def is_completed(self, problem_id : str) -> bool:
+        return problem_id in self.__completed
+
+    def mark_completed(self, problem_id : str) -> None:
+        with self.__lock:
+            self.__completed.add(problem_id)
+            with open(self.path, 'a') as file:
+                file.write(problem_id + '\n')
+
+    def __len__(self) -> int:
+        return len(self.__completed)
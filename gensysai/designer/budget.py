@@ -0,0 +1,234 @@
+from __future__ import annotations
+from .ratelimiter import estimate_tokens
+from .routing import with_max_tokens
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from langchain.llms import BaseLLM
+    from langchain.schema import LLMResult
+
+# context windows of the OpenAI models, prompt and completion tokens together
+CONTEXT_WINDOWS = {
+    'gpt-4' : 8192,
+    'gpt-4-32k' : 32768,
+    'gpt-3.5-turbo' : 4096,
+    'gpt-3.5-turbo-16k' : 16384,
+    'text-davinci-003' : 4097,
+    'text-davinci-002' : 4097,
+    'code-davinci-002' : 8001,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# completion tokens of the longest output expected from each stage, see `routing.STAGES`,
+# used unless the llm of the stage has its own max_tokens
+STAGE_MAX_TOKENS = {
+    'title' : 32,
+    'analyzer' : 1024,
+    'storage' : 1024,
+    'service' : 1024,
+    'generic' : 768,
+}
+
+# finish reason of a completion cut at max_tokens
+LENGTH = 'length'
+CONTINUE_INSTRUCTION = "Continue exactly where your previous answer stopped, without repeating any of it."
+
+
+def is_truncated(result : LLMResult, max_tokens : int = None) -> bool:
+    """
+    Whether the completion of a single prompt was cut at max_tokens.
+
+    Args:
+        result (LLMResult): The result of the request.
+        max_tokens (int, optional): max_tokens of the request, for the llms reporting no finish reason.
+
+    Returns:
+        bool: True if the completion is incomplete.
+    """
+    generation = result.generations[0][0]
+    finish_reason = (generation.generation_info or {}).get('finish_reason')
+    if finish_reason is not None:
+        return finish_reason == LENGTH
+    # chat models report no finish reason, a completion using all of max_tokens was most likely cut
+    usage = (result.llm_output or {}).get('token_usage') or {}
+    return max_tokens is not None and usage.get('completion_tokens', 0) >= max_tokens
+
+
+def completion_tokens(result : LLMResult) -> int:
+    ''' Completion tokens of a result, estimated if the llm reports no usage '''
+    usage = (result.llm_output or {}).get('token_usage') or {}
+    if 'completion_tokens' in usage:
+        return usage['completion_tokens']
+    return sum(estimate_tokens(generation.text) for generations in result.generations for generation in generations)
+
+
+class TokenBudget:
+    '''
+        Picks the `max_tokens` of every request from its stage and the room its prompt leaves in the context window
+        of the model, instead of one global value that truncates long designs and wastes rate budget on short ones.
+        A completion cut at max_tokens is continued up to `max_continuations` times rather than regenerated.
+        The completion tokens of every stage are collected in histograms, to tune the budgets from data.
+    '''
+
+    def __init__(self,
+            stage_max_tokens : Dict[str, int] = None,
+            context_windows : Dict[str, int] = None,
+            min_tokens : int = 64,
+            max_continuations : int = 2,
+            bucket_tokens : int = 64
+            ) -> None:
+        """
+        Initialize the TokenBudget object.
+
+        Args:
+            stage_max_tokens (Dict[str, int], optional): Completion tokens of an output by stage, over any other max_tokens. 
+                Defaults to None, a max_tokens set on the llm of the stage (e.g. by a `StageModel`) or else `STAGE_MAX_TOKENS`. \n
+            context_windows (Dict[str, int], optional): Context windows by model name, on top of `CONTEXT_WINDOWS`. Defaults to None. \n
+            min_tokens (int, optional): A prompt leaving fewer tokens than this in the context window is an error. Defaults to 64. \n
+            max_continuations (int, optional): Requests continuing a truncated completion, 0 to keep it truncated. Defaults to 2. \n
+            bucket_tokens (int, optional): Width of the buckets of the histograms. Defaults to 64. \n
+        """
+        if min_tokens < 1:
+            raise ValueError("min_tokens should be at least 1")
+        if max_continuations < 0:
+            raise ValueError("max_continuations should not be negative")
+        if bucket_tokens < 1:
+            raise ValueError("bucket_tokens should be at least 1")
+        self.stage_max_tokens = dict(stage_max_tokens or {})
+        self.context_windows = dict(CONTEXT_WINDOWS, **(context_windows or {}))
+        self.min_tokens = min_tokens
+        self.max_continuations = max_continuations
+        self.bucket_tokens = bucket_tokens
+
+        self.__lock = Lock()
+        self.__histograms : Dict[str, Dict[int, int]] = {}
+        self.__truncations : Dict[str, int] = {}
+        self.__continuations : Dict[str, int] = {}
+        # (id of the llm, max_tokens) -> (llm, copy with the max_tokens), the llm is kept so that its id is not reused
+        self.__llms : Dict[Tuple[int, int], Tuple[Any, Any]] = {}
+
+    def context_window(self, llm : BaseLLM) -> int:
+        ''' Context window of the model of the llm, a dated or fine-tuned model has the window of its base model '''
+        model_name = getattr(llm, 'model_name', None) or ''
+        if model_name in self.context_windows:
+            return self.context_windows[model_name]
+        for name in sorted(self.context_windows, key=len, reverse=True):
+            if model_name.startswith(name):
+                return self.context_windows[name]
+        return DEFAULT_CONTEXT_WINDOW
+
+    def available_tokens(self, prompt : str, llm : BaseLLM) -> int:
+        ''' Tokens the prompt leaves in the context window '''
+        # the estimate is rough, a tenth of the prompt is kept as margin
+        return self.context_window(llm) - estimate_tokens(prompt) * 11 // 10
+
+    def stage_tokens(self, llm : BaseLLM, stage : str, outputs : int = 1) -> Optional[int]:
+        """
+        Completion tokens of the requests of a stage, regardless of their prompt.
+
+        Args:
+            llm (BaseLLM): The llm of the stage.
+            stage (str): The stage of the operation, see `OpenAIOperation.stage`.
+            outputs (int, optional): Outputs of each request, e.g. the designs of a batch. Defaults to 1.
+
+        Returns:
+            int: `stage_max_tokens` per output, else the max_tokens set on the llm, else `STAGE_MAX_TOKENS` per output, 
+                else the default max_tokens of the llm. None if there is none.
+        """
+        if stage in self.stage_max_tokens:
+            return self.stage_max_tokens[stage] * outputs
+        max_tokens = getattr(llm, 'max_tokens', None)
+        # a max_tokens given to the llm, or to its `StageModel`, is meant for the stage
+        if max_tokens is not None and 'max_tokens' in getattr(llm, '__fields_set__', ()):
+            return max_tokens
+        if stage in STAGE_MAX_TOKENS:
+            return STAGE_MAX_TOKENS[stage] * outputs
+        return max_tokens
+
+    def max_tokens(self, prompt : str, llm : BaseLLM, stage : str, outputs : int = 1) -> int:
+        """
+        Completion tokens of a request.
+
+        Args:
+            prompt (str): The prompt of the request.
+            llm (BaseLLM): The llm of the request.
+            stage (str): The stage of the operation, see `OpenAIOperation.stage`.
+            outputs (int, optional): Outputs of the request, e.g. the designs of a batch. Defaults to 1.
+
+        Returns:
+            int: The tokens of the stage, see `stage_tokens`, within the room left by the prompt. 
+                Raises a ValueError if it is less than `min_tokens`.
+        """
+        available = self.available_tokens(prompt, llm)
+        if available < self.min_tokens:
+            raise ValueError(f"The {stage} prompt leaves {max(available, 0)} tokens in the context window of "
+                             f"{getattr(llm, 'model_name', type(llm).__name__)}, at least {self.min_tokens} are needed")
+        return min(self.stage_tokens(llm, stage, outputs) or available, available)
+
+    def llm_for(self, llm : BaseLLM, max_tokens : int) -> BaseLLM:
+        ''' The llm with the given `max_tokens`, copies are reused '''
+        if getattr(llm, 'max_tokens', None) == max_tokens:
+            return llm
+        key = (id(llm), max_tokens)
+        with self.__lock:
+            cached = self.__llms.get(key)
+        if cached is not None and cached[0] is llm:
+            return cached[1]
+
+        copy = with_max_tokens(llm, max_tokens)
+        with self.__lock:
+            # long prompts get many distinct values, the copies are cheap to make again
+            if len(self.__llms) >= 256:
+                self.__llms.clear()
+            self.__llms[key] = (llm, copy)
+        return copy
+
+    def observe(self, stage : str, tokens : int, truncated : bool = False, continuations : int = 0) -> None:
+        ''' Records the completion tokens of an output of the stage and the requests continuing it, continuations included '''
+        bucket = -(-max(tokens, 1) // self.bucket_tokens) * self.bucket_tokens
+        with self.__lock:
+            histogram = self.__histograms.setdefault(stage, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+            if truncated:
+                self.__truncations[stage] = self.__truncations.get(stage, 0) + 1
+            if continuations > 0:
+                self.__continuations[stage] = self.__continuations.get(stage, 0) + continuations
+
+    def histograms(self) -> Dict[str, Dict[int, int]]:
+        ''' Outputs per bucket of completion tokens by stage, a bucket is keyed by its upper bound '''
+        with self.__lock:
+            return {stage : dict(sorted(histogram.items())) for stage, histogram in self.__histograms.items()}
+
+    def truncations(self) -> Dict[str, int]:
+        ''' Outputs still truncated after `max_continuations`, by stage '''
+        with self.__lock:
+            return dict(self.__truncations)
+
+    def continuations(self) -> Dict[str, int]:
+        ''' Requests continuing a truncated output, by stage '''
+        with self.__lock:
+            return dict(self.__continuations)
+
+    def suggested_max_tokens(self, percentile : float = 0.95) -> Dict[str, int]:
+        """
+        Completion tokens covering the given share of the outputs observed so far, by stage.
+
+        Args:
+            percentile (float, optional): Share of the outputs that should fit. Defaults to 0.95.
+
+        Returns:
+            Dict[str, int]: The upper bound of the bucket reaching the percentile, e.g. for `stage_max_tokens`.
+        """
+        if not 0 < percentile <= 1:
+            raise ValueError("percentile should be in (0, 1]")
+        suggestions = {}
+        for stage, histogram in self.histograms().items():
+            threshold, seen = percentile * sum(histogram.values()), 0
+            for bucket, count in histogram.items():
+                seen += count
+                if seen >= threshold:
+                    suggestions[stage] = bucket
+                    break
+        return suggestions
+
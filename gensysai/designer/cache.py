@@ -0,0 +1,118 @@
+from threading import Lock
+from typing import Any, Optional
+import hashlib
+import json
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = '.gensysai_cache.sqlite'
+
+
+class ResponseCache:
+    '''
+        Persistent content-addressed cache of LLM responses backed by SQLite.
+        Entries are keyed by a hash of the rendered prompt, the model name and the temperature.
+    '''
+
+    def __init__(self,
+            path : str = DEFAULT_CACHE_PATH,
+            ttl_seconds : Optional[float] = None,
+            max_entries : Optional[int] = None
+            ) -> None:
+        """
+        Initialize the ResponseCache object.
+
+        Args:
+            path (str, optional): Path of the SQLite database, `:memory:` for an in-process cache. Defaults to `.gensysai_cache.sqlite`. \n
+            ttl_seconds (float, optional): Entries older than this are treated as misses and evicted. Defaults to None (no expiry). \n
+            max_entries (int, optional): Least recently used entries are evicted beyond this size. Defaults to None (unbounded). \n
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL)''')
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses(accessed_at)')
+        self.__connection.commit()
+
+    @staticmethod
+    def key(prompt : str, llm = None) -> str:
+        """
+        Computes the cache key of a prompt for an llm.
+
+        Args:
+            prompt (str): The rendered prompt.
+            llm (BaseLLM, optional): The llm, whose model name and temperature are part of the key.
+
+        Returns:
+            str: sha256 hex digest of the prompt, model name and temperature.
+        """
+        model_name = getattr(llm, 'model_name', None) or type(llm).__name__
+        temperature = getattr(llm, 'temperature', None)
+        payload = json.dumps([prompt, model_name, temperature])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key : str) -> Optional[Any]:
+        """
+        Looks up a cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Any: The cached response or None on a miss.
+        """
+        now = time.time()
+        with self.__lock:
+            row = self.__connection.execute('SELECT value, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and row[1] + self.ttl_seconds < now:
+                self.__connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.__connection.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.__connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self.__connection.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key : str, value : Any) -> None:
+        """
+        Stores a response, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (str): The cache key.
+            value (Any): A JSON serializable response.
+        """
+        now = time.time()
+        with self.__lock:
+            self.__connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                      (key, json.dumps(value), now, now))
+            if self.max_entries is not None:
+                self.__connection.execute('''DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)''',
+                        (self.max_entries,))
+            self.__connection.commit()
+
+    def clear(self) -> None:
+        ''' Removes all the entries and resets the counters '''
+        with self.__lock:
+            self.__connection.execute('DELETE FROM responses')
+            self.__connection.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, List, Optional
+import asyncio
+import hashlib
+import json
+import os
+
+
+def content_key(*parts : Any) -> str:
+    ''' sha256 hex digest of the given parts '''
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+def stage_identity(operation : Any) -> List[Any]:
+    ''' What the output of an operation depends on besides its inputs: its type, prompt mode and model '''
+    llm = getattr(operation, 'llm', None)
+    return [type(operation).__name__, getattr(operation, 'prompt_mode', None),
+            getattr(llm, 'model_name', None) or type(llm).__name__,
+            getattr(llm, 'max_tokens', None), getattr(llm, 'temperature', None)]
+
+
+class CheckpointStore:
+    '''
+        Keeps the completed stages of designs (titles, analyses and component designs) by the content hash of their inputs.
+        A retry of a failed design resumes from its completed stages, and a re-design only pays for the stages
+        whose inputs changed, e.g. the provider-specific components after a change of cloud provider.
+    '''
+
+    def __init__(self, directory : str = None, max_entries : int = 1024) -> None:
+        """
+        Initialize the CheckpointStore object.
+
+        Args:
+            directory (str, optional): If provided, stages are also persisted as JSON files, to survive a restart
+                and to be shared by processes. Defaults to None. \n
+            max_entries (int, optional): Least recently used stages are dropped from memory beyond this size. Defaults to 1024. \n
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.__lock = Lock()
+        # key -> JSON of the stage output, so that callers never share a mutable value
+        self.__stages : OrderedDict = OrderedDict()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key : str) -> Optional[Any]:
+        ''' The saved output of a stage, None if there is none '''
+        with self.__lock:
+            if key in self.__stages:
+                self.__stages.move_to_end(key)
+                return json.loads(self.__stages[key])
+
+        path = self.__path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as file:
+                stage = file.read()
+            value = json.loads(stage)
+        except (OSError, ValueError):
+            return None
+        self.__remember(key, stage)
+        return value
+
+    def save(self, key : str, value : Any) -> None:
+        ''' Saves the output of a stage, it should be serializable as JSON '''
+        stage = json.dumps(value)
+        self.__remember(key, stage)
+
+        path = self.__path(key)
+        if path is not None:
+            # written aside and renamed, so that another process never reads a partial file
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as file:
+                file.write(stage)
+            os.replace(temp_path, path)
+
+    async def aget(self, key : str) -> Optional[Any]:
+        ''' Same as `get`, the file of a persisted stage is read off the event loop '''
+        return await self.__off_loop(self.get, key)
+
+    async def asave(self, key : str, value : Any) -> None:
+        ''' Same as `save`, the file of a persisted stage is written off the event loop '''
+        await self.__off_loop(self.save, key, value)
+
+    def discard(self, key : str) -> None:
+        with self.__lock:
+            self.__stages.pop(key, None)
+            path = self.__path(key)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    async def adiscard(self, key : str) -> None:
+        ''' Same as `discard`, the file of a persisted stage is removed off the event loop '''
+        await self.__off_loop(self.discard, key)
+
+    async def __off_loop(self, method : Callable[..., Any], *args : Any) -> Any:
+        # an in-memory store does no I/O, not worth a thread
+        if self.directory is None:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    def __remember(self, key : str, stage : str) -> None:
+        with self.__lock:
+            self.__stages[key] = stage
+            self.__stages.move_to_end(key)
+            while len(self.__stages) > self.max_entries:
+                self.__stages.popitem(last=False)
+
+    def __path(self, key : str) -> Optional[str]:
+        return os.path.join(self.directory, f"{key}.json") if self.directory is not None else None
@@ -1,58 +1,209 @@
-from langchain.llms import BaseLLM
-from ..models import Component
-from langchain import PromptTemplate, LLMChain
-from ..prompts import Prompts
-from typing import Dict, List
-from .base import BaseComponentDesigner
+from __future__ import annotations
+from ..models import Component, ComponentDesigns
+from ..prompts import Prompts, PromptMode, compact_prompt
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+from .base import BaseComponentDesigner, render_component, similarity_key
 from .openaioperation import OpenAIOperation
-    
+from .retry import OutputFixer, is_transient_error
+
+if TYPE_CHECKING:
+    from ..chains import BudgetedLLMChain
+    from langchain.llms import BaseLLM
+    from langchain.output_parsers import PydanticOutputParser
+    from langchain.callbacks.manager import Callbacks
+
+# component types of the dedicated designers
+DEDICATED_TYPES = frozenset(['Storage', 'Service'])
 
 class GenericComponentDesigner(BaseComponentDesigner, OpenAIOperation):
     '''Designs a Service component based on the provided component details'''
 
+    stage = 'generic'
+
     def __init__(self,
             llm : BaseLLM,
             verbose : bool = False,
-            additional_inputs : List[str] = None 
+            additional_inputs : List[str] = None,
+            prompt_mode : str = PromptMode.FULL,
+            batch_size : int = 1
             ) -> None:
-        
+        """
+        Initialize the GenericComponentDesigner object.
+
+        Args:
+            llm (BaseLLM): The BaseLLM object. \n
+            verbose (bool, optional): Verbose mode flag. Defaults to False. \n
+            additional_inputs (List[str], optional): Inputs to be provided with every design. Defaults to None. \n
+            prompt_mode (str, optional): One of `PromptMode.ALL`, see `compact_prompt`. Defaults to `PromptMode.FULL`. \n
+            batch_size (int, optional): Components designed in a single request by `design_batch`, a batch whose response 
+                does not parse falls back to one request per component. The designs of a batch share the completion 
+                tokens of the llm. Defaults to 1 (no batching). \n
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size should be at least 1")
+        self.llm = llm
+        self.verbose = verbose
+        self.batch_size = batch_size
+        self.prompt_mode = prompt_mode
         self.input_variables = ['component', 'cloud_provider']
         if additional_inputs is not None:
             self.input_variables = self.input_variables + additional_inputs
+        self.required_inputs = frozenset(self.input_variables).difference(['component', 'cloud_provider'])
+
 
-        prompt = PromptTemplate(template= Prompts.GenericComponentDesignerPrompt,
+    @cached_property
+    def __llm_chain(self) -> BudgetedLLMChain:
+        from langchain import PromptTemplate
+        from ..chains import BudgetedLLMChain
+        prompt = PromptTemplate(template= compact_prompt(Prompts.GenericComponentDesignerPrompt, self.prompt_mode),
                                 input_variables=self.input_variables)
-        self.__llm_chain = LLMChain(prompt=prompt, llm=llm, verbose=verbose)
+        return BudgetedLLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose, operation=self)
+
+    @cached_property
+    def __batch_parser(self) -> PydanticOutputParser:
+        from langchain.output_parsers import PydanticOutputParser
+        return PydanticOutputParser(pydantic_object=ComponentDesigns)
+
+    @cached_property
+    def __batch_chain(self) -> BudgetedLLMChain:
+        from langchain import PromptTemplate
+        from ..chains import BudgetedLLMChain
+        batch_variables = ['components'] + [var for var in self.input_variables if var != 'component']
+        batch_prompt = PromptTemplate(template= compact_prompt(Prompts.BatchedGenericComponentDesignerPrompt, self.prompt_mode),
+                                      input_variables=batch_variables,
+                                      partial_variables={"format_instructions": self.__batch_parser.get_format_instructions()})
+        return BudgetedLLMChain(prompt=batch_prompt, llm=self.llm, verbose=self.verbose, operation=self, outputs=self.batch_size)
 
+    @cached_property
+    def __batch_fixer(self) -> OutputFixer:
+        return OutputFixer(llm=self.llm, format_instructions=self.__batch_parser.get_format_instructions())
     
     def design(self,
                component : Component,
                cloud_provider : str = 'Any',
-               additional_input : Dict[str,str] = None):
-
-        if component.component_type in ['Storage', 'Service']:
-            raise ValueError('''This Designer is suitable for generic Components only. 
-            Use StorageComponentDesigner or ServiceComponentDesigner as per component type.''')
-        
-        if cloud_provider not in ['AWS', 'Azure', 'GCP', 'Any']:
-            raise ValueError("Cloud Provider should be from ['AWS', 'Azure', 'GCP', 'Any']")
-        
-        # validate input variables
-        for var in self.input_variables:
-            if var not in ['component', 'cloud_provider']:
-                if additional_input is None or var not in additional_input.keys():
-                    raise ValueError(f"input {var} is not provided.")
-
-        
-        inputs = { 'component' : str(component),
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+
+        self.validate(component, cloud_provider, additional_input)
+        return self._design(component, cloud_provider, additional_input, callbacks)
+
+    async def adesign(self,
+               component : Component,
+               cloud_provider : str = 'Any',
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+
+        self.validate(component, cloud_provider, additional_input)
+        return await self._adesign(component, cloud_provider, additional_input, callbacks)
+
+    def _design(self,
+               component : Component,
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+        inputs = self.__inputs(component, cloud_provider, additional_input)
+        return self._run_chain(self.__llm_chain, inputs, callbacks=callbacks, component=component.name, similar=similarity_key(component, cloud_provider, additional_input))
+
+    async def _adesign(self,
+               component : Component,
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+        inputs = self.__inputs(component, cloud_provider, additional_input)
+        return await self._arun_chain(self.__llm_chain, inputs, callbacks=callbacks, component=component.name, similar=similarity_key(component, cloud_provider, additional_input))
+
+    def _design_batch(self,
+               components : List[Component],
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> List[Union[str, Exception]]:
+        """
+        Designs the components in a single request, the components missing from the response, 
+        or all of them if it does not parse, are designed one by one.
+
+        Args:
+            components (List[Component]): At most `batch_size` components.
+            cloud_provider (str): The cloud provider.
+            additional_input (Dict[str,str], optional): Additional inputs of the designer. Defaults to None.
+            callbacks (Callbacks, optional): LangChain callbacks passed to the LLM calls.
+
+        Returns:
+            List[Union[str, Exception]]: The design, or the error, of each component in the given order.
+        """
+        inputs = self.__batch_inputs(components, cloud_provider, additional_input)
+        if inputs is None:
+            return super()._design_batch(components, cloud_provider, additional_input, callbacks)
+
+        try:
+            batch = self._run_chain(self.__batch_chain, inputs, parser=self.__batch_parser.parse, callbacks=callbacks,
+                                    component=', '.join(component.name for component in components), fixer=self.__batch_fixer)
+            designs = {design.name : design.design for design in batch.designs}
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            designs = {}
+
+        missing = [component for component in components if component.name not in designs]
+        fallback = dict(zip([component.name for component in missing], 
+                            super()._design_batch(missing, cloud_provider, additional_input, callbacks)))
+        return [designs[component.name] if component.name in designs else fallback[component.name] for component in components]
+
+    async def _adesign_batch(self,
+               components : List[Component],
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None) -> List[Union[str, Exception]]:
+        ''' Async version of `_design_batch` '''
+        inputs = self.__batch_inputs(components, cloud_provider, additional_input)
+        if inputs is None:
+            return await super()._adesign_batch(components, cloud_provider, additional_input, callbacks)
+
+        try:
+            batch = await self._arun_chain(self.__batch_chain, inputs, parser=self.__batch_parser.parse, callbacks=callbacks,
+                                           component=', '.join(component.name for component in components), fixer=self.__batch_fixer)
+            designs = {design.name : design.design for design in batch.designs}
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            designs = {}
+
+        missing = [component for component in components if component.name not in designs]
+        fallback = dict(zip([component.name for component in missing], 
+                            await super()._adesign_batch(missing, cloud_provider, additional_input, callbacks)))
+        return [designs[component.name] if component.name in designs else fallback[component.name] for component in components]
+
+    def __batch_inputs(self,
+               components : List[Component],
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None) -> Optional[Dict[str,str]]:
+        # None if the components are not worth a batch
+        if self.batch_size < 2 or len(components) < 2 or len(components) > self.batch_size:
+            return None
+        if len({component.name for component in components}) < len(components):
+            # designs are matched back to the components by name
+            return None
+
+        inputs = self.__inputs(components[0], cloud_provider, additional_input)
+        del inputs['component']
+        inputs['components'] = '[' + ', '.join(component.compact_str() for component in components) + ']'
+        return inputs
+
+    def __inputs(self,
+               component : Component,
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None) -> Dict[str,str]:
+        # the inputs were checked by `validate`, or by the registry of the designer
+        inputs = { 'component' : render_component(component, self.prompt_mode),
                     'cloud_provider' : cloud_provider,
         }
         if additional_input is not None:
             for var in additional_input.keys():
                 inputs[var] = additional_input[var]
-
-        output = self.__llm_chain.run(**inputs)
-        return output
+        return inputs
     
+    def supports(self, component_type : str) -> bool:
+        return component_type not in DEDICATED_TYPES
+
     def get_request_count(self):
         return 1
\ No newline at end of file
@@ -1,8 +1,330 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, Tuple
+from .ratelimiter import RateLimiter, default_rate_limiter, estimate_tokens
+from .cache import ResponseCache
+from .retry import RetryPolicy, FixableOutputError, OutputFixer, is_transient_error
+from ..instrumentation import StageRecord, bind_recorder, raise_if_cancelled
+import asyncio
+import time
+
+if TYPE_CHECKING:
+    from langchain.callbacks.manager import Callbacks
+    from .semantic import SemanticCache
+    from .budget import TokenBudget
 
 class OpenAIOperation(ABC):
 
     ''' Abstract class for for any operation that uses OpenAI '''
+
+    # shared across all operations and designer instances unless overridden per instance
+    rate_limiter : RateLimiter = default_rate_limiter
+    cache : ResponseCache = None
+    semantic_cache : SemanticCache = None
+    retry_policy : RetryPolicy = RetryPolicy()
+    # max_tokens of the requests and continuations of truncated completions, see `BudgetedLLMChain`
+    token_budget : TokenBudget = None
+    # name of the operation in run reports
+    stage : str = 'operation'
+
     @abstractmethod
     def get_request_count(self) -> int:
-        return 0
\ No newline at end of file
+        return 0
+
+    def wait_for_rate_limit(self, prompt : str, llm = None, requests : int = None, outputs : int = 1) -> float:
+        """
+        Blocks until the operation's requests fit into the rate limit.
+
+        Args:
+            prompt (str): The prompt text to be sent, used to estimate the tokens.
+            llm (BaseLLM, optional): The llm, whose `max_tokens` is counted towards the completion tokens.
+            requests (int, optional): Number of requests. Defaults to `get_request_count()`.
+            outputs (int, optional): Outputs of each request, e.g. the designs of a batch, see `TokenBudget.stage_tokens`. Defaults to 1.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        if self.rate_limiter is None:
+            return 0.0
+        return self.rate_limiter.acquire(*self.__rate_limit_cost(prompt, llm, requests, outputs))
+
+    async def await_rate_limit(self, prompt : str, llm = None, requests : int = None, outputs : int = 1) -> float:
+        ''' Same as `wait_for_rate_limit` without blocking the event loop '''
+        if self.rate_limiter is None:
+            return 0.0
+        return await self.rate_limiter.aacquire(*self.__rate_limit_cost(prompt, llm, requests, outputs))
+
+    def __rate_limit_cost(self, prompt : str, llm = None, requests : int = None, outputs : int = 1) -> Tuple[int, int]:
+        # number of requests and estimated tokens, including the completion tokens
+        requests = requests if requests is not None else self.get_request_count()
+        completion_tokens = getattr(llm, 'max_tokens', None) or 0
+        if self.token_budget is not None:
+            completion_tokens = self.token_budget.stage_tokens(llm, self.stage, outputs) or completion_tokens
+        return requests, estimate_tokens(prompt) + requests * completion_tokens
+
+    def _cached_call(self,
+            prompt : str,
+            llm,
+            call : Callable[[Callbacks], Any],
+            parser : Callable[[Any], Any] = None,
+            callbacks : Callbacks = None,
+            component : str = None,
+            fixer : OutputFixer = None,
+            fix_key : str = None,
+            similar : Tuple[str, str] = None,
+            outputs : int = 1) -> Any:
+        """
+        Returns the cached response of a prompt, otherwise makes the call once the rate limit allows it.
+        Transient API errors are retried with backoff as per `retry_policy`, and a response that does not
+        parse is corrected by the fixer instead of being regenerated.
+        If a RunRecorder is among the callbacks, the call is recorded under the operation's `stage`.
+
+        Args:
+            prompt (str): The rendered prompt, part of the cache key.
+            llm (BaseLLM): The llm used by the call, part of the cache key.
+            call (Callable): Makes the actual request with the given callbacks and returns a JSON serializable output.
+            parser (Callable, optional): Parses the output. A response is cached only if it parses.
+            callbacks (Callbacks, optional): LangChain callbacks passed to the call.
+            component (str, optional): Name of the component of the call, for the run report.
+            fixer (OutputFixer, optional): Corrects an output that fails to parse.
+            fix_key (str, optional): If the output is a dict, the key of the value to be corrected.
+            similar (Tuple[str, str], optional): (context, text) for the `semantic_cache`, the response of a near-duplicate text
+                with the same context is reused. The context should identify the prompt template and any other inputs.
+            outputs (int, optional): Outputs of the request, e.g. the designs of a batch, for the rate limiter. Defaults to 1.
+
+        Returns:
+            Any: The (parsed) output.
+        """
+        parse = parser if parser is not None else (lambda output: output)
+        callbacks, record = bind_recorder(callbacks, self.stage, component)
+        start = time.perf_counter()
+
+        try:
+            key, output = self.__lookup(prompt, llm, record, similar)
+            if output is not None:
+                return self.__parse(parse, output, record)
+
+            output = self.__call_with_retries(lambda: call(callbacks), prompt, llm, record, outputs=outputs, callbacks=callbacks)
+            output, parsed = self.__parse_or_fix(parse, output, record, fixer, fix_key, callbacks)
+
+            self.__store(key, output, llm, similar)
+            return parsed
+        except Exception as e:
+            if record is not None:
+                record.error = str(e)
+            raise
+        finally:
+            if record is not None:
+                record.wall_seconds = time.perf_counter() - start
+
+    async def _acached_call(self,
+            prompt : str,
+            llm,
+            call : Callable[[Callbacks], Awaitable[Any]],
+            parser : Callable[[Any], Any] = None,
+            callbacks : Callbacks = None,
+            component : str = None,
+            fixer : OutputFixer = None,
+            fix_key : str = None,
+            similar : Tuple[str, str] = None,
+            outputs : int = 1) -> Any:
+        ''' Same as `_cached_call` for an async call, waits and backs off without blocking the event loop '''
+        parse = parser if parser is not None else (lambda output: output)
+        callbacks, record = bind_recorder(callbacks, self.stage, component)
+        start = time.perf_counter()
+
+        try:
+            key, output = await self.__off_loop(self.__lookup, prompt, llm, record, similar)
+            if output is not None:
+                return self.__parse(parse, output, record)
+
+            output = await self.__acall_with_retries(lambda: call(callbacks), prompt, llm, record, outputs=outputs, callbacks=callbacks)
+            output, parsed = await self.__aparse_or_fix(parse, output, record, fixer, fix_key, callbacks)
+
+            await self.__off_loop(self.__store, key, output, llm, similar)
+            return parsed
+        except Exception as e:
+            if record is not None:
+                record.error = str(e)
+            raise
+        finally:
+            if record is not None:
+                record.wall_seconds = time.perf_counter() - start
+
+    def __lookup(self, prompt : str, llm, record : StageRecord = None, similar : Tuple[str, str] = None) -> Tuple[Optional[str], Any]:
+        # returns the cache key, None without a cache, and the cached output, None on a miss
+        key, output = None, None
+        if self.cache is not None:
+            key = self.cache.key(prompt, llm)
+            output = self.cache.get(key)
+            if output is not None and record is not None:
+                record.cache_hit = True
+
+        # an exact hit is preferred over a near-duplicate
+        if output is None and self.semantic_cache is not None and similar is not None:
+            output = self.semantic_cache.get(self.__namespace(similar[0], llm), similar[1])
+            if output is not None and record is not None:
+                record.cache_hit = True
+                record.semantic_hit = True
+        return key, output
+
+    def __store(self, key : Optional[str], output : Any, llm, similar : Tuple[str, str] = None) -> None:
+        if key is not None:
+            self.cache.set(key, output)
+        if self.semantic_cache is not None and similar is not None:
+            self.semantic_cache.set(self.__namespace(similar[0], llm), similar[1], output)
+
+    async def __off_loop(self, method : Callable[..., Any], *args : Any) -> Any:
+        # the SQLite cache and the scan of the semantic index would block the event loop
+        if self.cache is None and self.semantic_cache is None:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, method, *args)
+
+    def __namespace(self, context : str, llm) -> str:
+        # near-duplicates are only matched for the same operation, model and context
+        return ResponseCache.key(f"{self.stage}\n{context}", llm)
+
+    def __should_retry(self, error : Exception, attempt : int, record : StageRecord = None) -> bool:
+        if self.retry_policy is None or attempt > self.retry_policy.max_retries or not is_transient_error(error):
+            return False
+        if record is not None:
+            record.retries += 1
+        return True
+
+    def __call_with_retries(self,
+            call : Callable[[], Any],
+            prompt : str,
+            llm,
+            record : StageRecord = None,
+            requests : int = None,
+            outputs : int = 1,
+            callbacks : Callbacks = None) -> Any:
+        attempt = 0
+        while True:
+            # an abandoned call stops before its next request
+            raise_if_cancelled(callbacks)
+            self.wait_for_rate_limit(prompt, llm, requests, outputs)
+            try:
+                return call()
+            except Exception as e:
+                attempt += 1
+                if not self.__should_retry(e, attempt, record):
+                    raise
+                time.sleep(self.retry_policy.backoff(attempt))
+
+    async def __acall_with_retries(self,
+            call : Callable[[], Awaitable[Any]],
+            prompt : str,
+            llm,
+            record : StageRecord = None,
+            requests : int = None,
+            outputs : int = 1,
+            callbacks : Callbacks = None) -> Any:
+        attempt = 0
+        while True:
+            raise_if_cancelled(callbacks)
+            await self.await_rate_limit(prompt, llm, requests, outputs)
+            try:
+                return await call()
+            except Exception as e:
+                attempt += 1
+                if not self.__should_retry(e, attempt, record):
+                    raise
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+
+    def __parse_or_fix(self,
+            parse : Callable[[Any], Any],
+            output : Any,
+            record : StageRecord = None,
+            fixer : OutputFixer = None,
+            fix_key : str = None,
+            callbacks : Callbacks = None) -> Tuple[Any, Any]:
+        # returns the (corrected) output along with the parsed output
+        attempts = self.retry_policy.max_fix_attempts if self.retry_policy is not None and fixer is not None else 0
+        while True:
+            try:
+                return output, self.__parse(parse, output, record)
+            except Exception as e:
+                # a parser may name the value to fix along with its fixer
+                key, value_fixer, error = (e.fix_key, e.fixer, e.error) if isinstance(e, FixableOutputError) else (fix_key, fixer, e)
+                if attempts <= 0 or value_fixer is None:
+                    raise
+                attempts -= 1
+
+                completion = output[key] if key is not None else output
+                fixed = self.__call_with_retries(lambda: value_fixer.fix(completion, error, callbacks),
+                                                 value_fixer.prompt(completion, error), value_fixer.llm, record, requests=1,
+                                                 callbacks=callbacks)
+                if record is not None:
+                    record.retries += 1
+                output = {**output, key : fixed} if key is not None else fixed
+
+    async def __aparse_or_fix(self,
+            parse : Callable[[Any], Any],
+            output : Any,
+            record : StageRecord = None,
+            fixer : OutputFixer = None,
+            fix_key : str = None,
+            callbacks : Callbacks = None) -> Tuple[Any, Any]:
+        attempts = self.retry_policy.max_fix_attempts if self.retry_policy is not None and fixer is not None else 0
+        while True:
+            try:
+                return output, self.__parse(parse, output, record)
+            except Exception as e:
+                # a parser may name the value to fix along with its fixer
+                key, value_fixer, error = (e.fix_key, e.fixer, e.error) if isinstance(e, FixableOutputError) else (fix_key, fixer, e)
+                if attempts <= 0 or value_fixer is None:
+                    raise
+                attempts -= 1
+
+                completion = output[key] if key is not None else output
+                fixed = await self.__acall_with_retries(lambda: value_fixer.afix(completion, error, callbacks),
+                                                        value_fixer.prompt(completion, error), value_fixer.llm, record, requests=1,
+                                                        callbacks=callbacks)
+                if record is not None:
+                    record.retries += 1
+                output = {**output, key : fixed} if key is not None else fixed
+
+    def __parse(self, parse : Callable[[Any], Any], output : Any, record : StageRecord = None) -> Any:
+        try:
+            return parse(output)
+        except Exception:
+            if record is not None:
+                record.parse_failure = True
+            raise
+
+    def _run_chain(self,
+            chain,
+            inputs : Dict[str, Any],
+            parser : Callable[[str], Any] = None,
+            callbacks : Callbacks = None,
+            component : str = None,
+            fixer : OutputFixer = None,
+            similar : Tuple[str, str] = None) -> Any:
+        """
+        Runs an LLMChain through the cache, the rate limiter and the retry policy.
+        The (context, text) of `similar` are matched within the chain's prompt template, see `_cached_call`.
+        """
+        return self._cached_call(chain.prompt.format(**inputs), chain.llm,
+                                 lambda callbacks: chain.run(**inputs, callbacks=callbacks),
+                                 parser, callbacks, component, fixer,
+                                 similar=self.__similar(chain, similar), outputs=getattr(chain, 'outputs', 1))
+
+    async def _arun_chain(self,
+            chain,
+            inputs : Dict[str, Any],
+            parser : Callable[[str], Any] = None,
+            callbacks : Callbacks = None,
+            component : str = None,
+            fixer : OutputFixer = None,
+            similar : Tuple[str, str] = None) -> Any:
+        ''' Runs an LLMChain asynchronously through the cache, the rate limiter and the retry policy '''
+        return await self._acached_call(chain.prompt.format(**inputs), chain.llm,
+                                        lambda callbacks: chain.arun(**inputs, callbacks=callbacks),
+                                        parser, callbacks, component, fixer,
+                                        similar=self.__similar(chain, similar), outputs=getattr(chain, 'outputs', 1))
+
+    def __similar(self, chain, similar : Tuple[str, str] = None) -> Optional[Tuple[str, str]]:
+        if similar is None:
+            return None
+        return f"{chain.prompt.template}\n{similar[0]}", similar[1]
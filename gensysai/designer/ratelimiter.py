@@ -0,0 +1,227 @@
+from collections import deque
+from threading import Lock
+from typing import Deque, Iterable, Optional, Tuple
+import asyncio
+import sqlite3
+import time
+
+REQUESTS_PER_MINUTE = 15
+TOKENS_PER_MINUTE = 40000
+WINDOW_IN_SECONDS = 60.0
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text : str) -> int:
+    ''' Rough token estimate of a text, ~4 characters per token for English prompts '''
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class RateLimiter:
+    '''
+        Thread-safe sliding window rate limiter over requests per minute and tokens per minute.
+        A caller blocks only until enough of the window has expired to fit its request.
+    '''
+
+    def __init__(self,
+            requests_per_minute : Optional[int] = REQUESTS_PER_MINUTE,
+            tokens_per_minute : Optional[int] = TOKENS_PER_MINUTE,
+            window_seconds : float = WINDOW_IN_SECONDS
+            ) -> None:
+        """
+        Initialize the RateLimiter object.
+
+        Args:
+            requests_per_minute (int, optional): Maximum requests in a window, None for no limit. Defaults to 15. \n
+            tokens_per_minute (int, optional): Maximum tokens in a window, None for no limit. Defaults to 40000. \n
+            window_seconds (float, optional): Length of the sliding window in seconds. Defaults to 60. \n
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window_seconds = window_seconds
+
+        self.__lock = Lock()
+        self.__window : Deque[Tuple[float, int, int]] = deque()
+        self.__used_requests = 0
+        self.__used_tokens = 0
+
+        # telemetry
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.total_wait_seconds = 0.0
+
+    def acquire(self, requests : int = 1, tokens : int = 0) -> float:
+        """
+        Blocks until the given number of requests and tokens fit in the window and records them.
+
+        Args:
+            requests (int, optional): Number of requests about to be made. Defaults to 1.
+            tokens (int, optional): Estimated number of tokens of the requests. Defaults to 0.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                delay = self.__reserve(requests, tokens, time.monotonic())
+                if delay == 0.0:
+                    self.total_wait_seconds += waited
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def aacquire(self, requests : int = 1, tokens : int = 0) -> float:
+        """
+        Waits without blocking the event loop until the given number of requests and tokens fit in the window and records them.
+
+        Args:
+            requests (int, optional): Number of requests about to be made. Defaults to 1.
+            tokens (int, optional): Estimated number of tokens of the requests. Defaults to 0.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                delay = self.__reserve(requests, tokens, time.monotonic())
+                if delay == 0.0:
+                    self.total_wait_seconds += waited
+                    return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def __reserve(self, requests : int, tokens : int, now : float) -> float:
+        ''' Records the request and returns 0 if it fits in the window, otherwise the seconds to wait '''
+        self.__expire(now)
+
+        if self.__fits(requests, tokens):
+            # without any limit there is no window to keep
+            if self.requests_per_minute is not None or self.tokens_per_minute is not None:
+                self.__window.append((now, requests, tokens))
+                self.__used_requests += requests
+                self.__used_tokens += tokens
+            self.total_requests += requests
+            self.total_tokens += tokens
+            return 0.0
+
+        return self._wait_seconds(self.__window, self.__used_requests, self.__used_tokens, requests, tokens, now)
+
+    def _wait_seconds(self,
+            window : Iterable[Tuple[float, int, int]],
+            used_requests : int,
+            used_tokens : int,
+            requests : int,
+            tokens : int,
+            now : float) -> float:
+        ''' Seconds until enough of the window, oldest first, has expired to fit the request '''
+        for timestamp, _requests, _tokens in window:
+            used_requests -= _requests
+            used_tokens -= _tokens
+            if used_requests == 0 or self._within_limits(used_requests + requests, used_tokens + tokens):
+                return max(timestamp + self.window_seconds - now, 0.001)
+        return self.window_seconds
+
+    def __fits(self, requests : int, tokens : int) -> bool:
+        # an oversized request is let through alone on an empty window, it would never fit otherwise
+        if not self.__window:
+            return True
+        return self._within_limits(self.__used_requests + requests, self.__used_tokens + tokens)
+
+    def _within_limits(self, requests : int, tokens : int) -> bool:
+        if self.requests_per_minute is not None and requests > self.requests_per_minute:
+            return False
+        if self.tokens_per_minute is not None and tokens > self.tokens_per_minute:
+            return False
+        return True
+
+    def __expire(self, now : float) -> None:
+        while self.__window and self.__window[0][0] + self.window_seconds <= now:
+            _, requests, tokens = self.__window.popleft()
+            self.__used_requests -= requests
+            self.__used_tokens -= tokens
+
+
+class SQLiteRateLimiter(RateLimiter):
+    '''
+        Sliding window rate limiter whose window is kept in a SQLite database, so that the processes
+        sharing the database, e.g. the workers of a `jobs.WorkerPool`, share one API quota.
+    '''
+
+    def __init__(self,
+            path : str,
+            requests_per_minute : Optional[int] = REQUESTS_PER_MINUTE,
+            tokens_per_minute : Optional[int] = TOKENS_PER_MINUTE,
+            window_seconds : float = WINDOW_IN_SECONDS
+            ) -> None:
+        """
+        Initialize the SQLiteRateLimiter object.
+
+        Args:
+            path (str): Path of the SQLite database shared by the processes. \n
+            requests_per_minute (int, optional): Maximum requests in a window across the processes, None for no limit. Defaults to 15. \n
+            tokens_per_minute (int, optional): Maximum tokens in a window across the processes, None for no limit. Defaults to 40000. \n
+            window_seconds (float, optional): Length of the sliding window in seconds. Defaults to 60. \n
+        """
+        super().__init__(requests_per_minute, tokens_per_minute, window_seconds)
+        self.path = path
+
+        self.__lock = Lock()
+        # transactions are explicit, a reservation locks the database against the other processes
+        self.__connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.__connection.execute('''CREATE TABLE IF NOT EXISTS rate_window (
+                at REAL NOT NULL,
+                requests INTEGER NOT NULL,
+                tokens INTEGER NOT NULL)''')
+
+    def acquire(self, requests : int = 1, tokens : int = 0) -> float:
+        waited = 0.0
+        while True:
+            delay = self.__reserve(requests, tokens)
+            if delay == 0.0:
+                with self.__lock:
+                    self.total_wait_seconds += waited
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def aacquire(self, requests : int = 1, tokens : int = 0) -> float:
+        # a reservation may wait for the lock of the database held by another process, it runs off the event loop
+        loop = asyncio.get_running_loop()
+        waited = 0.0
+        while True:
+            delay = await loop.run_in_executor(None, self.__reserve, requests, tokens)
+            if delay == 0.0:
+                with self.__lock:
+                    self.total_wait_seconds += waited
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def __reserve(self, requests : int, tokens : int) -> float:
+        # wall clock time, the monotonic clock of each process is different
+        now = time.time()
+        with self.__lock:
+            self.__connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.__connection.execute('DELETE FROM rate_window WHERE at <= ?', (now - self.window_seconds,))
+                window = self.__connection.execute('SELECT at, requests, tokens FROM rate_window ORDER BY at').fetchall()
+                used_requests, used_tokens = sum(row[1] for row in window), sum(row[2] for row in window)
+
+                if not window or self._within_limits(used_requests + requests, used_tokens + tokens):
+                    if self.requests_per_minute is not None or self.tokens_per_minute is not None:
+                        self.__connection.execute('INSERT INTO rate_window VALUES (?, ?, ?)', (now, requests, tokens))
+                    self.__connection.execute('COMMIT')
+                    self.total_requests += requests
+                    self.total_tokens += tokens
+                    return 0.0
+
+                self.__connection.execute('COMMIT')
+            except Exception:
+                self.__connection.execute('ROLLBACK')
+                raise
+        return self._wait_seconds(window, used_requests, used_tokens, requests, tokens, now)
+
+
+# Rate limiter shared by every OpenAIOperation unless one is explicitly provided
+default_rate_limiter = RateLimiter()
@@ -0,0 +1,65 @@
+from .base import BaseComponentDesigner
+from typing import Dict, List, Optional
+
+
+class DesignerRegistry:
+    '''
+        Maps component types to the designers of the components. Designers are checked once when registered,
+        so that the designs dispatched here skip the checks of the public `design` (see `BaseComponentDesigner.validate`): 
+        designing a component is a dictionary lookup followed by the LLM call.
+    '''
+
+    def __init__(self, default : BaseComponentDesigner = None) -> None:
+        """
+        Initialize the DesignerRegistry object.
+
+        Args:
+            default (BaseComponentDesigner, optional): Designer of the component types that are not registered. 
+                Defaults to None, an unregistered type is an error. \n
+        """
+        self.__designers : Dict[str, BaseComponentDesigner] = {}
+        self.default = None
+        if default is not None:
+            self.set_default(default)
+
+    def register(self, component_type : str, designer : BaseComponentDesigner) -> None:
+        """
+        Registers the designer of a component type, replacing any previous one.
+
+        Args:
+            component_type (str): The component type, as identified by the problem analysis, e.g. "Cache".
+            designer (BaseComponentDesigner): The designer of the components of the type.
+        """
+        self.__check(designer, component_type)
+        self.__designers[component_type] = designer
+
+    def set_default(self, designer : BaseComponentDesigner) -> None:
+        self.__check(designer)
+        self.default = designer
+
+    def designer_for(self, component_type : str) -> BaseComponentDesigner:
+        designer = self.__designers.get(component_type, self.default)
+        if designer is None:
+            raise ValueError(f"No designer is registered for component type {component_type}")
+        return designer
+
+    def component_types(self) -> List[str]:
+        return list(self.__designers.keys())
+
+    def designers(self) -> List[BaseComponentDesigner]:
+        ''' The distinct registered designers, the default one included '''
+        designers = list(self.__designers.values()) + ([self.default] if self.default is not None else [])
+        return list({id(designer) : designer for designer in designers}.values())
+
+    def __contains__(self, component_type : str) -> bool:
+        return component_type in self.__designers
+
+    def __check(self, designer : BaseComponentDesigner, component_type : Optional[str] = None) -> None:
+        if not isinstance(designer, BaseComponentDesigner):
+            raise TypeError(f"{type(designer).__name__} is not a BaseComponentDesigner")
+        if component_type is not None and not designer.supports(component_type):
+            raise ValueError(f"{type(designer).__name__} can not design {component_type} components")
+        if designer.required_inputs:
+            # the components dispatched here are designed from the component and the cloud provider only
+            raise ValueError(f"{type(designer).__name__} requires the inputs {', '.join(sorted(designer.required_inputs))}, "
+                             "which the designs of a registry are not given")
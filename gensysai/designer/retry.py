@@ -0,0 +1,112 @@
+from __future__ import annotations
+from functools import cached_property
+from typing import TYPE_CHECKING, Tuple, Type
+import random
+
+if TYPE_CHECKING:
+    from langchain import LLMChain
+    from langchain.callbacks.manager import Callbacks
+
+_transient_errors : Tuple[Type[BaseException], ...] = None
+
+def transient_errors() -> Tuple[Type[BaseException], ...]:
+    ''' The transient error types, resolved on the first error since importing openai is slow '''
+    global _transient_errors
+    if _transient_errors is None:
+        try:
+            import openai.error as openai_error
+            _transient_errors = (
+                openai_error.RateLimitError,
+                openai_error.APIError,
+                openai_error.APIConnectionError,
+                openai_error.ServiceUnavailableError,
+                openai_error.Timeout,
+                openai_error.TryAgain,
+                TimeoutError,
+                ConnectionError,
+            )
+        except ImportError:
+            _transient_errors = (TimeoutError, ConnectionError)
+    return _transient_errors
+
+
+def is_transient_error(error : BaseException) -> bool:
+    ''' Whether the error is a transient API error, worth retrying the same request '''
+    return isinstance(error, transient_errors())
+
+
+class RetryPolicy:
+    '''
+        Retries of transient API errors with jittered exponential backoff,
+        and the number of output-fixing attempts for responses that do not parse.
+    '''
+
+    def __init__(self,
+            max_retries : int = 3,
+            base_delay : float = 1.0,
+            max_delay : float = 30.0,
+            max_fix_attempts : int = 1
+            ) -> None:
+        """
+        Initialize the RetryPolicy object.
+
+        Args:
+            max_retries (int, optional): Retries of a request after a transient error. Defaults to 3. \n
+            base_delay (float, optional): Upper bound of the first backoff in seconds, doubled on every retry. Defaults to 1. \n
+            max_delay (float, optional): Upper bound of any backoff in seconds. Defaults to 30. \n
+            max_fix_attempts (int, optional): Output-fixing requests for a response that does not parse. Defaults to 1. \n
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_fix_attempts = max_fix_attempts
+
+    def backoff(self, attempt : int) -> float:
+        ''' Seconds to wait before the given retry, starting from 1, with full jitter '''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class OutputFixer:
+    '''
+        Asks the llm to correct a response that does not satisfy the format instructions of a parser.
+        A short re-parse request is much cheaper than regenerating the whole response.
+    '''
+
+    def __init__(self, llm, format_instructions : str) -> None:
+        self.llm = llm
+        self.format_instructions = format_instructions
+
+    @cached_property
+    def __chain(self) -> LLMChain:
+        # built on the first fix, most responses parse
+        from langchain import LLMChain
+        from langchain.output_parsers.prompts import NAIVE_FIX_PROMPT
+        return LLMChain(llm=self.llm, prompt=NAIVE_FIX_PROMPT)
+
+    def prompt(self, completion : str, error : Exception) -> str:
+        ''' The rendered fix prompt '''
+        return self.__chain.prompt.format(**self.__inputs(completion, error))
+
+    def fix(self, completion : str, error : Exception, callbacks : Callbacks = None) -> str:
+        ''' Returns the corrected completion '''
+        return self.__chain.run(**self.__inputs(completion, error), callbacks=callbacks)
+
+    async def afix(self, completion : str, error : Exception, callbacks : Callbacks = None) -> str:
+        ''' Returns the corrected completion '''
+        return await self.__chain.arun(**self.__inputs(completion, error), callbacks=callbacks)
+
+    def __inputs(self, completion : str, error : Exception):
+        return {'instructions' : self.format_instructions, 'completion' : completion, 'error' : repr(error)}
+
+
+class FixableOutputError(ValueError):
+    '''
+        A parse error of one value of a dict output, raised by a parser along with the fixer of that value,
+        so that the completions of a sequential chain are each fixed with their own format instructions.
+    '''
+
+    def __init__(self, error : Exception, fix_key : str, fixer : OutputFixer) -> None:
+        super().__init__(str(error))
+        self.error = error
+        self.fix_key = fix_key
+        self.fixer = fixer
@@ -0,0 +1,71 @@
+from __future__ import annotations
+from .ratelimiter import RateLimiter
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:
+    from langchain.llms import BaseLLM
+
+# stages of the operations created by `SystemDesigner`, see `OpenAIOperation.stage`
+STAGES = ('title', 'analyzer', 'storage', 'service', 'generic')
+
+
+class StageModel:
+    '''
+        The model of a design stage along with its completion budget and rate limits, so that
+        lightweight stages (title, requirements) can run on a faster model than the component designs.
+    '''
+
+    def __init__(self,
+            llm : BaseLLM = None,
+            max_tokens : int = None,
+            rate_limiter : RateLimiter = None
+            ) -> None:
+        """
+        Initialize the StageModel object.
+
+        Args:
+            llm (BaseLLM, optional): The llm of the stage. Defaults to None, the llm of the SystemDesigner. \n
+            max_tokens (int, optional): Completion tokens of the stage's requests, the llm is copied with it.
+                Defaults to None, the `max_tokens` of the llm. \n
+            rate_limiter (RateLimiter, optional): Rate limits of the stage. Stages sharing a model (or an API quota) should share
+                a limiter. Defaults to None, the rate limiter of the SystemDesigner. \n
+        """
+        if max_tokens is not None and max_tokens < 1:
+            raise ValueError("max_tokens should be at least 1")
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.rate_limiter = rate_limiter
+
+    def resolve_llm(self, default_llm : BaseLLM) -> BaseLLM:
+        ''' The llm of the stage, with its `max_tokens` '''
+        llm = self.llm if self.llm is not None else default_llm
+        if self.max_tokens is None:
+            return llm
+        # an llm left with its default max_tokens is copied too, a `TokenBudget` only keeps those set on purpose
+        if getattr(llm, 'max_tokens', None) == self.max_tokens and 'max_tokens' in getattr(llm, '__fields_set__', ()):
+            return llm
+        return with_max_tokens(llm, self.max_tokens)
+
+
+def with_max_tokens(llm : BaseLLM, max_tokens : int) -> BaseLLM:
+    ''' A copy of the llm with another `max_tokens` '''
+    if not hasattr(llm, 'max_tokens'):
+        raise ValueError(f"{type(llm).__name__} has no max_tokens to be set")
+    copy = llm.copy(update={'max_tokens' : max_tokens})
+    # `copy` drops the fields excluded from serialization (e.g. the callbacks of a LangChain llm) and rebuilds 
+    # the dict fields, the copy shares them with the llm instead, e.g. the request counts of a `FakeDesignLLM`
+    for name in getattr(llm, '__fields__', {}):
+        if name != 'max_tokens':
+            copy.__dict__[name] = getattr(llm, name)
+    return copy
+
+
+def validate_stage_models(stage_models : Optional[Dict[str, StageModel]]) -> Dict[str, StageModel]:
+    ''' The stage models by stage, raises a ValueError for an unknown stage '''
+    stage_models = dict(stage_models or {})
+    for stage, stage_model in stage_models.items():
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage!r}, should be one of {STAGES}")
+        if not isinstance(stage_model, StageModel):
+            raise TypeError(f"The model of stage {stage!r} should be a StageModel")
+    return stage_models
@@ -0,0 +1,197 @@
+from collections import OrderedDict
+from langchain.embeddings.base import Embeddings
+from threading import Lock
+from typing import Any, Dict, List, Optional
+import hashlib
+import re
+import numpy as np
+
+DEFAULT_DIMENSIONS = 512
+# for the embeddings of a model: problems differing by a negation, a clause or a name still score 0.9-0.95, 
+# too close to their rewordings for a lower threshold to be safe
+DEFAULT_THRESHOLD = 0.97
+# float32 rounding, the same text does not always score exactly 1
+TOLERANCE = 1e-5
+
+
+class HashingEmbedder(Embeddings):
+    '''
+        Offline embedder hashing the words, word bigrams and character trigrams of a text into a fixed size vector.
+        It measures the words two texts share, not their meaning: "pay online" and "pay offline" score 0.9, and a long problem 
+        with "without" instead of "with" 0.98. Only texts equal up to case, punctuation and whitespace score 1, 
+        the only threshold a `SemanticCache` accepts with it.
+    '''
+
+    # similar embeddings do not mean similar texts, see `SemanticCache`
+    lexical = True
+
+    def __init__(self, dimensions : int = DEFAULT_DIMENSIONS) -> None:
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts : List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text : str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self.__features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            # the sign bit keeps colliding features from only ever adding up
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        return vector.tolist()
+
+    def __features(self, text : str) -> List[str]:
+        words = re.findall(r'\w+', text.lower())
+        features = list(words)
+        features += [f"{first} {second}" for first, second in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        return features
+
+
+class SemanticCache:
+    '''
+        Near-duplicate cache of LLM responses. Texts are embedded and matched by cosine similarity
+        against a brute-force NumPy index, so a slightly reworded problem statement or a recurring
+        component reuses an earlier response instead of a new request.
+        Entries are matched only within the same namespace, e.g. the same prompt and cloud provider.
+    '''
+
+    def __init__(self,
+            embedder : Embeddings,
+            threshold : float = DEFAULT_THRESHOLD,
+            max_entries : int = 1024
+            ) -> None:
+        """
+        Initialize the SemanticCache object.
+
+        Args:
+            embedder (Embeddings): LangChain embeddings of a model, e.g. `OpenAIEmbeddings`, or a `HashingEmbedder` 
+                to match only the texts equal up to case, punctuation and whitespace offline. \n
+            threshold (float, optional): Minimum cosine similarity of a near-duplicate, between 0 and 1, 
+                1 with a `HashingEmbedder`. Defaults to 0.97. \n
+            max_entries (int, optional): Least recently used entries are evicted beyond this size. Defaults to 1024. \n
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold should be in (0, 1]")
+        if max_entries < 1:
+            raise ValueError("max_entries should be at least 1")
+        if getattr(embedder, 'lexical', False) and threshold < 1:
+            raise ValueError(f"{type(embedder).__name__} scores distinct problems above any threshold below 1, "
+                             "use the embeddings of a model for near-duplicates")
+
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = Lock()
+        # rows of unit vectors, allocated on the first entry once the dimensions are known
+        self.__vectors : Optional[np.ndarray] = None
+        self.__namespace_ids = np.full(max_entries, -1, dtype=np.int64)
+        self.__last_used = np.zeros(max_entries, dtype=np.int64)
+        self.__values : List[Any] = [None] * max_entries
+        self.__namespaces : Dict[str, int] = {}
+        self.__size = 0
+        self.__clock = 0
+        # recent embeddings, a lookup miss is usually followed by a store of the same text
+        self.__embeddings : OrderedDict = OrderedDict()
+
+    def get(self, namespace : str, text : str) -> Optional[Any]:
+        """
+        Looks up the response of the most similar text of the namespace.
+
+        Args:
+            namespace (str): Exact-match part of the key, e.g. a hash of the prompt template.
+            text (str): The text matched by similarity.
+
+        Returns:
+            Any: The response of the nearest entry, None if no entry reaches the threshold.
+        """
+        vector = self.__embed(text)
+        with self.__lock:
+            slot, similarity = self.__nearest(namespace, vector)
+            if slot is None or similarity < self.threshold - TOLERANCE:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.__touch(slot)
+            return self.__values[slot]
+
+    def set(self, namespace : str, text : str, value : Any) -> None:
+        """
+        Stores a response, replacing a near-duplicate entry or else the least recently used one if the cache is full.
+
+        Args:
+            namespace (str): Exact-match part of the key.
+            text (str): The text matched by similarity.
+            value (Any): The response.
+        """
+        vector = self.__embed(text)
+        with self.__lock:
+            if self.__vectors is None:
+                self.__vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+            slot, similarity = self.__nearest(namespace, vector)
+            if slot is None or similarity < self.threshold - TOLERANCE:
+                if self.__size < self.max_entries:
+                    slot = self.__size
+                    self.__size += 1
+                else:
+                    slot = int(np.argmin(self.__last_used))
+
+            self.__vectors[slot] = vector
+            self.__namespace_ids[slot] = self.__namespaces.setdefault(namespace, len(self.__namespaces))
+            self.__values[slot] = value
+            self.__touch(slot)
+
+    def clear(self) -> None:
+        ''' Removes all the entries and resets the counters '''
+        with self.__lock:
+            self.__vectors = None
+            self.__namespace_ids[:] = -1
+            self.__last_used[:] = 0
+            self.__values = [None] * self.max_entries
+            self.__namespaces.clear()
+            self.__size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def __nearest(self, namespace : str, vector : np.ndarray):
+        # slot and cosine similarity of the nearest entry of the namespace, (None, 0) if it has none
+        namespace_id = self.__namespaces.get(namespace)
+        if namespace_id is None or self.__size == 0:
+            return None, 0.0
+
+        similarities = self.__vectors[:self.__size] @ vector
+        similarities[self.__namespace_ids[:self.__size] != namespace_id] = -np.inf
+        slot = int(np.argmax(similarities))
+        if similarities[slot] == -np.inf:
+            return None, 0.0
+        return slot, float(similarities[slot])
+
+    def __touch(self, slot : int) -> None:
+        self.__clock += 1
+        self.__last_used[slot] = self.__clock
+
+    def __embed(self, text : str) -> np.ndarray:
+        with self.__lock:
+            if text in self.__embeddings:
+                self.__embeddings.move_to_end(text)
+                return self.__embeddings[text]
+
+        vector = np.asarray(self.embedder.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+
+        with self.__lock:
+            self.__embeddings[text] = vector
+            while len(self.__embeddings) > 64:
+                self.__embeddings.popitem(last=False)
+        return vector
@@ -1,37 +1,88 @@
+from __future__ import annotations
 from .openaioperation import OpenAIOperation
-from .base import BaseComponentDesigner
-from langchain.llms import BaseLLM
+from .retry import OutputFixer
+from .base import BaseComponentDesigner, render_component, similarity_key
 from ..models import Component, ServiceComponent
-from langchain import PromptTemplate, LLMChain
-from ..prompts import Prompts
-from typing import Dict
-from langchain.output_parsers import PydanticOutputParser
+from ..prompts import Prompts, PromptMode, compact_prompt
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict
+
+if TYPE_CHECKING:
+    from ..chains import BudgetedLLMChain
+    from langchain.llms import BaseLLM
+    from langchain.output_parsers import PydanticOutputParser
+    from langchain.callbacks.manager import Callbacks
 
 class ServiceComponentDesigner(BaseComponentDesigner, OpenAIOperation):
     '''Designs a Service component based on the provided component details'''
 
+    stage = 'service'
+    uses_cloud_provider = False
+
     def __init__(self,
             llm : BaseLLM,
-            verbose : bool = False
+            verbose : bool = False,
+            prompt_mode : str = PromptMode.FULL
             ) -> None:
         
-        self.__parser = PydanticOutputParser(pydantic_object=ServiceComponent)
-        prompt = PromptTemplate(template=  Prompts.ServiceComponentDesignerPrompt,
+        self.llm = llm
+        self.verbose = verbose
+        self.prompt_mode = prompt_mode
+
+    @cached_property
+    def __parser(self) -> PydanticOutputParser:
+        from langchain.output_parsers import PydanticOutputParser
+        return PydanticOutputParser(pydantic_object=ServiceComponent)
+
+    @cached_property
+    def __llm_chain(self) -> BudgetedLLMChain:
+        from langchain import PromptTemplate
+        from ..chains import BudgetedLLMChain
+        prompt = PromptTemplate(template=  compact_prompt(Prompts.ServiceComponentDesignerPrompt, self.prompt_mode),
                                 input_variables=['component'],
                                 partial_variables={"format_instructions": self.__parser.get_format_instructions()})
-        self.__llm_chain = LLMChain(prompt=prompt, llm=llm, verbose=verbose)
+        return BudgetedLLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose, operation=self)
 
+    @cached_property
+    def __fixer(self) -> OutputFixer:
+        return OutputFixer(llm=self.llm, format_instructions=self.__parser.get_format_instructions())
     
     def design(self,
                component : Component,
                cloud_provider : str = 'Any',
-               additional_input : Dict[str,str] = None):
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
 
-        if component.component_type != 'Service':
-            raise ValueError("This Designer is suitable for Service Components only")
-        
-        output = self.__llm_chain.run(component = str(component))
-        return self.__parser.parse(output)
+        self.validate(component, cloud_provider, additional_input)
+        return self._design(component, cloud_provider, additional_input, callbacks)
+
+    async def adesign(self,
+               component : Component,
+               cloud_provider : str = 'Any',
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+
+        self.validate(component, cloud_provider, additional_input)
+        return await self._adesign(component, cloud_provider, additional_input, callbacks)
+
+    def _design(self,
+               component : Component,
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+        return self._run_chain(self.__llm_chain, {'component' : render_component(component, self.prompt_mode)}, parser=self.__parser.parse, 
+                               callbacks=callbacks, component=component.name, fixer=self.__fixer, similar=similarity_key(component))
+
+    async def _adesign(self,
+               component : Component,
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+        return await self._arun_chain(self.__llm_chain, {'component' : render_component(component, self.prompt_mode)}, parser=self.__parser.parse, 
+                                      callbacks=callbacks, component=component.name, fixer=self.__fixer, similar=similarity_key(component))
+
+    def supports(self, component_type : str) -> bool:
+        return component_type == 'Service'
     
     def get_request_count(self):
         return 1
\ No newline at end of file
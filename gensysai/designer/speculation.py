@@ -0,0 +1,100 @@
+from ..models import Component, System
+from .checkpoint import CheckpointStore
+from threading import Event, Lock
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+
+# stock components of almost every analyzed system, `ComponentIdentifierPrompt` mandates the Storage
+SPECULATIVE_TYPES = ('Storage', 'Load Balancer', 'Cache')
+
+# responsibilities of the speculative components, the problem statement stands in for the functional requirements
+DESCRIPTIONS = {
+    'Storage' : "Stores all the data of the system below, each kind of data in the database suited to it.",
+    'Load Balancer' : "Distributes the incoming requests of the system below across the instances of its services.",
+    'Cache' : "Caches the frequently read data of the system below, to cut the latency and the load of the storage.",
+}
+
+
+def speculative_component(problem_statement : str, component_type : str) -> Component:
+    ''' A component of the type described from the raw problem statement, designed before the analysis identifies the actual one '''
+    description = DESCRIPTIONS.get(component_type, f"The {component_type} of the system below.")
+    return Component(name=component_type, component_type=component_type, description=f"{description}\n{problem_statement}")
+
+
+def reconcile(system : System, component_types : Tuple[str, ...]) -> Set[int]:
+    ''' Indexes of the components a speculative design stands for: the only component of a speculated type '''
+    indexes : Dict[str, List[int]] = {}
+    for i, component in enumerate(system.components):
+        if component.component_type in component_types:
+            indexes.setdefault(component.component_type, []).append(i)
+    # several components of a type split its responsibilities, a design of the whole layer matches none of them
+    return {matching[0] for matching in indexes.values() if len(matching) == 1}
+
+
+class Speculation:
+    '''
+        The speculative designs of a design in flight, as futures (or asyncio tasks) by (component type, cloud provider).
+        Those reused for components of the analysis are taken, the others are cancelled, or discarded once completed.
+        A running design is not interrupted by `close`, it makes no more requests, see `recorder.CancellationHandler`,
+        and saves no checkpoint.
+    '''
+
+    def __init__(self, executor : Any = None) -> None:
+        """
+        Initialize the Speculation object.
+
+        Args:
+            executor (Executor, optional): The executor of the futures, shut down by `close`. Defaults to None (asyncio tasks). \n
+        """
+        self.executor = executor
+        # set by `close`, the running designs stop before their next request
+        self.cancelled = Event()
+        # a checkpoint is saved before `close` returns or not at all, the keys discarded after it stay discarded
+        self.__lock = Lock()
+        # (component type, cloud provider) -> (checkpoint key, future)
+        self.__pending : Dict[Tuple[str, Optional[str]], Tuple[str, Any]] = {}
+        self.__taken : List[Any] = []
+
+    def add(self, component_type : str, cloud_provider : Optional[str], key : str, future : Any) -> None:
+        self.__pending[(component_type, cloud_provider)] = (key, future)
+
+    def take(self, component_type : str, cloud_provider : Optional[str]) -> Optional[Tuple[str, Any]]:
+        ''' The (checkpoint key, future) of the speculative design of a type, None if there is none or it is taken '''
+        speculated = self.__pending.pop((component_type, cloud_provider), None)
+        if speculated is not None:
+            self.__taken.append(speculated[1])
+        return speculated
+
+    def discard(self) -> int:
+        ''' Cancels the speculative designs not taken, returns their number '''
+        discarded = len(self.__pending)
+        for _, future in self.__pending.values():
+            future.cancel()
+        self.__pending.clear()
+        return discarded
+
+    def save(self, checkpoints : CheckpointStore, key : str, stage : Any) -> bool:
+        ''' Saves the checkpoint of a completed speculative design, unless the speculation is closed '''
+        with self.__lock:
+            if self.cancelled.is_set():
+                return False
+            checkpoints.save(key, stage)
+            return True
+
+    async def asave(self, checkpoints : CheckpointStore, key : str, stage : Any) -> bool:
+        ''' Same as `save` off the event loop, like `CheckpointStore.asave` '''
+        if self.cancelled.is_set():
+            return False
+        if checkpoints.directory is None:
+            return self.save(checkpoints, key, stage)
+        return await asyncio.get_running_loop().run_in_executor(None, self.save, checkpoints, key, stage)
+
+    def close(self) -> None:
+        ''' Cancels every unfinished speculative design, e.g. of an abandoned design, the running ones stop before their next request '''
+        with self.__lock:
+            self.cancelled.set()
+        self.discard()
+        for future in self.__taken:
+            future.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,38 +1,76 @@
-from .base import BaseComponentDesigner
-from langchain.llms import BaseLLM
+from __future__ import annotations
+from .base import BaseComponentDesigner, render_component, similarity_key
 from ..models import Component
-from langchain import PromptTemplate, LLMChain
-from ..prompts import Prompts
-from typing import Dict
+from ..prompts import Prompts, PromptMode, compact_prompt
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict
 from .openaioperation import OpenAIOperation
 
+if TYPE_CHECKING:
+    from ..chains import BudgetedLLMChain
+    from langchain.llms import BaseLLM
+    from langchain.callbacks.manager import Callbacks
+
 class StorageComponentDesigner(BaseComponentDesigner, OpenAIOperation):
     '''
         Designs a Storage Component based on the component details
     '''
+    stage = 'storage'
+
     def __init__(self,
             llm : BaseLLM,
-            verbose : bool = False
+            verbose : bool = False,
+            prompt_mode : str = PromptMode.FULL
             ) -> None:
         
-        prompt = PromptTemplate(template= Prompts.StorageComponentDesignerPrompt,
-                                input_variables=['component', 'cloud_provider'])
-        self.__llm_chain = LLMChain(prompt=prompt, llm=llm, verbose=verbose)
+        self.llm = llm
+        self.verbose = verbose
+        self.prompt_mode = prompt_mode
 
+    @cached_property
+    def __llm_chain(self) -> BudgetedLLMChain:
+        from langchain import PromptTemplate
+        from ..chains import BudgetedLLMChain
+        prompt = PromptTemplate(template= compact_prompt(Prompts.StorageComponentDesignerPrompt, self.prompt_mode),
+                                input_variables=['component', 'cloud_provider'])
+        return BudgetedLLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose, operation=self)
     
     def design(self,
                component : Component,
                cloud_provider : str = 'Any',
-               additional_input : Dict[str,str] = None):
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
 
-        if component.component_type != 'Storage':
-            raise ValueError("This Designer is suitable for Storage Components only")
-        
-        if cloud_provider not in ['AWS', 'Azure', 'GCP', 'Any']:
-            raise ValueError("Cloud Provider should be from ['AWS', 'Azure', 'GCP', 'Any']")
+        self.validate(component, cloud_provider, additional_input)
+        return self._design(component, cloud_provider, additional_input, callbacks)
+
+    async def adesign(self,
+               component : Component,
+               cloud_provider : str = 'Any',
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+
+        self.validate(component, cloud_provider, additional_input)
+        return await self._adesign(component, cloud_provider, additional_input, callbacks)
+
+    def _design(self,
+               component : Component,
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+        return self._run_chain(self.__llm_chain, {'component' : render_component(component, self.prompt_mode), 'cloud_provider' : cloud_provider}, 
+                               callbacks=callbacks, component=component.name, similar=similarity_key(component, cloud_provider))
+
+    async def _adesign(self,
+               component : Component,
+               cloud_provider : str,
+               additional_input : Dict[str,str] = None,
+               callbacks : Callbacks = None):
+        return await self._arun_chain(self.__llm_chain, {'component' : render_component(component, self.prompt_mode), 'cloud_provider' : cloud_provider}, 
+                                      callbacks=callbacks, component=component.name, similar=similarity_key(component, cloud_provider))
 
-        output = self.__llm_chain.run(component = str(component), cloud_provider=cloud_provider)
-        return output
+    def supports(self, component_type : str) -> bool:
+        return component_type == 'Storage'
     
     def get_request_count(self):
         return 1
\ No newline at end of file
@@ -1,14 +1,37 @@
-from langchain.llms import BaseLLM
+from __future__ import annotations
 from .storage import StorageComponentDesigner
 from .service import ServiceComponentDesigner
 from .designer import GenericComponentDesigner
 from .analyzer import ProblemAnalyzer
 from .titlegen import TitleGenerator
-from ..designdoc import DesignedComponent, DesignDocument
-import time
+from .base import BaseComponentDesigner, validate_cloud_provider
+from .registry import DesignerRegistry
+from .ratelimiter import RateLimiter
+from .routing import StageModel, validate_stage_models
+from .budget import TokenBudget
+from .cache import ResponseCache
+from .openaioperation import OpenAIOperation
+from .batch import BatchCheckpoint, safe_filename
+from .checkpoint import CheckpointStore, content_key, stage_identity
+from .speculation import Speculation, reconcile, speculative_component
+from .retry import RetryPolicy, is_transient_error
+from ..designdoc import DesignedComponent, DesignDocument, DesignEvent, DesignRecord
+from ..instrumentation import add_callback_handler
+from ..export import OUTPUT_FORMATS, DesignStreamWriter, render_markdown
+from ..models import Component, System
+from ..prompts import PromptMode
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from functools import partial
+from threading import Lock
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+import asyncio
+import os
 
-SLEEP_TIME_IN_SECONDS = 65
-RPM_COUNT = 15
+if TYPE_CHECKING:
+    from langchain.llms import BaseLLM
+    from langchain.callbacks.manager import Callbacks
+    from .semantic import SemanticCache
+    from ..recorder import RunRecorder
 
 class SystemDesigner:
     ''' The SystemDesigner class handles the entire design of the system '''
@@ -20,6 +43,20 @@ class SystemDesigner:
             storage_designer : StorageComponentDesigner = None,
             service_designer : ServiceComponentDesigner = None,
             misc_designer : GenericComponentDesigner = None,
+            designers : Dict[str, BaseComponentDesigner] = None,
+            max_concurrency : int = 1,
+            rate_limiter : RateLimiter = None,
+            stage_models : Dict[str, StageModel] = None,
+            cache : ResponseCache = None,
+            semantic_cache : SemanticCache = None,
+            token_budget : TokenBudget = None,
+            fuse_title : bool = False,
+            batch_size : int = 1,
+            instrument : bool = True,
+            retry_policy : RetryPolicy = None,
+            checkpoints : CheckpointStore = None,
+            speculative_types : Iterable[str] = None,
+            prompt_mode : str = PromptMode.FULL,
             verbose: bool = False
             ) -> None:
         """
@@ -31,87 +68,838 @@ class SystemDesigner:
             problem_analyzer (ProblemAnalyzer, optional): The ProblemAnalyzer object. Defaults to None. \n
             storage_designer (StorageComponentDesigner, optional): The StorageComponentDesigner object. Defaults to None. \n
             service_designer (ServiceComponentDesigner, optional): The ServiceComponentDesigner object. Defaults to None. \n
-            misc_designer (GenericComponentDesigner, optional): The GenericComponentDesigner object. Defaults to None.\n
+            misc_designer (GenericComponentDesigner, optional): The GenericComponentDesigner object, also the designer of unregistered component types. Defaults to None.\n
+            designers (Dict[str, BaseComponentDesigner], optional): Designers of further component types, or replacements of the above, 
+                by component type. Defaults to None.\n
+            max_concurrency (int, optional): Maximum number of components designed in parallel. Defaults to 1 (sequential).\n
+            rate_limiter (RateLimiter, optional): Rate limiter for all the operations. Defaults to None, the limiter shared by all designers.\n
+            stage_models (Dict[str, StageModel], optional): Model, max_tokens and rate limiter of a stage, by stage name among 
+                `routing.STAGES`, e.g. a faster model for 'title' and 'analyzer'. The model of a stage applies to the operations 
+                created here, its rate limiter also to a provided one. Defaults to None, `llm` and `rate_limiter` for every stage.\n
+            cache (ResponseCache, optional): Cache of LLM responses for all the operations. Defaults to None (no caching).\n
+            semantic_cache (SemanticCache, optional): Near-duplicate cache of problem analyses, titles and component designs, 
+                checked after an exact cache miss. Defaults to None.\n
+            token_budget (TokenBudget, optional): Picks the max_tokens of every request from its stage and prompt size, and continues 
+                truncated completions. A max_tokens given to `llm` or a `StageModel` takes priority over its defaults, 
+                see `TokenBudget.stage_tokens`. Defaults to None (the max_tokens of the llms).\n
+            fuse_title (bool, optional): Generates the title within the problem analysis, saving one request per design. 
+                Ignored if a problem_analyzer is provided, its `with_title` flag is used instead. Defaults to False.\n
+            batch_size (int, optional): Generic components (e.g. Cache, Load Balancer) designed in a single request, 
+                ignored if a misc_designer is provided. Defaults to 1 (one request per component).\n
+            instrument (bool, optional): Records wall time, requests and tokens of every stage in `DesignDocument.run_report`. Defaults to True.\n
+            retry_policy (RetryPolicy, optional): Retries of transient errors and fixes of unparsable responses for all the operations. 
+                Defaults to None, the default policy of the operations.\n
+            checkpoints (CheckpointStore, optional): Completed stages by the content hash of their inputs. A retry or a re-design 
+                only requests the stages whose inputs changed, e.g. after a change of cloud provider the components of designers 
+                using it, see `BaseComponentDesigner.uses_cloud_provider`. Share it between designers of different providers. 
+                Defaults to None, the stages of a design are only kept until it completes, for a retry of a failed design.\n
+            speculative_types (Iterable[str], optional): Component types designed from the raw problem statement while it is 
+                analyzed, e.g. `speculation.SPECULATIVE_TYPES`. The design of a type is reused for the only component of that 
+                type in the analysis, the others are cancelled or discarded: extra requests for a shorter critical path. 
+                Defaults to None (components are designed after the analysis).\n
+            prompt_mode (str, optional): Compaction of the prompts of the operations created here, one of `PromptMode.ALL`, 
+                see `compact_prompt`. Defaults to `PromptMode.FULL`.\n
             verbose (bool, optional): Verbose mode flag. Defaults to False.\n
         """
 
+        validate_cloud_provider(cloud_provider)
         self.llm = llm
         self.cloud_provider = cloud_provider
-        self.problem_analyzer = problem_analyzer if problem_analyzer is not None else ProblemAnalyzer(llm=self.llm, verbose=verbose)
-        self.storage_designer = storage_designer if storage_designer is not None else StorageComponentDesigner(llm=self.llm, verbose=verbose) 
-        self.service_designer = service_designer if service_designer is not None else ServiceComponentDesigner(llm=self.llm, verbose=verbose) 
-        self.misc_designer = misc_designer if misc_designer is not None else GenericComponentDesigner(llm=self.llm, verbose=verbose) 
-        self.title_generator = TitleGenerator(llm=llm, verbose=verbose)
+        self.stage_models = validate_stage_models(stage_models)
+        self.problem_analyzer = problem_analyzer if problem_analyzer is not None else ProblemAnalyzer(llm=self.__stage_llm('analyzer'), verbose=verbose, with_title=fuse_title, prompt_mode=prompt_mode)
+        self.storage_designer = storage_designer if storage_designer is not None else StorageComponentDesigner(llm=self.__stage_llm('storage'), verbose=verbose, prompt_mode=prompt_mode) 
+        self.service_designer = service_designer if service_designer is not None else ServiceComponentDesigner(llm=self.__stage_llm('service'), verbose=verbose, prompt_mode=prompt_mode) 
+        self.misc_designer = misc_designer if misc_designer is not None else GenericComponentDesigner(llm=self.__stage_llm('generic'), verbose=verbose, prompt_mode=prompt_mode, batch_size=batch_size) 
+        self.title_generator = TitleGenerator(llm=self.__stage_llm('title'), verbose=verbose, prompt_mode=prompt_mode)
+
+        # component type -> designer, custom types are plugged in here
+        self.registry = DesignerRegistry(default=self.misc_designer)
+        self.registry.register("Storage", self.storage_designer)
+        self.registry.register("Service", self.service_designer)
+        self.registry.register("Cache", self.misc_designer)
+        self.registry.register("Load Balancer", self.misc_designer)
+        for component_type, designer in (designers or {}).items():
+            self.registry.register(component_type, designer)
+
         self.design_doc = None
         self.verbose = verbose
+        self.instrument = instrument
+
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency should be at least 1")
+        self.max_concurrency = max_concurrency
+
+        # OpenAI rate limiting is done by each operation, a limiter given here overrides the shared one
+        if rate_limiter is not None:
+            for operation in self.operations():
+                operation.rate_limiter = rate_limiter
+        # a stage with its own budget leaves the capacity of the others free
+        for operation in self.operations():
+            stage_model = self.stage_models.get(operation.stage)
+            if stage_model is not None and stage_model.rate_limiter is not None:
+                operation.rate_limiter = stage_model.rate_limiter
+        if cache is not None:
+            for operation in self.operations():
+                operation.cache = cache
+        if semantic_cache is not None:
+            for operation in self.operations():
+                operation.semantic_cache = semantic_cache
+        if token_budget is not None:
+            for operation in self.operations():
+                operation.token_budget = token_budget
+        if retry_policy is not None:
+            for operation in self.operations():
+                operation.retry_policy = retry_policy
+
+        self.checkpoints = checkpoints if checkpoints is not None else CheckpointStore()
+        # reusing stages across designs is opt-in, a store of the designer's own only serves the retries
+        self.__keep_stages = checkpoints is not None
+        self.speculative_types = tuple(dict.fromkeys(speculative_types or ()))
 
         # OpenAI request tracker
-        self.track_request = True
         self.current_request_count = 0
+        self.__request_lock = Lock()
+
+    def __stage_llm(self, stage : str) -> BaseLLM:
+        stage_model = self.stage_models.get(stage)
+        return stage_model.resolve_llm(self.llm) if stage_model is not None else self.llm
 
     def design(self, 
-            problem_statement : str
+            problem_statement : str,
+            cloud_providers : List[str] = None
             ) -> str:
         """
         Design the system based on the provided problem statement.
 
         Args:
             problem_statement (str): The problem statement.
+            cloud_providers (List[str], optional): Compares these cloud providers in one design, see `design_iter`.
 
         Returns:
             str: The design document.
         """
 
-        self.design_doc = DesignDocument()
-        self.design_doc.title = self.title_generator.generate_title(problem_statement)
-        self.design_doc.problem_statement = problem_statement
-        self.current_request_count += self.title_generator.get_request_count()
+        self.design_doc = self._design(problem_statement, cloud_providers)
+        return self.design_doc
+
+    def design_many(self,
+            problems : Iterable[Tuple[str, str]],
+            max_workers : int = 4,
+            output_dir : str = None,
+            checkpoint : BatchCheckpoint = None,
+            output_format : str = 'md',
+            cloud_providers : List[str] = None
+            ) -> Iterator[Tuple[str, Optional[DesignDocument], Optional[Exception]]]:
+        """
+        Designs several problems concurrently, all of them share the rate limiter of the operations.
+        Problems are consumed lazily, so the input can be streamed from a large file.
+
+        Args:
+            problems (Iterable[Tuple[str, str]]): (problem id, problem statement) pairs, see `read_problems`.
+            max_workers (int, optional): Number of problems designed in parallel. Defaults to 4.
+            output_dir (str, optional): If provided, each design is written to `<output_dir>/<problem id>.md` as soon as it finishes.
+            checkpoint (BatchCheckpoint, optional): Problems completed in a previous run are skipped, newly completed ones are recorded.
+            output_format (str, optional): 'md' writes `<problem id>.md` once a design finishes, 'json' streams the sections 
+                of each design to `<problem id>.jsonl` as they complete, see `export.load_design`. Defaults to 'md'.
+            cloud_providers (List[str], optional): Compares these cloud providers in each design, see `design_iter`.
+
+        Returns:
+            Iterator[Tuple[str, DesignDocument, Exception]]: (problem id, design doc, error) in the order of completion. 
+            Either the design doc or the error is None.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers should be at least 1")
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format should be one of {OUTPUT_FORMATS}")
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        cloud_providers = self.__validate_cloud_providers(cloud_providers)
+
+        pending = set()
+        problems = iter(problems)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                # keep a bounded number of problems in flight instead of reading the whole input
+                for problem_id, problem_statement in problems:
+                    if checkpoint is not None and checkpoint.is_completed(problem_id):
+                        self._debug(f"Skipping completed problem {problem_id}.")
+                        continue
+                    pending.add(executor.submit(self.__design_batch_item, problem_id, problem_statement, output_dir, output_format, cloud_providers))
+                    if len(pending) >= 2 * max_workers:
+                        break
+
+                if not pending:
+                    return
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    problem_id, design_doc, error = future.result()
+                    if error is None and checkpoint is not None:
+                        checkpoint.mark_completed(problem_id)
+                    yield problem_id, design_doc, error
 
+    def __design_batch_item(self, 
+            problem_id : str, 
+            problem_statement : str, 
+            output_dir : str = None,
+            output_format : str = 'md',
+            cloud_providers : List[str] = None
+            ) -> Tuple[str, Optional[DesignDocument], Optional[Exception]]:
         try:
-            system = self.problem_analyzer.analyze(problem=problem_statement)
+            if output_dir is not None and output_format == 'json':
+                # the sections are saved as they complete, a failed design keeps the completed ones
+                path = os.path.join(output_dir, f"{safe_filename(problem_id)}.jsonl")
+                with DesignStreamWriter(path, problem_statement) as writer:
+                    design_doc = self.__design_from(writer.tee(self.design_iter(problem_statement, cloud_providers=cloud_providers)))
+            else:
+                design_doc = self._design(problem_statement, cloud_providers)
         except Exception as e:
-            raise ValueError(f"Sorry. It does not seem like a valid system design problem. Please rephrase your question.")
-        
-        self.current_request_count += self.problem_analyzer.get_request_count()
-        self._debug("Problem analysis is completed...")
+            self._debug(f"Design failed for problem {problem_id}: {e}")
+            return problem_id, None, e
+
+        if output_dir is not None and output_format == 'md':
+            path = os.path.join(output_dir, f"{safe_filename(problem_id)}.md")
+            with open(path, 'w') as file:
+                file.write(self.generate_markdown(design_doc))
+        return problem_id, design_doc, None
+
+    def _design(self, problem_statement : str, cloud_providers : List[str] = None) -> DesignDocument:
+        """
+        Designs the system without touching the designer's state other than the request count,
+        so that several problems can be designed concurrently.
+
+        Args:
+            problem_statement (str): The problem statement.
+            cloud_providers (List[str], optional): Compares these cloud providers in one design, see `design_iter`.
+
+        Returns:
+            DesignDocument: The design document.
+        """
+        return self.__design_from(self.design_iter(problem_statement, cloud_providers=cloud_providers))
+
+    def __design_from(self, events : Iterator[Tuple[str, Any]]) -> DesignDocument:
+        for event, payload in events:
+            if event == DesignEvent.DONE:
+                return payload
+
+    def design_iter(self, 
+            problem_statement : str, 
+            callbacks : Callbacks = None,
+            cloud_providers : List[str] = None
+            ) -> Iterator[Tuple[str, Any]]:
+        """
+        Designs the system and yields each section as soon as it is completed.
+
+        Args:
+            problem_statement (str): The problem statement.
+            callbacks (Callbacks, optional): LangChain callbacks passed to every LLM call, e.g. for token streaming.
+            cloud_providers (List[str], optional): Compares these cloud providers in one design instead of `cloud_provider`. 
+                The title, the analysis and the components of designers ignoring the provider are designed once, the others 
+                once per provider and tagged with it, see `DesignedComponent.cloud_provider`. Defaults to None.
+
+        Returns:
+            Iterator[Tuple[str, Any]]: (event, payload) pairs, see `DesignEvent`. `DesignEvent.COMPONENT` events 
+            come in the order of completion, the final `DesignEvent.DONE` payload is the DesignDocument 
+            with the components in a stable order.
+        """
+        cloud_providers = self.__validate_cloud_providers(cloud_providers)
+        design_doc, callbacks, recorder = self.__start_run(problem_statement, callbacks, cloud_providers)
+
+        # stages are keyed by the content hash of their inputs, those of a previous design
+        # (or a failed attempt) with the same inputs are reused instead of requested again
+        record = design_doc.dependencies = DesignRecord(analysis=self.__analysis_key(problem_statement))
+        analysis = self.__parsed_analysis(self.__saved(record, record.analysis))
+        # likely components are designed from the problem statement while it is analyzed, see `speculative_types`
+        speculation = self.__speculate(problem_statement, record, cloud_providers, callbacks) if analysis is None else None
+
+        try:
+            # the title does not depend on the analysis, both requests are in flight together
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                pending_analysis = None
+                if analysis is None:
+                    pending_analysis = executor.submit(self.__analyze, problem_statement, record.analysis, callbacks)
+
+                if not self.problem_analyzer.with_title:
+                    record.title = self.__title_key(problem_statement)
+                    design_doc.title = self.__saved(record, record.title)
+                    if design_doc.title is None:
+                        design_doc.title = executor.submit(self.__generate_title, problem_statement, record.title, callbacks).result()
+                    yield DesignEvent.TITLE, design_doc.title
+
+                if pending_analysis is not None:
+                    analysis = pending_analysis.result()
+            title, system = analysis
+            self._debug("Problem analysis is completed...")
+
+            if self.problem_analyzer.with_title:
+                design_doc.title = title
+                yield DesignEvent.TITLE, design_doc.title
 
-        self.design_doc.functional_requirement = system.functional_requirements
+            design_doc.functional_requirement = system.functional_requirements
+            yield DesignEvent.FUNCTIONAL_REQUIREMENTS, design_doc.functional_requirement
 
-        # Wait as OpenAI apis are ratelimited
-        self.wait_if_tracked()
 
+            ## TODO: algorithm for ordered components
+            # design services first and then the storage.
+            # Components are independent of each other, so they are fanned out to a
+            # thread pool when max_concurrency > 1. Components of a batching designer share a request.
+            targets, keys = self.__component_targets(problem_statement, system, record, cloud_providers)
+            stages = {key : self.checkpoints.get(key) for key in keys}
+            targets, designed, units, speculated = self.__plan_components(problem_statement, system, record, targets, stages, speculation)
+            for i in sorted(designed):
+                yield DesignEvent.COMPONENT, designed[i]
 
-        ## TODO: algorithm for ordered components
-        # design services first and then the storage.
-        for component in system.components:
-            designed_component = DesignedComponent()
-            designed_component.name = component.name
-            self._debug(f"Design started for component {component.name}.")
+            def design_unit(indexes : List[int]) -> List[Tuple[int, DesignedComponent]]:
+                return self.__design_unit(system, record, targets, indexes, callbacks)
 
-            if component.component_type == "Storage":
-                design = self.storage_designer.design(component=component, cloud_provider=self.cloud_provider)
-                designed_component.design = design
-                self.current_request_count += self.storage_designer.get_request_count()
-            
-            elif component.component_type == "Service":
-                design = self.service_designer.design(component=component, cloud_provider=self.cloud_provider)
-                designed_component.design = str(design)
-                self.current_request_count += self.service_designer.get_request_count()
+            def design_speculated(position : int) -> List[Tuple[int, DesignedComponent]]:
+                reused = self.__reuse_speculated(system, record, targets, position, speculated[position].result())
+                return reused if reused is not None else design_unit([position])
 
+            # the speculative designs started first, they are likely completed first
+            jobs = [partial(design_speculated, position) for position in speculated] + [partial(design_unit, unit) for unit in units]
+            if self.max_concurrency > 1 and len(jobs) > 1:
+                with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                    futures = [executor.submit(job) for job in jobs]
+                    for future in as_completed(futures):
+                        for i, designed_component in future.result():
+                            designed[i] = designed_component
+                            yield DesignEvent.COMPONENT, designed_component
             else:
-                design = self.misc_designer.design(component=component, cloud_provider=self.cloud_provider)
-                designed_component.design = design
-                self.current_request_count += self.misc_designer.get_request_count()
+                for job in jobs:
+                    for i, designed_component in job():
+                        designed[i] = designed_component
+                        yield DesignEvent.COMPONENT, designed_component
+            design_doc.components = [designed[i] for i in range(len(targets))]
+        finally:
+            if speculation is not None:
+                speculation.close()
 
-            # Wait as OpenAI apis are ratelimited
-            self.wait_if_tracked()
+        self.__finish_run(design_doc, recorder)
+        yield DesignEvent.DONE, design_doc
 
-            self.design_doc.components.append(designed_component)
-            self._debug(f"Design for component {component.name} is completed.")
-            
+    async def adesign(self, 
+            problem_statement : str,
+            callbacks : Callbacks = None,
+            cloud_providers : List[str] = None
+            ) -> DesignDocument:
+        """
+        Designs the system without blocking the event loop. Unlike `design()`, the design doc is only returned, 
+        so that several problems can be designed concurrently on the same designer.
+
+        Args:
+            problem_statement (str): The problem statement.
+            callbacks (Callbacks, optional): LangChain callbacks passed to every LLM call.
+            cloud_providers (List[str], optional): Compares these cloud providers in one design, see `design_iter`.
+
+        Returns:
+            DesignDocument: The design document.
+        """
+        async for event, payload in self.adesign_iter(problem_statement, callbacks=callbacks, cloud_providers=cloud_providers):
+            if event == DesignEvent.DONE:
+                return payload
+
+    async def adesign_iter(self, 
+            problem_statement : str, 
+            callbacks : Callbacks = None,
+            cloud_providers : List[str] = None
+            ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Async version of `design_iter`, components are designed concurrently up to `max_concurrency`.
+
+        Args:
+            problem_statement (str): The problem statement.
+            callbacks (Callbacks, optional): LangChain callbacks passed to every LLM call, e.g. for token streaming.
+            cloud_providers (List[str], optional): Compares these cloud providers in one design, see `design_iter`.
+
+        Returns:
+            AsyncIterator[Tuple[str, Any]]: (event, payload) pairs, see `design_iter`.
+        """
+        cloud_providers = self.__validate_cloud_providers(cloud_providers)
+        design_doc, callbacks, recorder = self.__start_run(problem_statement, callbacks, cloud_providers)
+
+        record = design_doc.dependencies = DesignRecord(analysis=self.__analysis_key(problem_statement))
+        # the persisted stages are read and written off the event loop
+        analysis = self.__parsed_analysis(await self.__asaved(record, record.analysis))
+        speculation = await self.__aspeculate(problem_statement, record, cloud_providers, callbacks) if analysis is None else None
+
+        try:
+            pending_analysis = None
+            if analysis is None:
+                pending_analysis = asyncio.ensure_future(self.__aanalyze(problem_statement, record.analysis, callbacks))
+            try:
+                if not self.problem_analyzer.with_title:
+                    record.title = self.__title_key(problem_statement)
+                    design_doc.title = await self.__asaved(record, record.title)
+                    if design_doc.title is None:
+                        design_doc.title = await self.__agenerate_title(problem_statement, record.title, callbacks)
+                    yield DesignEvent.TITLE, design_doc.title
+
+                if pending_analysis is not None:
+                    analysis = await pending_analysis
+            finally:
+                if pending_analysis is not None and not pending_analysis.done():
+                    pending_analysis.cancel()
+            title, system = analysis
+            self._debug("Problem analysis is completed...")
+
+            if self.problem_analyzer.with_title:
+                design_doc.title = title
+                yield DesignEvent.TITLE, design_doc.title
+
+            design_doc.functional_requirement = system.functional_requirements
+            yield DesignEvent.FUNCTIONAL_REQUIREMENTS, design_doc.functional_requirement
+
+            targets, keys = self.__component_targets(problem_statement, system, record, cloud_providers)
+            stages = dict(zip(keys, await asyncio.gather(*[self.checkpoints.aget(key) for key in keys])))
+            targets, designed, units, speculated = self.__plan_components(problem_statement, system, record, targets, stages, speculation)
+            for i in sorted(designed):
+                yield DesignEvent.COMPONENT, designed[i]
+
+            # the semaphore bounds the requests in flight like the thread pool of `design_iter`
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def design_unit(indexes : List[int]) -> List[Tuple[int, DesignedComponent]]:
+                cloud_provider = targets[indexes[0]][1]
+                async with semaphore:
+                    designed_components = await self._adesign_components([system.components[targets[i][0]] for i in indexes],
+                                                                         callbacks=callbacks, cloud_provider=cloud_provider)
+                for key, stage in self.__completed_stages(record, indexes, designed_components):
+                    await self.checkpoints.asave(key, stage)
+                return self.__designed_unit(indexes, designed_components, cloud_provider)
+
+            async def design_speculated(position : int) -> List[Tuple[int, DesignedComponent]]:
+                reused = self.__reuse_speculated(system, record, targets, position, await speculated[position])
+                return reused if reused is not None else await design_unit([position])
+
+            tasks = ([asyncio.ensure_future(design_speculated(position)) for position in speculated] + 
+                     [asyncio.ensure_future(design_unit(unit)) for unit in units])
+            try:
+                for task in asyncio.as_completed(tasks):
+                    for i, designed_component in await task:
+                        designed[i] = designed_component
+                        yield DesignEvent.COMPONENT, designed_component
+            finally:
+                for task in tasks:
+                    task.cancel()
+            design_doc.components = [designed[i] for i in range(len(targets))]
+        finally:
+            if speculation is not None:
+                speculation.close()
+
+        await self.__afinish_run(design_doc, recorder)
+        yield DesignEvent.DONE, design_doc
+
+    def __generate_title(self, problem_statement : str, key : str, callbacks : Callbacks = None) -> str:
+        title = self.title_generator.generate_title(problem_statement, callbacks=callbacks)
+        self.__count_requests(self.title_generator)
+        self.checkpoints.save(key, title)
+        return title
+
+    async def __agenerate_title(self, problem_statement : str, key : str, callbacks : Callbacks = None) -> str:
+        title = await self.title_generator.agenerate_title(problem_statement, callbacks=callbacks)
+        self.__count_requests(self.title_generator)
+        await self.checkpoints.asave(key, title)
+        return title
+
+    def __analyze(self, problem_statement : str, key : str, callbacks : Callbacks = None) -> Tuple[Optional[str], System]:
+        try:
+            title, system = self.problem_analyzer.analyze_with_title(problem=problem_statement, callbacks=callbacks)
+        except Exception as e:
+            raise self.__analysis_error(e) from e
+        self.__count_requests(self.problem_analyzer)
+        self.checkpoints.save(key, {'title' : title, 'system' : system.dict()})
+        return title, system
+
+    async def __aanalyze(self, problem_statement : str, key : str, callbacks : Callbacks = None) -> Tuple[Optional[str], System]:
+        try:
+            title, system = await self.problem_analyzer.aanalyze_with_title(problem=problem_statement, callbacks=callbacks)
+        except Exception as e:
+            raise self.__analysis_error(e) from e
+        self.__count_requests(self.problem_analyzer)
+        await self.checkpoints.asave(key, {'title' : title, 'system' : system.dict()})
+        return title, system
+
+    def __title_key(self, problem_statement : str) -> str:
+        return content_key('title', problem_statement, stage_identity(self.title_generator))
+
+    def __analysis_key(self, problem_statement : str) -> str:
+        return content_key('analysis', problem_statement, stage_identity(self.problem_analyzer), self.problem_analyzer.with_title)
+
+    def __component_key(self, component : Component, cloud_provider : str = None) -> str:
+        # the components of a designer that ignores the cloud provider are shared by every provider
+        designer = self.registry.designer_for(component.component_type)
+        cloud_provider = (cloud_provider or self.cloud_provider) if getattr(designer, 'uses_cloud_provider', True) else None
+        return content_key('component', component.json(), stage_identity(designer), cloud_provider)
+
+    def __saved(self, record : DesignRecord, key : str) -> Optional[Any]:
+        return self.__reused(record, key, self.checkpoints.get(key))
+
+    async def __asaved(self, record : DesignRecord, key : str) -> Optional[Any]:
+        return self.__reused(record, key, await self.checkpoints.aget(key))
+
+    def __reused(self, record : DesignRecord, key : str, value : Optional[Any]) -> Optional[Any]:
+        if value is not None:
+            record.reused.append(key)
+        return value
+
+    def __parsed_analysis(self, analysis : Optional[Dict[str, Any]]) -> Optional[Tuple[Optional[str], System]]:
+        if analysis is None:
+            return None
+        return analysis['title'], System.parse_obj(analysis['system'])
+
+    def __component_targets(self, problem_statement : str, system : System, record : DesignRecord,
+                            cloud_providers : Optional[List[str]]) -> Tuple[List[Tuple[int, Optional[str]]], List[str]]:
+        # the designs to make as (component index, cloud provider) pairs, with a provider only for the components depending on it
+        # in a multi-cloud design, and the keys of the stages that may have been saved before: the components and their speculative designs
+        targets = []
+        for i, component in enumerate(system.components):
+            designer = self.registry.designer_for(component.component_type)
+            if cloud_providers is not None and getattr(designer, 'uses_cloud_provider', True):
+                targets += [(i, cloud_provider) for cloud_provider in cloud_providers]
+            else:
+                targets.append((i, None))
+
+        record.components = [self.__component_key(system.components[i], cloud_provider) for i, cloud_provider in targets]
+        matching = reconcile(system, self.speculative_types) if self.speculative_types else set()
+        speculative_keys = [self.__speculative_key(problem_statement, system.components[i].component_type, cloud_provider)
+                            for i, cloud_provider in targets if i in matching]
+        return targets, list(dict.fromkeys(record.components + speculative_keys))
+
+    def __plan_components(self, problem_statement : str, system : System, record : DesignRecord,
+                          targets : List[Tuple[int, Optional[str]]], stages : Dict[str, Any], speculation : Optional[Speculation] = None
+                          ) -> Tuple[List[Tuple[int, Optional[str]]], Dict[int, DesignedComponent], List[List[int]], Dict[int, Any]]:
+        # the targets, the designs made before with the same inputs by position, taken from the stages looked up
+        # for the keys of `__component_targets`, the positions of the remaining designs grouped by request,
+        # and the speculative designs in flight by position
+        designed = {}
+        for position, key in enumerate(record.components):
+            saved = self.__reused(record, key, stages.get(key))
+            if saved is not None:
+                designed[position] = DesignedComponent.parse_obj(saved)
+                designed[position].cloud_provider = targets[position][1]
+        speculated = self.__reconcile(problem_statement, system, record, targets, stages, designed, speculation)
+
+        units, batches = [], {}
+        for position, (i, cloud_provider) in enumerate(targets):
+            if position in designed or position in speculated:
+                continue
+            designer = self.registry.designer_for(system.components[i].component_type)
+            if designer.batch_size <= 1:
+                units.append([position])
+                continue
+
+            # a batch shares the cloud provider of its request
+            batch = batches.setdefault((id(designer), cloud_provider), [])
+            batch.append(position)
+            if len(batch) == designer.batch_size:
+                units.append(batch)
+                batches[(id(designer), cloud_provider)] = []
+        units += [batch for batch in batches.values() if batch]
+        return targets, designed, units, speculated
+
+    def __reconcile(self, problem_statement : str, system : System, record : DesignRecord, targets : List[Tuple[int, Optional[str]]],
+                    stages : Dict[str, Any], designed : Dict[int, DesignedComponent], speculation : Optional[Speculation] = None
+                    ) -> Dict[int, Any]:
+        # the speculative design of a type stands for the only component of that type, unless the component was designed before.
+        # it is taken from the speculation in flight, or from the checkpoints if the analysis was reused, the others are cancelled
+        speculated = {}
+        matching = reconcile(system, self.speculative_types) if self.speculative_types else set()
+        for position, (i, cloud_provider) in enumerate(targets):
+            if i not in matching or position in designed:
+                continue
+            component_type = system.components[i].component_type
+            taken = speculation.take(component_type, cloud_provider) if speculation is not None else None
+            if taken is not None:
+                record.components[position], speculated[position] = taken
+                continue
+            key = self.__speculative_key(problem_statement, component_type, cloud_provider)
+            saved = self.__reused(record, key, stages.get(key))
+            if saved is not None:
+                record.components[position] = key
+                designed[position] = self.__speculated_component(system.components[i], DesignedComponent.parse_obj(saved), cloud_provider)
+
+        if speculation is not None:
+            discarded = speculation.discard()
+            self._debug(f"{len(speculated)} speculative designs reused, {discarded} discarded.")
+        return speculated
+
+    def __speculative_key(self, problem_statement : str, component_type : str, cloud_provider : Optional[str]) -> str:
+        return self.__component_key(speculative_component(problem_statement, component_type), cloud_provider)
+
+    def __speculative_targets(self, problem_statement : str, cloud_providers : Optional[List[str]]
+                              ) -> List[Tuple[Component, Optional[str], str]]:
+        # (component, cloud provider, key) of the speculative designs, providers as in `__component_targets`
+        speculative_targets = []
+        for component_type in self.speculative_types:
+            component = speculative_component(problem_statement, component_type)
+            designer = self.registry.designer_for(component_type)
+            if cloud_providers is not None and getattr(designer, 'uses_cloud_provider', True):
+                providers = cloud_providers
+            else:
+                providers = [None]
+            for cloud_provider in providers:
+                speculative_targets.append((component, cloud_provider, self.__component_key(component, cloud_provider)))
+        return speculative_targets
+
+    def __speculate(self, problem_statement : str, record : DesignRecord, cloud_providers : Optional[List[str]],
+                    callbacks : Callbacks = None) -> Optional[Speculation]:
+        # those made before are not made again
+        speculative_targets = [target for target in self.__speculative_targets(problem_statement, cloud_providers)
+                               if self.checkpoints.get(target[2]) is None]
+        if not speculative_targets:
+            return None
+        # all of them start at once, alongside the analysis
+        speculation = Speculation(ThreadPoolExecutor(max_workers=len(speculative_targets)))
+        callbacks = self.__cancellable(callbacks, speculation)
+        for component, cloud_provider, key in speculative_targets:
+            record.speculated.append(key)
+            future = speculation.executor.submit(self.__design_speculative, speculation, component, key, callbacks, cloud_provider)
+            speculation.add(component.component_type, cloud_provider, key, future)
+        return speculation
+
+    async def __aspeculate(self, problem_statement : str, record : DesignRecord, cloud_providers : Optional[List[str]],
+                           callbacks : Callbacks = None) -> Optional[Speculation]:
+        speculative_targets = self.__speculative_targets(problem_statement, cloud_providers)
+        saved = await asyncio.gather(*[self.checkpoints.aget(key) for _, _, key in speculative_targets])
+        speculative_targets = [target for target, stage in zip(speculative_targets, saved) if stage is None]
+        if not speculative_targets:
+            return None
+        speculation = Speculation()
+        callbacks = self.__cancellable(callbacks, speculation)
+        for component, cloud_provider, key in speculative_targets:
+            record.speculated.append(key)
+            task = asyncio.ensure_future(self.__adesign_speculative(speculation, component, key, callbacks, cloud_provider))
+            speculation.add(component.component_type, cloud_provider, key, task)
+        return speculation
+
+    def __cancellable(self, callbacks : Callbacks, speculation : Speculation) -> Callbacks:
+        # the callbacks of the speculative designs, closing the speculation stops their requests
+        from ..recorder import CancellationHandler
+        return self.__with_handler(callbacks, CancellationHandler(speculation.cancelled))
+
+    def __design_speculative(self, speculation : Speculation, component : Component, key : str, callbacks : Callbacks = None, 
+                             cloud_provider : str = None) -> DesignedComponent:
+        designed_component = self._design_component(component, callbacks=callbacks, cloud_provider=cloud_provider)
+        if designed_component.error is None:
+            speculation.save(self.checkpoints, key, designed_component.dict())
+        return designed_component
+
+    async def __adesign_speculative(self, speculation : Speculation, component : Component, key : str, callbacks : Callbacks = None, 
+                                    cloud_provider : str = None) -> DesignedComponent:
+        designed_component = await self._adesign_component(component, callbacks=callbacks, cloud_provider=cloud_provider)
+        if designed_component.error is None:
+            await speculation.asave(self.checkpoints, key, designed_component.dict())
+        return designed_component
+
+    def __reuse_speculated(self, system : System, record : DesignRecord, targets : List[Tuple[int, Optional[str]]], 
+                           position : int, designed_component : DesignedComponent) -> Optional[List[Tuple[int, DesignedComponent]]]:
+        # the speculative design as the design of the component, None if it failed and the component is to be designed instead
+        i, cloud_provider = targets[position]
+        if designed_component.error is not None:
+            record.components[position] = self.__component_key(system.components[i], cloud_provider)
+            return None
+        return [(position, self.__speculated_component(system.components[i], designed_component, cloud_provider))]
+
+    def __speculated_component(self, component : Component, designed_component : DesignedComponent, 
+                               cloud_provider : Optional[str]) -> DesignedComponent:
+        return DesignedComponent(name=component.name, design=designed_component.design, cloud_provider=cloud_provider)
+
+    def __design_unit(self, system : System, record : DesignRecord, targets : List[Tuple[int, Optional[str]]], 
+                      indexes : List[int], callbacks : Callbacks = None) -> List[Tuple[int, DesignedComponent]]:
+        cloud_provider = targets[indexes[0]][1]
+        designed_components = self._design_components([system.components[targets[i][0]] for i in indexes],
+                                                      callbacks=callbacks, cloud_provider=cloud_provider)
+        for key, stage in self.__completed_stages(record, indexes, designed_components):
+            self.checkpoints.save(key, stage)
+        return self.__designed_unit(indexes, designed_components, cloud_provider)
+
+    def __completed_stages(self, record : DesignRecord, indexes : List[int], 
+                           designed_components : List[DesignedComponent]) -> List[Tuple[str, Dict[str, Any]]]:
+        # (key, stage) of the components to save, failed components are designed again by the next attempt
+        return [(record.components[i], designed_component.dict()) 
+                for i, designed_component in zip(indexes, designed_components) if designed_component.error is None]
+
+    def __designed_unit(self, indexes : List[int], designed_components : List[DesignedComponent], 
+                        cloud_provider : Optional[str]) -> List[Tuple[int, DesignedComponent]]:
+        for designed_component in designed_components:
+            designed_component.cloud_provider = cloud_provider
+        return list(zip(indexes, designed_components))
+
+    def __validate_cloud_providers(self, cloud_providers : Optional[List[str]]) -> Optional[List[str]]:
+        if cloud_providers is None:
+            return None
+        cloud_providers = list(dict.fromkeys(cloud_providers))
+        if not cloud_providers:
+            raise ValueError("cloud_providers should not be empty")
+        for cloud_provider in cloud_providers:
+            validate_cloud_provider(cloud_provider)
+        return cloud_providers
+
+    def __start_run(self, problem_statement : str, callbacks : Callbacks = None, 
+                    cloud_providers : List[str] = None) -> Tuple[DesignDocument, Callbacks, Optional[RunRecorder]]:
+        # a new design doc, and the callbacks with the recorder of the run if instrumented
+        design_doc = DesignDocument(problem_statement=problem_statement, cloud_providers=cloud_providers or [])
+        recorder = None
+        if self.instrument:
+            # the callback handlers import LangChain, which the llm has already loaded by now
+            from ..recorder import RunRecorder
+            recorder = RunRecorder()
+            callbacks = self.__with_handler(callbacks, recorder)
+        return design_doc, callbacks, recorder
+
+    def __with_handler(self, callbacks : Callbacks, handler : Any) -> Callbacks:
+        # the callbacks with one more handler, the given ones are left as they are
+        from langchain.callbacks.base import BaseCallbackManager
+        if isinstance(callbacks, BaseCallbackManager):
+            return add_callback_handler(callbacks, handler)
+        return (list(callbacks) if callbacks is not None else []) + [handler]
+
+    def __analysis_error(self, error : Exception) -> Exception:
+        # transient errors are worth a retry of the same problem, anything else is a bad problem statement
+        if is_transient_error(error):
+            return error
+        return ValueError(f"Sorry. It does not seem like a valid system design problem. Please rephrase your question.")
+
+    def __finish_run(self, design_doc : DesignDocument, recorder : Optional[RunRecorder]) -> None:
+        for key in self.__finished_stages(design_doc):
+            self.checkpoints.discard(key)
+        self.__report_run(design_doc, recorder)
+
+    async def __afinish_run(self, design_doc : DesignDocument, recorder : Optional[RunRecorder]) -> None:
+        for key in self.__finished_stages(design_doc):
+            await self.checkpoints.adiscard(key)
+        self.__report_run(design_doc, recorder)
+
+    def __finished_stages(self, design_doc : DesignDocument) -> List[str]:
+        # the keys of the stages to discard: a completed design has nothing left to retry, the memory of a long-lived designer stays flat
+        record = design_doc.dependencies
+        if self.__keep_stages or any(component.error is not None for component in design_doc.components):
+            return []
+        return [key for key in [record.title, record.analysis, *record.components, *record.speculated] if key is not None]
+
+    def __report_run(self, design_doc : DesignDocument, recorder : Optional[RunRecorder]) -> None:
+        self._debug(f"{len(design_doc.dependencies.reused)} stages reused from previous designs.")
+        if recorder is not None:
+            design_doc.run_report = recorder.report()
 
         self._debug("System Design completed...\n")
-        return self.design_doc
+
+    def _design_component(self, component : Component, callbacks : Callbacks = None, cloud_provider : str = None) -> DesignedComponent:
+        """
+        Designs a single component with the designer matching its type.
+        Errors are recorded on the returned component instead of being raised,
+        so that one bad component does not abort the rest of the design.
+
+        Args:
+            component (Component): The component to be designed.
+            callbacks (Callbacks, optional): LangChain callbacks passed to the LLM call.
+            cloud_provider (str, optional): The cloud provider of the design. Defaults to None, `cloud_provider` of the designer.
+
+        Returns:
+            DesignedComponent: The designed component.
+        """
+        designed_component = DesignedComponent(name=component.name)
+        self._debug(f"Design started for component {component.name}.")
+        designer = self.registry.designer_for(component.component_type)
+
+        try:
+            design = designer._design(component=component, cloud_provider=cloud_provider or self.cloud_provider, callbacks=callbacks)
+            designed_component.design = str(design)
+        except Exception as e:
+            designed_component.error = str(e)
+            self._debug(f"Design for component {component.name} failed: {e}")
+        finally:
+            self.__count_requests(designer)
+
+        if designed_component.error is None:
+            self._debug(f"Design for component {component.name} is completed.")
+        return designed_component
+
+    def _design_components(self, components : List[Component], callbacks : Callbacks = None, cloud_provider : str = None) -> List[DesignedComponent]:
+        """
+        Designs components of the same designer, in a single request if the designer batches them.
+
+        Args:
+            components (List[Component]): The components to be designed.
+            callbacks (Callbacks, optional): LangChain callbacks passed to the LLM calls.
+            cloud_provider (str, optional): The cloud provider of the designs. Defaults to None, `cloud_provider` of the designer.
+
+        Returns:
+            List[DesignedComponent]: The designed components in the given order.
+        """
+        if len(components) == 1:
+            return [self._design_component(components[0], callbacks=callbacks, cloud_provider=cloud_provider)]
+
+        designer = self.registry.designer_for(components[0].component_type)
+        self._debug(f"Design started for components {', '.join(component.name for component in components)}.")
+        try:
+            designs = designer._design_batch(components=components, cloud_provider=cloud_provider or self.cloud_provider, callbacks=callbacks)
+        except Exception as e:
+            designs = [e] * len(components)
+        finally:
+            self.__count_requests(designer)
+        return [self.__designed_component(component, design) for component, design in zip(components, designs)]
+
+    async def _adesign_components(self, components : List[Component], callbacks : Callbacks = None, cloud_provider : str = None) -> List[DesignedComponent]:
+        ''' Async version of `_design_components` '''
+        if len(components) == 1:
+            return [await self._adesign_component(components[0], callbacks=callbacks, cloud_provider=cloud_provider)]
+
+        designer = self.registry.designer_for(components[0].component_type)
+        self._debug(f"Design started for components {', '.join(component.name for component in components)}.")
+        try:
+            designs = await designer._adesign_batch(components=components, cloud_provider=cloud_provider or self.cloud_provider, callbacks=callbacks)
+        except Exception as e:
+            designs = [e] * len(components)
+        finally:
+            self.__count_requests(designer)
+        return [self.__designed_component(component, design) for component, design in zip(components, designs)]
+
+    def __designed_component(self, component : Component, design : Any) -> DesignedComponent:
+        designed_component = DesignedComponent(name=component.name)
+        if isinstance(design, Exception):
+            designed_component.error = str(design)
+            self._debug(f"Design for component {component.name} failed: {design}")
+        else:
+            designed_component.design = str(design)
+            self._debug(f"Design for component {component.name} is completed.")
+        return designed_component
+
+    async def _adesign_component(self, component : Component, callbacks : Callbacks = None, cloud_provider : str = None) -> DesignedComponent:
+        ''' Async version of `_design_component` '''
+        designed_component = DesignedComponent(name=component.name)
+        self._debug(f"Design started for component {component.name}.")
+        designer = self.registry.designer_for(component.component_type)
+
+        try:
+            design = await designer._adesign(component=component, cloud_provider=cloud_provider or self.cloud_provider, callbacks=callbacks)
+            designed_component.design = str(design)
+        except Exception as e:
+            designed_component.error = str(e)
+            self._debug(f"Design for component {component.name} failed: {e}")
+        finally:
+            self.__count_requests(designer)
+
+        if designed_component.error is None:
+            self._debug(f"Design for component {component.name} is completed.")
+        return designed_component
+
+
+    def __count_requests(self, operation : Any) -> None:
+        if not isinstance(operation, OpenAIOperation):
+            return
+        with self.__request_lock:
+            self.current_request_count += operation.get_request_count()
+
+    def operations(self) -> List[OpenAIOperation]:
+        ''' All the OpenAI operations used by the designer '''
+        operations = [self.title_generator, self.problem_analyzer, 
+                      self.storage_designer, self.service_designer, self.misc_designer]
+        for designer in self.registry.designers():
+            if isinstance(designer, OpenAIOperation) and all(designer is not operation for operation in operations):
+                operations.append(designer)
+        return operations
 
     def dump_to_md_file(self, path : str):
         """
@@ -132,33 +920,39 @@ class SystemDesigner:
         with open(path, 'w') as file:
             file.write(self.generate_markdown())
         file.close()
+
+    def dump_to_json_file(self, path : str):
+        """
+        Dumps the Generated design to a JSON file, it can be loaded back with `export.load_design` 
+        and rendered with `export.render_markdown`
+
+        Args:
+            path (str): The pathstring of a JSON file, should end with `.json`
+
+        Returns:
+            None: 
+        """
+        if not path.endswith('.json'):
+            raise ValueError("The path should be a valid JSON file")
+
+        if self.design_doc is None:
+            raise ValueError("Design doc is not generated yet. Run `design()` to generate a design doc")
+
+        with open(path, 'w') as file:
+            file.write(self.design_doc.json(indent=2))
     
-    def generate_markdown(self):
+    def generate_markdown(self, design_doc : DesignDocument = None):
         """
         Generates a markdown file of the design
+
+        Args:
+            design_doc (DesignDocument, optional): The design doc to render. Defaults to the last design of `design()`.
         """
-        if self.design_doc is None:
+        design_doc = design_doc if design_doc is not None else self.design_doc
+        if design_doc is None:
             raise ValueError("Design doc is not generated yet. Run `design()` to generate a design doc")
-        
-        design = ''
-        design += f"# {self.design_doc.title}\n\n\n\n"
-        design += f'## Problem Statement\n\n'
-        design += f'{self.design_doc.problem_statement}\n\n'
-        design += f'## Functional Requirements\n\n'
-        design += f'{self.design_doc.functional_requirement}\n\n'
-        design += f'## Components\n\n'
-        for component in self.design_doc.components:
-            design += f'### {component.name}\n'
-            design += f'{component.design}\n\n'
-
-        return design
+        return render_markdown(design_doc)
 
     def _debug(self, message):
         if self.verbose :
             print(message)
-
-    def wait_if_tracked(self):
-        
-        if self.track_request and self.current_request_count % RPM_COUNT == 0:
-            self._debug(f"Total request : {self.current_request_count}, Sleep for {SLEEP_TIME_IN_SECONDS} seconds")
-            time.sleep(SLEEP_TIME_IN_SECONDS)
\ No newline at end of file
@@ -1,23 +1,43 @@
+from __future__ import annotations
 from .openaioperation import *
-from langchain.llms import BaseLLM
-from langchain import PromptTemplate, LLMChain
-from ..prompts import Prompts
+from ..prompts import Prompts, PromptMode, compact_prompt
+from functools import cached_property
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..chains import BudgetedLLMChain
+    from langchain.llms import BaseLLM
+    from langchain.callbacks.manager import Callbacks
 
 
 class TitleGenerator(OpenAIOperation):
     '''Generates a title of the system under design'''
 
+    stage = 'title'
+
     def __init__(self, 
             llm:BaseLLM,
-            verbose:bool):
+            verbose:bool,
+            prompt_mode : str = PromptMode.FULL):
 
         self.llm = llm
-        prompt = PromptTemplate(template=  Prompts.TitleGenerationPrompt,
+        self.verbose = verbose
+        self.prompt_mode = prompt_mode
+
+    @cached_property
+    def __llm_chain(self) -> BudgetedLLMChain:
+        # built on the first request, LangChain is only imported then
+        from langchain import PromptTemplate
+        from ..chains import BudgetedLLMChain
+        prompt = PromptTemplate(template=  compact_prompt(Prompts.TitleGenerationPrompt, self.prompt_mode),
                                 input_variables=['input'])
-        self.__llm_chain = LLMChain(prompt=prompt, llm=llm, verbose=verbose)
+        return BudgetedLLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose, operation=self)
+
+    def generate_title(self, problem_statement, callbacks : Callbacks = None):
+        return self._run_chain(self.__llm_chain, {'input' : problem_statement}, callbacks=callbacks, similar=('', problem_statement))
 
-    def generate_title(self, problem_statement):
-        return self.__llm_chain.run(input=problem_statement)
+    async def agenerate_title(self, problem_statement, callbacks : Callbacks = None):
+        return await self._arun_chain(self.__llm_chain, {'input' : problem_statement}, callbacks=callbacks, similar=('', problem_statement))
     
     def get_request_count(self):
         return 1
\ No newline at end of file
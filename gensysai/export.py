@@ -0,0 +1,264 @@
+from .designdoc import DesignedComponent, DesignDocument, DesignEvent
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import json
+import os
+
+# first event of a stream, before those of `design_iter`
+PROBLEM_STATEMENT = 'problem_statement'
+
+PARQUET_BATCH_SIZE = 1000
+# output formats of a designed problem, see `SystemDesigner.design_many`
+OUTPUT_FORMATS = ('md', 'json')
+
+
+def render_markdown(design_doc : Union[DesignDocument, Dict[str, Any], str]) -> str:
+    """
+    Renders a design as markdown.
+
+    Args:
+        design_doc (Union[DesignDocument, Dict, str]): The design, or its saved JSON as a dict or a string.
+
+    Returns:
+        str: The markdown document.
+    """
+    design_doc = as_design_document(design_doc)
+    sections = [
+        f"# {design_doc.title}\n\n\n\n",
+        "## Problem Statement\n\n", f"{design_doc.problem_statement}\n\n",
+        "## Functional Requirements\n\n", f"{design_doc.functional_requirement}\n\n",
+    ]
+    for cloud_provider, components in components_by_provider(design_doc):
+        sections.append("## Components\n\n" if cloud_provider is None else f"## Components on {cloud_provider}\n\n")
+        for component in components:
+            sections.append(f"### {component.name}\n")
+            if component.error is not None:
+                sections.append(f"_Design could not be generated: {component.error}_\n\n")
+            else:
+                sections.append(f"{component.design}\n\n")
+    return ''.join(sections)
+
+
+def components_by_provider(design_doc : DesignDocument) -> List[Tuple[Optional[str], List[DesignedComponent]]]:
+    """
+    Groups the components of a design by cloud provider, for a section per provider.
+
+    Args:
+        design_doc (DesignDocument): The design.
+
+    Returns:
+        List[Tuple[Optional[str], List[DesignedComponent]]]: (cloud provider, components) pairs, first the components
+        of every provider (None), then those of each provider of a multi-cloud design in the order of `cloud_providers`.
+        Empty groups of a multi-cloud design are left out.
+    """
+    groups = {None : []}
+    groups.update((cloud_provider, []) for cloud_provider in design_doc.cloud_providers)
+    for component in design_doc.components:
+        groups.setdefault(component.cloud_provider, []).append(component)
+    # a single provider design always has its components section
+    return [(cloud_provider, components) for cloud_provider, components in groups.items()
+            if components or not design_doc.cloud_providers]
+
+
+def as_design_document(design_doc : Union[DesignDocument, Dict[str, Any], str]) -> DesignDocument:
+    if isinstance(design_doc, DesignDocument):
+        return design_doc
+    if isinstance(design_doc, str):
+        return DesignDocument.parse_raw(design_doc)
+    return DesignDocument.parse_obj(design_doc)
+
+
+def load_design(path : str) -> DesignDocument:
+    """
+    Loads a design saved as JSON, either a document or the event stream of a `DesignStreamWriter`.
+
+    Args:
+        path (str): The path of a `.json` document or a `.jsonl` event stream.
+
+    Returns:
+        DesignDocument: The design, with the sections completed so far for an unfinished stream.
+    """
+    if path.endswith('.jsonl'):
+        with open(path) as file:
+            return read_design_events(json.loads(line) for line in file if line.strip())
+    return DesignDocument.parse_file(path)
+
+
+def read_design_events(events : Iterable[Dict[str, Any]]) -> DesignDocument:
+    ''' Rebuilds a design from the events of a `DesignStreamWriter` '''
+    design_doc = DesignDocument()
+    for event in events:
+        design_doc = apply_design_event(design_doc, event['event'], event['payload'])
+    return design_doc
+
+
+def apply_design_event(design_doc : DesignDocument, event : str, payload : Any) -> DesignDocument:
+    """
+    Adds a section to a design in progress.
+
+    Args:
+        design_doc (DesignDocument): The design so far, updated in place.
+        event (str): An event of `design_iter`, or `PROBLEM_STATEMENT`.
+        payload (Any): The payload of the event, or its saved JSON.
+
+    Returns:
+        DesignDocument: The design, the final document of a `DesignEvent.DONE` event.
+    """
+    if event == PROBLEM_STATEMENT:
+        design_doc.problem_statement = payload
+    elif event == DesignEvent.TITLE:
+        design_doc.title = payload
+    elif event == DesignEvent.FUNCTIONAL_REQUIREMENTS:
+        design_doc.functional_requirement = payload
+    elif event == DesignEvent.COMPONENT:
+        design_doc.components.append(payload if isinstance(payload, DesignedComponent) else DesignedComponent.parse_obj(payload))
+    elif event == DesignEvent.DONE:
+        # the final document has the components in their stable order
+        return as_design_document(payload)
+    return design_doc
+
+
+class DesignStreamWriter:
+    '''
+        Appends the sections of a design to a JSON Lines file as soon as each of them is completed,
+        so a long design is saved progressively and an interrupted one keeps its completed sections.
+        Read it back with `load_design`.
+    '''
+
+    def __init__(self, path : str, problem_statement : str = None) -> None:
+        """
+        Initialize the DesignStreamWriter object.
+
+        Args:
+            path (str): The `.jsonl` file, truncated if it exists. \n
+            problem_statement (str, optional): Written as the first event if provided. \n
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.__file = open(path, 'w')
+        if problem_statement is not None:
+            self.write(PROBLEM_STATEMENT, problem_statement)
+
+    def write(self, event : str, payload : Any) -> None:
+        ''' Appends an event of `design_iter`, the payload is serialized as JSON '''
+        if hasattr(payload, 'dict'):
+            payload = json.loads(payload.json())
+        self.__file.write(json.dumps({'event' : event, 'payload' : payload}) + '\n')
+        self.__file.flush()
+
+    def tee(self, events : Iterable[Tuple[str, Any]]) -> Iterator[Tuple[str, Any]]:
+        ''' Writes the events of `design_iter` while passing them on '''
+        for event, payload in events:
+            self.write(event, payload)
+            yield event, payload
+
+    def close(self) -> None:
+        self.__file.close()
+
+    def __enter__(self) -> 'DesignStreamWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def design_records(design_doc : DesignDocument, design_id : str = None) -> List[Dict[str, Any]]:
+    """
+    Flattens a design into one row per component, for tabular exports.
+
+    Args:
+        design_doc (DesignDocument): The design.
+        design_id (str, optional): Identifier of the design, e.g. the problem id of a batch.
+
+    Returns:
+        List[Dict]: The rows, a design without components has a single row with empty component columns.
+    """
+    design = {
+        'design_id' : design_id,
+        'title' : design_doc.title,
+        'problem_statement' : design_doc.problem_statement,
+        'functional_requirement' : design_doc.functional_requirement,
+        'wall_seconds' : design_doc.run_report.wall_seconds if design_doc.run_report is not None else None,
+    }
+    components = design_doc.components or [DesignedComponent(name='')]
+    return [dict(design, component_index=i, component_name=component.name or None, component_cloud_provider=component.cloud_provider,
+                 component_design=component.design, component_error=component.error)
+            for i, component in enumerate(components)]
+
+
+def export_jsonl(designs : Iterable[Union[DesignDocument, Tuple[str, DesignDocument]]], path : str) -> int:
+    """
+    Writes designs to a JSON Lines file, one document per line. Designs are consumed lazily.
+
+    Args:
+        designs (Iterable): Designs, or (design id, design) pairs.
+        path (str): The `.jsonl` file.
+
+    Returns:
+        int: The number of designs written.
+    """
+    count = 0
+    with open(path, 'w') as file:
+        for design_id, design_doc in _with_ids(designs):
+            record = json.loads(design_doc.json())
+            if design_id is not None:
+                record = dict(design_id=design_id, **record)
+            file.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+
+def export_parquet(designs : Iterable[Union[DesignDocument, Tuple[str, DesignDocument]]],
+                   path : str,
+                   batch_size : int = PARQUET_BATCH_SIZE) -> int:
+    """
+    Writes designs to a Parquet file with one row per component, see `design_records`.
+    Requires the optional `pyarrow` package. Designs are consumed lazily and written in row groups.
+
+    Args:
+        designs (Iterable): Designs, or (design id, design) pairs.
+        path (str): The `.parquet` file.
+        batch_size (int, optional): Rows per row group. Defaults to 1000.
+
+    Returns:
+        int: The number of rows written.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is required to export to parquet, install it with `pip install pyarrow`")
+
+    schema = pa.schema([
+        ('design_id', pa.string()),
+        ('title', pa.string()),
+        ('problem_statement', pa.string()),
+        ('functional_requirement', pa.string()),
+        ('wall_seconds', pa.float64()),
+        ('component_index', pa.int32()),
+        ('component_name', pa.string()),
+        ('component_cloud_provider', pa.string()),
+        ('component_design', pa.string()),
+        ('component_error', pa.string()),
+    ])
+
+    count, rows = 0, []
+    with pq.ParquetWriter(path, schema) as writer:
+        for design_id, design_doc in _with_ids(designs):
+            rows += design_records(design_doc, design_id)
+            if len(rows) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                count, rows = count + len(rows), []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            count += len(rows)
+    return count
+
+
+def _with_ids(designs : Iterable[Union[DesignDocument, Tuple[str, DesignDocument]]]) -> Iterator[Tuple[str, DesignDocument]]:
+    for design in designs:
+        if isinstance(design, tuple):
+            yield design[0], design[1]
+        else:
+            yield None, design
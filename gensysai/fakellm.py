@@ -0,0 +1,193 @@
+from langchain.llms.base import LLM
+from langchain.schema import Generation, LLMResult
+from pydantic import Field, PrivateAttr
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+import asyncio
+import json
+import random
+import re
+import time
+from .instrumentation import CHARS_PER_TOKEN
+
+# Distinctive phrase of each template in `Prompts`, checked in order
+PROMPT_SIGNATURES = [
+    ('titled_requirements', 'generate a 2-3 word title of the system and identify functional requirements'),
+    ('title', 'Generate a 2-3 word title'),
+    ('requirements', 'identify functional requirements from a given system design problem statement'),
+    ('components', 'high level Components'),
+    ('service', 'single service component'),
+    ('storage', 'On Storage type component'),
+    ('generic_batch', 'design each of the components'),
+    ('generic', 'enlist a few popular and accepted approaches'),
+]
+
+# Types of the generated components after the mandatory Storage component
+COMPONENT_TYPES = ['Service', 'Service', 'Cache', 'Service', 'Load Balancer']
+
+
+def classify_prompt(prompt : str) -> str:
+    ''' Returns the kind of the prompt from `PROMPT_SIGNATURES`, or `unknown` '''
+    for kind, signature in PROMPT_SIGNATURES:
+        if signature in prompt:
+            return kind
+    return 'unknown'
+
+
+class FakeDesignLLM(LLM):
+    '''
+        Deterministic offline stand-in for the OpenAI LLM. Returns canned, schema-valid responses
+        for each prompt in `Prompts` after a configurable latency, and counts the requests per prompt kind.
+    '''
+
+    latency : float = 0.0
+    '''Seconds each request takes'''
+    jitter : float = 0.0
+    '''Maximum seconds added to the latency, uniformly distributed'''
+    components : int = 4
+    '''Number of components of every analyzed system'''
+    seed : Optional[int] = None
+    model_name : str = 'fake-design-llm'
+    temperature : float = 0.0
+    max_tokens : int = 512
+    truncate : bool = False
+    '''Cuts the responses at max_tokens (~4 characters per token) with a `length` finish reason like the OpenAI API,
+    a prompt ending with the start of a response gets the rest of it'''
+    streaming : bool = False
+    '''Passes each word of the responses to the `on_llm_new_token` callbacks, spread over the latency'''
+    request_counts : Dict[str, int] = Field(default_factory=dict)
+
+    _lock : Any = PrivateAttr(default_factory=Lock)
+    _random : Any = PrivateAttr()
+
+    def __init__(self, **kwargs : Any) -> None:
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-design"
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"model_name" : self.model_name, "components" : self.components}
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.request_counts.values())
+
+    def reset(self) -> None:
+        ''' Resets the request counts '''
+        with self._lock:
+            self.request_counts.clear()
+
+    def _call(self, prompt : str, stop : Optional[List[str]] = None, run_manager = None) -> str:
+        return self._generate([prompt], stop).generations[0][0].text
+
+    async def _acall(self, prompt : str, stop : Optional[List[str]] = None, run_manager = None) -> str:
+        return (await self._agenerate([prompt], stop)).generations[0][0].text
+
+    def _generate(self, prompts : List[str], stop : Optional[List[str]] = None, run_manager = None) -> LLMResult:
+        generations = []
+        for prompt in prompts:
+            kind, delay = self._count(prompt)
+            generation = self._complete(kind, prompt)
+            if self.streaming and run_manager is not None:
+                tokens = self._tokens(generation.text)
+                for token in tokens:
+                    time.sleep(delay / len(tokens))
+                    run_manager.on_llm_new_token(token)
+            elif delay > 0:
+                time.sleep(delay)
+            generations.append([generation])
+        return LLMResult(generations=generations)
+
+    async def _agenerate(self, prompts : List[str], stop : Optional[List[str]] = None, run_manager = None) -> LLMResult:
+        generations = []
+        for prompt in prompts:
+            kind, delay = self._count(prompt)
+            generation = self._complete(kind, prompt)
+            if self.streaming and run_manager is not None:
+                tokens = self._tokens(generation.text)
+                for token in tokens:
+                    await asyncio.sleep(delay / len(tokens))
+                    await run_manager.on_llm_new_token(token)
+            elif delay > 0:
+                await asyncio.sleep(delay)
+            generations.append([generation])
+        return LLMResult(generations=generations)
+
+    @staticmethod
+    def _tokens(text : str) -> List[str]:
+        # words with their trailing whitespace, never empty
+        return re.findall(r'\s*\S+\s*|\s+', text) or ['']
+
+    def _complete(self, kind : str, prompt : str) -> Generation:
+        text = self._respond(kind, prompt)
+        if not self.truncate:
+            return Generation(text=text, generation_info={'finish_reason' : 'stop'})
+
+        # the continuation of a truncated response
+        start = next((end for end in range(len(text), 0, -1) if prompt.endswith(text[:end])), 0)
+        text, limit = text[start:], self.max_tokens * CHARS_PER_TOKEN
+        if len(text) > limit:
+            return Generation(text=text[:limit], generation_info={'finish_reason' : 'length'})
+        return Generation(text=text, generation_info={'finish_reason' : 'stop'})
+
+    def _count(self, prompt : str) -> Tuple[str, float]:
+        # the kind of the prompt and the simulated latency of the request
+        kind = classify_prompt(prompt)
+        with self._lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter > 0 else 0.0)
+        return kind, delay
+
+    def _respond(self, kind : str, prompt : str) -> str:
+        if kind == 'title':
+            return "Chat Application"
+
+        if kind == 'generic_batch':
+            # unique, a continued prompt also has the names of its truncated response
+            names = list(dict.fromkeys(re.findall(r'"name": "([^"]+)"', prompt)))
+            return json.dumps({"designs" : [{"name" : name, "design" : self._generic_design()} for name in names]})
+
+        if kind == 'titled_requirements':
+            return json.dumps({"title" : "Chat Application", "functional_requirements" : self._requirements()})
+
+        if kind == 'requirements':
+            return self._requirements()
+
+        if kind == 'components':
+            return json.dumps({"functional_requirements" : self._requirements(), "components" : self._components()})
+
+        if kind == 'service':
+            return json.dumps({
+                "requirement" : "Responsible for sending and receiving messages.",
+                "apis" : ["SendMessage(userId, message) - Sends a message", "GetMessages(userId) - Lists the messages"],
+                "conclusion" : "The service fulfills the messaging requirements."
+            })
+
+        if kind == 'storage':
+            return ("- Messages are stored in a wide column database, partitioned by conversation.\n"
+                    "- User profiles are stored in a relational database.\n"
+                    "- Media is stored in an object storage.")
+
+        return self._generic_design()
+
+    def _generic_design(self) -> str:
+        return ("- Use a managed offering of the cloud provider.\n"
+                "- Configure it for high availability across zones.")
+
+    def _requirements(self) -> str:
+        return ("1. Messaging functionality - allow users to send and receive messages.\n"
+                "2. Group creation functionality - enable users to create groups.\n"
+                "3. Notification functionality - notify users of new messages.")
+
+    def _components(self) -> List[Dict[str, str]]:
+        components = [{"name" : "Data Storage", "description" : "Stores the data of the system.", "component_type" : "Storage"}]
+        for i in range(1, self.components):
+            component_type = COMPONENT_TYPES[(i - 1) % len(COMPONENT_TYPES)]
+            components.append({"name" : f"{component_type} {i}",
+                               "description" : f"Handles responsibility {i} of the system.",
+                               "component_type" : component_type})
+        return components
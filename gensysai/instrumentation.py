@@ -0,0 +1,188 @@
+from concurrent.futures import CancelledError
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+CHARS_PER_TOKEN = 4
+
+
+class StageRecord(BaseModel):
+    '''Represents a single operation of a design run, e.g. the design of one component'''
+
+    stage : str
+    component : Optional[str] = None
+    wall_seconds : float = 0.0
+    requests : int = 0
+    prompt_tokens : int = 0
+    completion_tokens : int = 0
+    tokens_estimated : bool = False
+    retries : int = 0
+    cache_hit : bool = False
+    semantic_hit : bool = False
+    parse_failure : bool = False
+    # completions cut at max_tokens, see `TokenBudget`
+    truncations : int = 0
+    error : Optional[str] = None
+
+
+class StageSummary(BaseModel):
+    '''Represents the totals of all the records of a stage'''
+
+    operations : int = 0
+    wall_seconds : float = 0.0
+    requests : int = 0
+    prompt_tokens : int = 0
+    completion_tokens : int = 0
+    retries : int = 0
+    cache_hits : int = 0
+    semantic_hits : int = 0
+    parse_failures : int = 0
+    truncations : int = 0
+    errors : int = 0
+
+
+class RunReport(BaseModel):
+    '''Represents the telemetry of a design run'''
+
+    wall_seconds : float = 0.0
+    records : List[StageRecord] = Field(default_factory=list)
+
+    def by_stage(self) -> Dict[str, StageSummary]:
+        ''' Totals per stage, in the order the stages first ran '''
+        summaries : Dict[str, StageSummary] = {}
+        for record in self.records:
+            summary = summaries.setdefault(record.stage, StageSummary())
+            summary.operations += 1
+            summary.wall_seconds += record.wall_seconds
+            summary.requests += record.requests
+            summary.prompt_tokens += record.prompt_tokens
+            summary.completion_tokens += record.completion_tokens
+            summary.retries += record.retries
+            summary.cache_hits += int(record.cache_hit)
+            summary.semantic_hits += int(record.semantic_hit)
+            summary.parse_failures += int(record.parse_failure)
+            summary.truncations += record.truncations
+            summary.errors += int(record.error is not None)
+        return summaries
+
+    def by_component(self) -> Dict[str, StageSummary]:
+        ''' Totals per designed component '''
+        return RunReport(records=[record.copy(update={'stage' : record.component})
+                                  for record in self.records if record.component is not None]).by_stage()
+
+
+def bind_recorder(callbacks : Any, stage : str, component : str = None):
+    """
+    Replaces a RunRecorder in the callbacks with the StageRecorder of a new record.
+
+    Args:
+        callbacks (Callbacks): LangChain callbacks of an operation.
+        stage (str): The stage of the operation.
+        component (str, optional): The component designed by the operation.
+
+    Returns:
+        Tuple[Callbacks, Optional[StageRecord]]: The callbacks to use and the record, None if no recorder is present.
+    """
+    is_manager = hasattr(callbacks, 'handlers') and hasattr(callbacks, 'inheritable_handlers')
+    if not isinstance(callbacks, list) and not is_manager:
+        return callbacks, None
+
+    from .recorder import RunRecorder
+
+    recorders = [handler for handler in (callbacks.handlers if is_manager else callbacks) if isinstance(handler, RunRecorder)]
+    if not recorders:
+        return callbacks, None
+
+    stage_recorder = recorders[0].start(stage, component)
+    if is_manager:
+        return add_callback_handler(callbacks, stage_recorder, replaced=RunRecorder), stage_recorder.record
+    handlers = [handler for handler in callbacks if not isinstance(handler, RunRecorder)]
+    return handlers + [stage_recorder], stage_recorder.record
+
+
+def raise_if_cancelled(callbacks : Any) -> None:
+    ''' Raises a CancelledError if a `CancellationHandler` among the callbacks is cancelled, checked before each request '''
+    is_manager = hasattr(callbacks, 'handlers') and hasattr(callbacks, 'inheritable_handlers')
+    if not isinstance(callbacks, list) and not is_manager:
+        return
+
+    from .recorder import CancellationHandler
+
+    if any(isinstance(handler, CancellationHandler) and handler.cancelled.is_set()
+           for handler in (callbacks.handlers if is_manager else callbacks)):
+        raise CancelledError("The operation was cancelled")
+
+
+def add_callback_handler(callback_manager : Any, handler : Any, replaced : type = None) -> Any:
+    """
+    Copies a LangChain callback manager with one more handler, the given manager is left as it is.
+
+    Args:
+        callback_manager (BaseCallbackManager): The callback manager.
+        handler (BaseCallbackHandler): The handler, inherited by the child runs (e.g. the llm calls of a chain).
+        replaced (type, optional): Handlers of this type are left out of the copy. Defaults to None.
+
+    Returns:
+        BaseCallbackManager: The copy, of the same type.
+    """
+    def kept(handlers : list) -> list:
+        return [kept_handler for kept_handler in handlers if replaced is None or not isinstance(kept_handler, replaced)]
+
+    # LangChain managers have no `copy` yet
+    copy = type(callback_manager)(handlers=kept(callback_manager.handlers),
+                                  inheritable_handlers=kept(callback_manager.inheritable_handlers),
+                                  parent_run_id=callback_manager.parent_run_id)
+    copy.add_handler(handler, inherit=True)
+    return copy
+
+
+def __getattr__(name : str) -> Any:
+    # the callback handlers live in `recorder`, which imports LangChain
+    if name in ('RunRecorder', 'StageRecorder', 'CancellationHandler'):
+        from . import recorder
+        return getattr(recorder, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_prometheus_metrics = None
+
+def export_prometheus(report : RunReport, registry = None) -> None:
+    """
+    Adds a run report to Prometheus metrics. Requires the optional `prometheus_client` package.
+
+    Args:
+        report (RunReport): The run report.
+        registry (CollectorRegistry, optional): The registry of the metrics, created on the first export only.
+            Defaults to the default registry of prometheus_client.
+    """
+    global _prometheus_metrics
+    try:
+        from prometheus_client import Counter, Histogram, REGISTRY
+    except ImportError:
+        raise ImportError("prometheus_client is required to export metrics, install it with `pip install prometheus-client`")
+
+    if _prometheus_metrics is None:
+        registry = registry if registry is not None else REGISTRY
+        _prometheus_metrics = {
+            'seconds' : Histogram('gensysai_stage_seconds', 'Wall time of a design stage', ['stage'], registry=registry),
+            'requests' : Counter('gensysai_stage_requests', 'LLM requests of a design stage', ['stage'], registry=registry),
+            'tokens' : Counter('gensysai_stage_tokens', 'Tokens of a design stage', ['stage', 'kind'], registry=registry),
+            'completion_tokens' : Histogram('gensysai_stage_completion_tokens', 'Completion tokens of an operation of a design stage', ['stage'],
+                                            buckets=(32, 64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096), registry=registry),
+            'truncations' : Counter('gensysai_stage_truncations', 'Completions cut at max_tokens', ['stage'], registry=registry),
+            'retries' : Counter('gensysai_stage_retries', 'Retries of a design stage', ['stage'], registry=registry),
+            'cache_hits' : Counter('gensysai_stage_cache_hits', 'Cache hits of a design stage', ['stage'], registry=registry),
+            'parse_failures' : Counter('gensysai_stage_parse_failures', 'Parse failures of a design stage', ['stage'], registry=registry),
+        }
+
+    metrics = _prometheus_metrics
+    for record in report.records:
+        metrics['seconds'].labels(record.stage).observe(record.wall_seconds)
+        metrics['requests'].labels(record.stage).inc(record.requests)
+        metrics['tokens'].labels(record.stage, 'prompt').inc(record.prompt_tokens)
+        metrics['tokens'].labels(record.stage, 'completion').inc(record.completion_tokens)
+        if record.requests > 0:
+            metrics['completion_tokens'].labels(record.stage).observe(record.completion_tokens)
+        metrics['truncations'].labels(record.stage).inc(record.truncations)
+        metrics['retries'].labels(record.stage).inc(record.retries)
+        metrics['cache_hits'].labels(record.stage).inc(int(record.cache_hit))
+        metrics['parse_failures'].labels(record.stage).inc(int(record.parse_failure))
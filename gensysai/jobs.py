@@ -0,0 +1,427 @@
+from __future__ import annotations
+from .designdoc import DesignDocument
+from .designer.checkpoint import CheckpointStore, content_key
+from .designer.ratelimiter import RateLimiter, SQLiteRateLimiter, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE
+from .export import PROBLEM_STATEMENT, apply_design_event
+from pydantic import BaseModel
+from functools import partial
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Union
+import multiprocessing
+import os
+import sqlite3
+import time
+import uuid
+
+if TYPE_CHECKING:
+    from .designer.system import SystemDesigner
+
+DEFAULT_JOBS_PATH = '.gensysai_jobs.sqlite'
+# a running job whose worker has not reported for this long is claimed again, e.g. after a crash
+LEASE_SECONDS = 900.0
+POLL_SECONDS = 1.0
+# the text of the running llm calls of a job is saved at most this often
+STREAM_SECONDS = 0.5
+HTTP_POOL_SIZE = 32
+
+
+class JobStatus:
+    ''' Statuses of a design job '''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    FINISHED = (DONE, FAILED)
+
+
+class Job(BaseModel):
+    '''Represents a design job, the result holds the sections completed so far while it runs'''
+
+    id : str
+    problem_statement : str
+    cloud_provider : str = 'Any'
+    status : str = JobStatus.QUEUED
+    result : Optional[DesignDocument] = None
+    error : Optional[str] = None
+    partial : Optional[str] = None
+    '''Text streamed so far by the running LLM calls of the job'''
+    worker : Optional[str] = None
+    attempts : int = 0
+    queued_at : float = 0.0
+    started_at : Optional[float] = None
+    finished_at : Optional[float] = None
+
+    @property
+    def cloud_providers(self) -> List[str]:
+        ''' The providers of the job, several for a multi-cloud design '''
+        return self.cloud_provider.split(',')
+
+
+def job_key(problem_statement : str, cloud_provider : str = 'Any') -> str:
+    ''' Id of the job of a problem, the same problem up to whitespace and case is designed once '''
+    return content_key(' '.join(problem_statement.split()).lower(), cloud_provider)
+
+
+class JobQueue:
+    '''
+        Persistent queue of design jobs backed by SQLite, shared by the UI and the worker processes.
+        Jobs are deduplicated by problem statement and keep their result once done.
+    '''
+
+    def __init__(self, path : str = DEFAULT_JOBS_PATH, lease_seconds : float = LEASE_SECONDS) -> None:
+        """
+        Initialize the JobQueue object.
+
+        Args:
+            path (str, optional): Path of the SQLite database. Defaults to `.gensysai_jobs.sqlite`. \n
+            lease_seconds (float, optional): A running job without progress for this long is given to another worker. Defaults to 900. \n
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+
+        self.__lock = Lock()
+        # transactions are explicit, a claim locks the database against the other processes
+        self.__connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ':memory:':
+            # the UI polls while the workers write
+            self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                problem_statement TEXT NOT NULL,
+                cloud_provider TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                partial TEXT,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                queued_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL)''')
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, queued_at)')
+        # databases created before the partial texts were streamed
+        columns = [row[1] for row in self.__connection.execute('PRAGMA table_info(jobs)').fetchall()]
+        if 'partial' not in columns:
+            self.__connection.execute('ALTER TABLE jobs ADD COLUMN partial TEXT')
+
+    def submit(self, problem_statement : str, cloud_provider : Union[str, List[str]] = 'Any') -> str:
+        """
+        Queues the design of a problem, unless the same problem is already queued, running or done.
+        A failed job is queued again.
+
+        Args:
+            problem_statement (str): The problem statement.
+            cloud_provider (Union[str, List[str]], optional): The cloud provider, or the providers compared by a multi-cloud design. 
+                Defaults to 'Any'.
+
+        Returns:
+            str: The job id.
+        """
+        if not isinstance(cloud_provider, str):
+            cloud_provider = ','.join(cloud_provider)
+        job_id = job_key(problem_statement, cloud_provider)
+        with self.__transaction() as connection:
+            row = connection.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                connection.execute('''INSERT INTO jobs (id, problem_statement, cloud_provider, status, queued_at)
+                        VALUES (?, ?, ?, ?, ?)''', (job_id, problem_statement, cloud_provider, JobStatus.QUEUED, time.time()))
+            elif row[0] == JobStatus.FAILED:
+                connection.execute('''UPDATE jobs SET status = ?, error = NULL, worker = NULL, queued_at = ?,
+                        started_at = NULL, heartbeat_at = NULL, finished_at = NULL WHERE id = ?''',
+                        (JobStatus.QUEUED, time.time(), job_id))
+        return job_id
+
+    def get(self, job_id : str) -> Optional[Job]:
+        ''' The job, None if there is no such job '''
+        with self.__lock:
+            row = self.__connection.execute(f'SELECT {self.__columns()} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self.__job(row) if row is not None else None
+
+    def jobs(self, status : str = None, limit : int = 100) -> List[Job]:
+        ''' The most recently queued jobs, of a status if given '''
+        query = f'SELECT {self.__columns()} FROM jobs'
+        parameters = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            parameters = (status,)
+        with self.__lock:
+            rows = self.__connection.execute(query + ' ORDER BY queued_at DESC LIMIT ?', parameters + (limit,)).fetchall()
+        return [self.__job(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        ''' Number of jobs by status '''
+        with self.__lock:
+            return dict(self.__connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def claim(self, worker : str) -> Optional[Job]:
+        """
+        Takes the oldest queued job, or a running job whose lease has expired.
+
+        Args:
+            worker (str): Id of the worker, only the worker holding a job can report on it.
+
+        Returns:
+            Job: The claimed job, None if there is nothing to do.
+        """
+        now = time.time()
+        with self.__transaction() as connection:
+            row = connection.execute(f'''SELECT {self.__columns()} FROM jobs
+                    WHERE status = ? OR (status = ? AND heartbeat_at < ?)
+                    ORDER BY queued_at LIMIT 1''', (JobStatus.QUEUED, JobStatus.RUNNING, now - self.lease_seconds)).fetchone()
+            if row is None:
+                return None
+            connection.execute('''UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, partial = NULL,
+                    started_at = ?, heartbeat_at = ? WHERE id = ?''', (JobStatus.RUNNING, worker, now, now, row[0]))
+
+        job = self.__job(row)
+        return job.copy(update={'status' : JobStatus.RUNNING, 'worker' : worker, 'attempts' : job.attempts + 1,
+                                'partial' : None, 'started_at' : now})
+
+    def update(self, job_id : str, worker : str, result : DesignDocument) -> bool:
+        ''' Saves the sections completed so far and renews the lease, False if the job is no longer held by the worker '''
+        return self.__report(job_id, worker, JobStatus.RUNNING, result, None)
+
+    def stream(self, job_id : str, worker : str, partial : Optional[str]) -> bool:
+        ''' Saves the text streamed so far by the running llm calls and renews the lease, False if the job is no longer held by the worker '''
+        with self.__transaction() as connection:
+            cursor = connection.execute('''UPDATE jobs SET partial = ?, heartbeat_at = ? WHERE id = ? AND worker = ? AND status = ?''',
+                                        (partial, time.time(), job_id, worker, JobStatus.RUNNING))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id : str, worker : str, result : DesignDocument) -> bool:
+        ''' Saves the result of a job, False if the job is no longer held by the worker '''
+        return self.__report(job_id, worker, JobStatus.DONE, result, None)
+
+    def fail(self, job_id : str, worker : str, error : str, result : DesignDocument = None) -> bool:
+        ''' Saves the error of a job along with its completed sections, False if the job is no longer held by the worker '''
+        return self.__report(job_id, worker, JobStatus.FAILED, result, error)
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+    def __report(self, job_id : str, worker : str, status : str, result : Optional[DesignDocument], error : Optional[str]) -> bool:
+        now = time.time()
+        finished_at = now if status in JobStatus.FINISHED else None
+        with self.__transaction() as connection:
+            # a finished job has no call in flight
+            cursor = connection.execute('''UPDATE jobs SET status = ?, result = COALESCE(?, result), error = ?,
+                    partial = CASE WHEN ? IS NULL THEN partial END,
+                    heartbeat_at = ?, finished_at = ? WHERE id = ? AND worker = ? AND status = ?''',
+                    (status, result.json() if result is not None else None, error, finished_at, now, finished_at,
+                     job_id, worker, JobStatus.RUNNING))
+            return cursor.rowcount == 1
+
+    def __transaction(self):
+        return _Transaction(self.__connection, self.__lock)
+
+    @staticmethod
+    def __columns() -> str:
+        return 'id, problem_statement, cloud_provider, status, result, error, worker, attempts, queued_at, started_at, finished_at, partial'
+
+    @staticmethod
+    def __job(row) -> Job:
+        return Job(id=row[0], problem_statement=row[1], cloud_provider=row[2], status=row[3],
+                   result=DesignDocument.parse_raw(row[4]) if row[4] is not None else None,
+                   error=row[5], worker=row[6], attempts=row[7], queued_at=row[8], started_at=row[9], finished_at=row[10],
+                   partial=row[11])
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock upfront, so two processes cannot claim the same job
+    def __init__(self, connection : sqlite3.Connection, lock : Lock) -> None:
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.connection.execute('BEGIN IMMEDIATE')
+        except Exception:
+            self.lock.release()
+            raise
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        try:
+            self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self.lock.release()
+
+
+# (cloud provider, rate limiter, checkpoints) -> designer, must be picklable, i.e. a module level function or a partial of one
+DesignerFactory = Callable[[str, RateLimiter, CheckpointStore], 'SystemDesigner']
+
+
+def openai_designer(cloud_provider : str,
+        rate_limiter : RateLimiter,
+        checkpoints : CheckpointStore = None,
+        model_name : str = 'gpt-3.5-turbo',
+        max_tokens : int = None,
+        light_model_name : str = None,
+        **kwargs) -> SystemDesigner:
+    """
+    Designer factory of the workers using an OpenAI model, with a pooled HTTP session per worker process.
+
+    Args:
+        cloud_provider (str): The cloud provider of the jobs of the designer.
+        rate_limiter (RateLimiter): The rate limiter shared by the workers.
+        checkpoints (CheckpointStore, optional): The completed stages shared by the workers. Defaults to None, an in-memory store.
+        model_name (str, optional): The OpenAI model. Defaults to 'gpt-3.5-turbo'.
+        max_tokens (int, optional): Completion tokens of every request. Defaults to None, a `TokenBudget` per stage.
+        light_model_name (str, optional): Faster OpenAI model of the title and the problem analysis, within the rate budget 
+            of the workers. Defaults to None, `model_name`.
+        **kwargs: Further arguments of the SystemDesigner.
+    """
+    import openai
+    import requests
+    from requests.adapters import HTTPAdapter
+    from langchain.llms import OpenAI
+    from .designer.system import SystemDesigner
+    from .designer.budget import TokenBudget
+    from .designer.routing import StageModel
+
+    if getattr(openai, 'requestssession', None) is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        openai.requestssession = session
+
+    # the tokens are streamed to the app while a job runs, see `PartialTextHandler`, without max_tokens
+    # the llms have the default one and the token budget picks those of the requests
+    llm_kwargs = dict(temperature=0.1, streaming=True)
+    if max_tokens is None:
+        kwargs.setdefault('token_budget', TokenBudget())
+    else:
+        llm_kwargs['max_tokens'] = max_tokens
+    llm = OpenAI(model_name=model_name, **llm_kwargs)
+    if light_model_name is not None and light_model_name != model_name:
+        light_llm = OpenAI(model_name=light_model_name, **llm_kwargs)
+        kwargs.setdefault('stage_models', {stage : StageModel(light_llm) for stage in ('title', 'analyzer')})
+    return SystemDesigner(llm=llm, cloud_provider=cloud_provider, rate_limiter=rate_limiter, checkpoints=checkpoints, **kwargs)
+
+
+class WorkerPool:
+    '''
+        Processes executing the jobs of a `JobQueue`. Every request of the workers goes through one
+        `SQLiteRateLimiter` in the same database, so throughput scales with the workers within a global rate budget.
+    '''
+
+    def __init__(self,
+            designer_factory : DesignerFactory,
+            path : str = DEFAULT_JOBS_PATH,
+            workers : int = 2,
+            requests_per_minute : Optional[int] = REQUESTS_PER_MINUTE,
+            tokens_per_minute : Optional[int] = TOKENS_PER_MINUTE,
+            poll_seconds : float = POLL_SECONDS,
+            stages_directory : str = None
+            ) -> None:
+        """
+        Initialize the WorkerPool object.
+
+        Args:
+            designer_factory (DesignerFactory): Builds the designer of a cloud provider in a worker, e.g. a partial of `openai_designer`.
+                It should pass the given rate limiter and checkpoints on to the designer. \n
+            path (str, optional): Path of the SQLite database of the queue. Defaults to `.gensysai_jobs.sqlite`. \n
+            workers (int, optional): Number of worker processes. Defaults to 2. \n
+            requests_per_minute (int, optional): Requests per minute of all the workers together, None for no limit. Defaults to 15. \n
+            tokens_per_minute (int, optional): Tokens per minute of all the workers together, None for no limit. Defaults to 40000. \n
+            poll_seconds (float, optional): Idle workers look for new jobs this often. Defaults to 1. \n
+            stages_directory (str, optional): Directory of the completed stages shared by the workers, so that a job differing from 
+                a previous one, e.g. by its cloud provider, only requests the stages whose inputs changed. 
+                Defaults to None, `<path>.stages`. \n
+        """
+        if workers < 1:
+            raise ValueError("workers should be at least 1")
+        if path == ':memory:':
+            raise ValueError("The worker processes need a database file")
+
+        self.designer_factory = designer_factory
+        self.path = path
+        self.workers = workers
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.poll_seconds = poll_seconds
+        self.stages_directory = stages_directory if stages_directory is not None else f"{path}.stages"
+
+        # spawned, not forked, the parent may hold SQLite connections and threads
+        self.__context = multiprocessing.get_context('spawn')
+        self.__stop = self.__context.Event()
+        self.__processes : List[multiprocessing.Process] = []
+
+    def start(self) -> 'WorkerPool':
+        if self.__processes:
+            raise RuntimeError("The pool is already started")
+        # creates the tables before the workers race for it
+        JobQueue(self.path).close()
+        self.__stop.clear()
+        for i in range(self.workers):
+            process = self.__context.Process(target=_work, daemon=True, name=f"gensysai-worker-{i}",
+                                             args=(self.designer_factory, self.path, self.requests_per_minute,
+                                                   self.tokens_per_minute, self.poll_seconds, self.stages_directory, self.__stop))
+            process.start()
+            self.__processes.append(process)
+        return self
+
+    def stop(self, timeout : float = None) -> None:
+        ''' Stops the workers once their current job is done '''
+        self.__stop.set()
+        for process in self.__processes:
+            process.join(timeout)
+        self.__processes = []
+
+    def is_alive(self) -> bool:
+        return any(process.is_alive() for process in self.__processes)
+
+    def __enter__(self) -> 'WorkerPool':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def _work(designer_factory : DesignerFactory,
+        path : str,
+        requests_per_minute : Optional[int],
+        tokens_per_minute : Optional[int],
+        poll_seconds : float,
+        stages_directory : str,
+        stop) -> None:
+    # the loop of a worker process
+    from .streaming import PartialTextHandler
+
+    worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    queue = JobQueue(path)
+    rate_limiter = SQLiteRateLimiter(path, requests_per_minute, tokens_per_minute)
+    # the designers of every cloud provider share the stages that do not depend on it
+    checkpoints = CheckpointStore(directory=stages_directory)
+    designers : Dict[str, SystemDesigner] = {}
+
+    while not stop.is_set():
+        job = queue.claim(worker)
+        if job is None:
+            stop.wait(poll_seconds)
+            continue
+
+        design_doc = apply_design_event(DesignDocument(), PROBLEM_STATEMENT, job.problem_statement)
+        try:
+            # a multi-cloud job runs on the designer of its first provider
+            cloud_providers = job.cloud_providers
+            if cloud_providers[0] not in designers:
+                designers[cloud_providers[0]] = designer_factory(cloud_providers[0], rate_limiter, checkpoints)
+            # the text of the running llm calls is saved as it streams, the UI shows it until their section completes
+            streamer = PartialTextHandler(partial(queue.stream, job.id, worker), interval=STREAM_SECONDS)
+            events = designers[cloud_providers[0]].design_iter(job.problem_statement, callbacks=[streamer],
+                                                                cloud_providers=cloud_providers if len(cloud_providers) > 1 else None)
+            for event, payload in events:
+                design_doc = apply_design_event(design_doc, event, payload)
+                # the sections are saved as they complete, the UI shows them while the job runs
+                if not queue.update(job.id, worker, design_doc):
+                    break
+            else:
+                queue.complete(job.id, worker, design_doc)
+        except Exception as e:
+            queue.fail(job.id, worker, str(e), design_doc)
+    queue.close()
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, validator
 from typing import List
+import json
 
 class Component(BaseModel):
     '''Represents a single component of a system'''
@@ -22,12 +23,31 @@ class Component(BaseModel):
             "description" : {self.description}
         }}'''
 
+    def compact_str(self) -> str:
+        ''' The component as single line JSON, for compact prompts '''
+        return json.dumps({"name" : self.name, "component_type" : self.component_type, "description" : self.description})
+
+class ProblemSummary(BaseModel):
+    '''Represents the title and the functional requirements of a problem statement'''
+
+    title : str = Field(description="a 2-3 word title of the system")
+    functional_requirements : str = Field(description="numbered list of the functional requirements")
+
 class System(BaseModel):
     '''Represents a System that consists of multiple components'''
 
     functional_requirements : str = Field(description="Functional Requirements")
     components: List[Component] = Field(description="List of Components")
 
+class ComponentDesign(BaseModel):
+    '''Represents the design of a single component within a batch'''
+    name: str = Field(description="name of the component, exactly as given")
+    design: str = Field(description="design of the component in markdown bullet points")
+
+class ComponentDesigns(BaseModel):
+    '''Represents the designs of several components designed in a single request'''
+    designs: List[ComponentDesign] = Field(description="one design per given component")
+
 class ServiceComponent(BaseModel):
     '''Represents a Service Component with a design'''
     requirement: str = Field(description="Requirements of the service component")
@@ -23,6 +23,26 @@ class Prompts:
         {input}
         '''
     
+    TitledFunctionalRequirementPrompt : str = '''
+        You are an expert in distributed system. 
+        The scope of your task will be to generate a 2-3 word title of the system and identify functional requirements from a given system design problem statement.
+        On response you should list down the functional requirements as you understand. If the question is vague and does not really talk about a
+        problem, return "Sorry, this does not seem like a System Design Problem. Please rephrase and try again." as the functional requirements.
+
+        {format_instructions}
+
+        ## Example:
+        Problem Statement : Design a Chat Application like WhatsApp, where an user can send or receive message, create a group with more than 2 people, gets notification when a new message is received.
+
+        ## Sample Output:
+        {{
+            "title": "Chat Application",
+            "functional_requirements": "1. Messaging functionality - allow users to send and receive messages through the chat application.\\n2. Group creation functionality - enable users to create groups within the application, which they can join to communicate with other members.\\n3. Notification functionality - notify users when someone sends them a new message, or when a new member joins their group."
+        }}
+
+        {input}
+        '''
+    
     ComponentIdentifierPrompt : str = '''
         You are an expert assistant to design a distributed System. 
         Given a list of functional requirements, you have to provide **high level Components** of the system under design.
@@ -36,7 +56,7 @@ class Prompts:
         {format_instructions}
 
         Output based on the functional requirement as below : 
-        {input}
+        {functional_requirements}
         '''
     
     StorageComponentDesignerPrompt : str = '''
@@ -101,8 +121,74 @@ class Prompts:
 
         '''
     
+    BatchedGenericComponentDesignerPrompt : str = '''
+        You are an expert assistant to design a distributed System. 
+        Given a list of components of a large system, you have to design each of the components.
+        1. You should understand the requirement of each component from its description.
+        2. You should enlist a few popular and accepted approaches to solve the problem and the requirement.
+        3. Suggest a well-known cloud offering that satisfies the requirement of the component from {cloud_provider} cloud provider.
+
+        You should iterate to each of the points mentioned above to refine the design of every component.
+        Your designs should be very specific to the problem and should not generate extra outputs.
+        Write the design of each component in bullet points, with the name of the component exactly as given.
+
+        {format_instructions}
+
+        {components}
+
+        '''
+    
     TitleGenerationPrompt : str = '''
         Generate a 2-3 word title of a distributed system, based on the given problem statement below.
 
         {input}
-        '''
\ No newline at end of file
+        '''
+
+class PromptMode:
+    ''' How the templates of `Prompts` are rendered, see `compact_prompt` '''
+    FULL = 'full'
+    # indentation and blank lines stripped, components serialized as compact JSON
+    COMPACT = 'compact'
+    # compact without the few-shot examples, for models that follow the format instructions alone
+    MINIMAL = 'minimal'
+
+    ALL = [FULL, COMPACT, MINIMAL]
+
+
+# few-shot examples are the paragraphs starting with these headers
+EXAMPLE_HEADERS = ('## Example', '## Sample Output')
+
+
+def compact_prompt(template : str, mode : str = PromptMode.COMPACT) -> str:
+    """
+    Compacts a prompt template to fewer tokens.
+
+    Args:
+        template (str): A template of `Prompts`.
+        mode (str, optional): One of `PromptMode.ALL`, the template is returned as is for `PromptMode.FULL`. Defaults to `PromptMode.COMPACT`.
+
+    Returns:
+        str: The compacted template, with the same input variables.
+    """
+    if mode not in PromptMode.ALL:
+        raise ValueError(f"Prompt mode should be from {PromptMode.ALL}")
+    if mode == PromptMode.FULL:
+        return template
+
+    paragraphs, paragraph = [], []
+    for line in template.splitlines() + ['']:
+        line = ' '.join(line.split())
+        if line:
+            paragraph.append(line)
+        elif paragraph:
+            paragraphs.append(paragraph)
+            paragraph = []
+
+    compacted, skip_next = [], False
+    for paragraph in paragraphs:
+        if mode == PromptMode.MINIMAL and (skip_next or paragraph[0].startswith(EXAMPLE_HEADERS)):
+            # a lone header is followed by its example in the next paragraph
+            skip_next = not skip_next and len(paragraph) == 1
+            continue
+        compacted.append('\n'.join(paragraph))
+    return '\n\n'.join(compacted)
@@ -0,0 +1,73 @@
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+from threading import Event, Lock
+from typing import Any, Dict, List
+from .instrumentation import CHARS_PER_TOKEN, RunReport, StageRecord
+from .designer.budget import is_truncated
+import time
+
+
+class StageRecorder(BaseCallbackHandler):
+    ''' Callback handler bound to the record of one operation, counts its requests and tokens '''
+
+    def __init__(self, record : StageRecord) -> None:
+        self.record = record
+        self.__lock = Lock()
+        self.__prompt_tokens = 0
+        self.__max_tokens = None
+
+    def on_llm_start(self, serialized : Dict[str, Any], prompts : List[str], **kwargs : Any) -> None:
+        with self.__lock:
+            self.record.requests += 1
+            self.__prompt_tokens = sum(len(prompt) // CHARS_PER_TOKEN + 1 for prompt in prompts)
+            self.__max_tokens = (kwargs.get('invocation_params') or {}).get('max_tokens')
+
+    def on_llm_end(self, response : LLMResult, **kwargs : Any) -> None:
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        with self.__lock:
+            if response.generations and response.generations[0] and is_truncated(response, self.__max_tokens):
+                self.record.truncations += 1
+            if 'prompt_tokens' in usage or 'completion_tokens' in usage:
+                self.record.prompt_tokens += usage.get('prompt_tokens', 0)
+                self.record.completion_tokens += usage.get('completion_tokens', 0)
+            else:
+                # streaming and non OpenAI llms report no usage
+                self.record.tokens_estimated = True
+                self.record.prompt_tokens += self.__prompt_tokens
+                self.record.completion_tokens += sum(len(generation.text) // CHARS_PER_TOKEN + 1
+                                                     for generations in response.generations
+                                                     for generation in generations)
+
+
+class RunRecorder(BaseCallbackHandler):
+    '''
+        Collects a StageRecord for each operation of a design run. Passed among the callbacks of an operation,
+        the operation replaces it with a `StageRecorder` bound to a new record, see `OpenAIOperation`.
+    '''
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__records : List[StageRecord] = []
+        self.__start = time.perf_counter()
+
+    def start(self, stage : str, component : str = None) -> StageRecorder:
+        ''' Starts the record of an operation and returns its callback handler '''
+        record = StageRecord(stage=stage, component=component)
+        with self.__lock:
+            self.__records.append(record)
+        return StageRecorder(record)
+
+    def report(self) -> RunReport:
+        with self.__lock:
+            return RunReport(wall_seconds=time.perf_counter() - self.__start,
+                             records=[record.copy() for record in self.__records])
+
+
+class CancellationHandler(BaseCallbackHandler):
+    '''
+        Passed among the callbacks of operations that may be abandoned, e.g. speculative designs. Once the event is set,
+        the operations raise a CancelledError before their next request, see `instrumentation.raise_if_cancelled`.
+    '''
+
+    def __init__(self, cancelled : Event) -> None:
+        self.cancelled = cancelled
@@ -0,0 +1,63 @@
+from langchain.callbacks.base import BaseCallbackHandler
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+import time
+
+# the streamed texts of the concurrent llm calls of a design, e.g. of its components, are shown one after the other
+SEPARATOR = '\n\n---\n\n'
+
+
+class PartialTextHandler(BaseCallbackHandler):
+    '''
+        Streams the text of the running LLM calls to a callable, e.g. into the record of a queued job.
+        The tokens are published at most once per interval, a completed call is removed right away.
+    '''
+
+    def __init__(self, publish : Callable[[Optional[str]], Any], interval : float = 0.5) -> None:
+        """
+        Initialize the PartialTextHandler object.
+
+        Args:
+            publish (Callable[[Optional[str]], Any]): Receives the text of the running calls, None once none is running. \n
+            interval (float, optional): Minimum seconds between two publications of new tokens. Defaults to 0.5. \n
+        """
+        self.publish = publish
+        self.interval = interval
+
+        self.__lock = Lock()
+        # run id -> text streamed so far, in the order the calls started
+        self.__texts : Dict[UUID, str] = {}
+        self.__published_at = 0.0
+
+    def on_llm_start(self, serialized : Dict[str, Any], prompts : List[str], *, run_id : UUID, **kwargs : Any) -> None:
+        with self.__lock:
+            self.__texts[run_id] = ''
+
+    def on_llm_new_token(self, token : str, *, run_id : UUID, **kwargs : Any) -> None:
+        now = time.monotonic()
+        with self.__lock:
+            self.__texts[run_id] = self.__texts.get(run_id, '') + token
+            if now - self.__published_at < self.interval:
+                return
+            self.__published_at = now
+            text = self.__text()
+        self.publish(text)
+
+    def on_llm_end(self, response : Any, *, run_id : UUID, **kwargs : Any) -> None:
+        self.__finish(run_id)
+
+    def on_llm_error(self, error : BaseException, *, run_id : UUID, **kwargs : Any) -> None:
+        self.__finish(run_id)
+
+    def __finish(self, run_id : UUID) -> None:
+        with self.__lock:
+            # a call that streamed nothing changes nothing
+            if not self.__texts.pop(run_id, None):
+                return
+            text = self.__text()
+        self.publish(text)
+
+    def __text(self) -> Optional[str]:
+        texts = [text for text in self.__texts.values() if text]
+        return SEPARATOR.join(texts) if texts else None
@@ -1,18 +1,131 @@
 import os
+import time
+import argparse
+from functools import partial
 from getpass import getpass
-from langchain.llms import OpenAI
-from langchain.chat_models import ChatOpenAI
 from gensysai.designer.system import SystemDesigner
+from gensysai.designer.batch import BatchCheckpoint, read_problems
+from gensysai.designer.checkpoint import CheckpointStore
+from gensysai.designer.ratelimiter import RateLimiter
+from gensysai.designer.routing import StageModel
+from gensysai.designer.budget import TokenBudget
+from gensysai.designer.speculation import SPECULATIVE_TYPES
+from gensysai.prompts import PromptMode
+from gensysai.jobs import DEFAULT_JOBS_PATH, JobQueue, WorkerPool, openai_designer
+
+TITLE_MAX_TOKENS = 32
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GenSysAI: GPT-Driven Automated Distributed System Designer")
+    parser.add_argument('--batch', help="JSONL file of problem statements to design, instead of an interactive prompt")
+    parser.add_argument('--output-dir', default='./samples/generated', help="Directory of the generated designs in batch mode")
+    parser.add_argument('--workers', type=int, default=4, help="Number of problems designed in parallel in batch mode")
+    parser.add_argument('--checkpoint', help="Checkpoint file to resume a batch from, defaults to <output-dir>/checkpoint.txt")
+    parser.add_argument('--model', default='gpt-3.5-turbo', help="Model of the component designs")
+    parser.add_argument('--light-model', help="Faster model of the title and the problem analysis, with its own rate limits "
+                        "(those of the workers with --serve). Defaults to --model")
+    parser.add_argument('--max-tokens', type=int, help="Completion tokens of every component design. Defaults to a token budget "
+                        "per stage, from the prompt size and the context window of the model, continuing truncated completions")
+    parser.add_argument('--cloud-provider', nargs='+', default=['Any'], choices=['Any', 'AWS', 'Azure', 'GCP'],
+                        help="Several providers are compared in one design, the provider independent stages run once. "
+                        "With --serve, each job has its own")
+    parser.add_argument('--fuse-title', action='store_true', help="Generate the title within the problem analysis, one request less per design")
+    parser.add_argument('--prompt-mode', default=PromptMode.FULL, choices=PromptMode.ALL, 
+                        help="compact strips the prompts' whitespace, minimal also drops their few-shot examples")
+    parser.add_argument('--output-format', default='md', choices=['md', 'json'],
+                        help="json saves each section of a design as soon as it completes, render it later with gensysai.export")
+    parser.add_argument('--batch-size', type=int, default=1, help="Cache and Load Balancer components designed per request")
+    parser.add_argument('--speculate', action='store_true', help="Design the Storage, Load Balancer and Cache from the problem statement "
+                        "while it is analyzed, a few extra requests for a shorter design")
+    parser.add_argument('--stages-dir', help="Directory of the completed stages, a rerun (e.g. with another --cloud-provider) "
+                        "only requests the stages whose inputs changed. Defaults to <jobs-path>.stages with --serve, only kept for retries otherwise")
+    parser.add_argument('--serve', action='store_true', help="Run --workers worker processes for the design jobs of the streamlit app")
+    parser.add_argument('--jobs-path', default=DEFAULT_JOBS_PATH, help="SQLite database of the design jobs")
+    parser.add_argument('--rpm', type=int, default=15, help="Requests per minute of all the workers together with --serve")
+    args = parser.parse_args()
+    if args.serve and args.cloud_provider != ['Any']:
+        # the app picks the providers of each job
+        parser.error("--cloud-provider does not apply to --serve, the cloud providers are those of each job")
+    return args
+
+
+def serve(args):
+    ''' Runs the workers of the design jobs until interrupted '''
+    # the workers build their own designers, LangChain is only imported by them
+    factory = partial(openai_designer, model_name=args.model, light_model_name=args.light_model, max_tokens=args.max_tokens, fuse_title=args.fuse_title,
+                      prompt_mode=args.prompt_mode, batch_size=args.batch_size,
+                      speculative_types=SPECULATIVE_TYPES if args.speculate else None)
+    queue = JobQueue(args.jobs_path)
+    with WorkerPool(factory, path=args.jobs_path, workers=args.workers, requests_per_minute=args.rpm, stages_directory=args.stages_dir):
+        print(f"Serving design jobs of {args.jobs_path} with {args.workers} workers, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(60)
+                print(f"Jobs : {queue.counts()}")
+        except KeyboardInterrupt:
+            print("Stopping the workers once their current design is done")
+
+
+def design(args):
+    ''' Designs a problem statement from the input, or the problems of --batch '''
+    # LangChain is imported once the arguments are parsed, `--help` and argument errors stay instant
+    from langchain.chat_models import ChatOpenAI
+
+    # without --max-tokens the llms have none, the token budget picks those of the requests
+    llm = ChatOpenAI(temperature=0.1, max_tokens=args.max_tokens, model_name=args.model)
+    token_budget = TokenBudget() if args.max_tokens is None else None
+    # a title is a few words, the analysis is as long as a design
+    stage_models = {'title' : StageModel(max_tokens=TITLE_MAX_TOKENS)}
+    if args.light_model is not None and args.light_model != args.model:
+        light_llm = ChatOpenAI(temperature=0.1, max_tokens=args.max_tokens, model_name=args.light_model)
+        # the quota of each model is separate
+        light_rate_limiter = RateLimiter()
+        stage_models = {
+            'title' : StageModel(light_llm, max_tokens=TITLE_MAX_TOKENS, rate_limiter=light_rate_limiter),
+            'analyzer' : StageModel(light_llm, rate_limiter=light_rate_limiter),
+        }
+    cloud_providers = args.cloud_provider if len(args.cloud_provider) > 1 else None
+    designer = SystemDesigner(llm=llm, cloud_provider=args.cloud_provider[0], fuse_title=args.fuse_title, stage_models=stage_models,
+                              token_budget=token_budget, prompt_mode=args.prompt_mode, batch_size=args.batch_size, checkpoints=CheckpointStore(args.stages_dir) if args.stages_dir is not None else None,
+                              speculative_types=SPECULATIVE_TYPES if args.speculate else None, verbose=True)
+
+    if args.batch is None:
+        problem_statement = input("Enter the problem statement: ")
+        designer.design(problem_statement=problem_statement, cloud_providers=cloud_providers)
+        if args.output_format == 'json':
+            designer.dump_to_json_file("./samples/generated/design001.json")
+        else:
+            designer.dump_to_md_file("./samples/generated/design001.md")
+    else:
+        checkpoint_path = args.checkpoint or os.path.join(args.output_dir, 'checkpoint.txt')
+        os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+        checkpoint = BatchCheckpoint(checkpoint_path)
+
+        results = designer.design_many(read_problems(args.batch),
+                                       max_workers=args.workers,
+                                       output_dir=args.output_dir,
+                                       checkpoint=checkpoint,
+                                       output_format=args.output_format,
+                                       cloud_providers=cloud_providers)
+        failed = 0
+        for problem_id, design_doc, error in results:
+            if error is None:
+                print(f"[done] {problem_id} : {design_doc.title}")
+            else:
+                failed += 1
+                print(f"[failed] {problem_id} : {error}")
+        print(f"Completed : {len(checkpoint)}, Failed : {failed}")
 
 
 if __name__ == '__main__':
-    OPENAI_API_KEY = getpass("Enter your OPEN AI API key: ")
-    os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
+    args = parse_args()
 
-    ## TODO: parameterize model names
-    llm = ChatOpenAI(temperature=0.1, max_tokens= 512, model_name='gpt-3.5-turbo')
-    designer = SystemDesigner(llm=llm, verbose=True)
+    if "OPENAI_API_KEY" not in os.environ:
+        OPENAI_API_KEY = getpass("Enter your OPEN AI API key: ")
+        os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
 
-    problem_statement = input("Enter the problem statement: ")
-    designer.design(problem_statement=problem_statement)
-    designer.dump_to_md_file("./samples/generated/design001.md")
+    if args.serve:
+        serve(args)
+    else:
+        design(args)